@@ -6,11 +6,89 @@ Memcached Operator.
 Usage: memcached_operator.py [options] [--help]
 
 Periodic Check Options:
-  --periodic-check-interval N   Check every N seconds [default: 25].
+  --periodic-check-interval N   Resync every cluster at least every N
+                                seconds [default: 120].
+  --max-check-interval N        Stretch the interval up to N seconds for large
+                                fleets and a busy apiserver [default: 600].
+  --resync-rate N               Resync up to N clusters per second
+                                [default: 100].
+  --gc-budget N                 Check N clusters for garbage per interval
+                                [default: 1000].
 
 Event Listener Options:
   --event-listener-timeout N    Timeout after N seconds [default: 25].
 
+Scope Options:
+  --namespaces NAMESPACES       Only manage clusters in these comma separated
+                                namespaces, defaults to all namespaces.
+  --selector SELECTOR           Only manage clusters matching the label
+                                SELECTOR.
+
+Reconcile Options:
+  --workers N                   Reconcile N clusters in parallel [default: 4].
+  --child-concurrency N         Create, update and delete up to N services and
+                                deployments in parallel over all workers
+                                [default: 8].
+  --server-side-apply           Create and update resources using
+                                server-side apply.
+  --max-rolling N               Roll out template changes to at most N
+                                deployments at once [default: 10].
+  --state-file PATH             Keep the versions of written services and
+                                deployments in PATH across restarts.
+
+Coordination Options:
+  --shards                      Split clusters between all operator replicas
+                                running with this option.
+  --leader-elect                Only reconcile while holding the leader
+                                lease, other replicas stand by with warm
+                                caches.
+  --lease-namespace NAMESPACE   Keep Lease objects in NAMESPACE
+                                [default: kubestack].
+  --lease-duration N            Consider replicas gone after N seconds
+                                without renewing their lease [default: 15].
+  --identity NAME               Name this replica, defaults to the hostname.
+
+Connection Options:
+  --connection-pool-size N      Keep up to N apiserver connections open
+                                [default: 16].
+  --keep-alive N                Probe idle connections every N seconds
+                                [default: 30].
+  --qps N                       Send up to N requests per second to the
+                                apiserver [default: 50].
+  --burst N                     Allow bursts of up to N requests
+                                [default: 100].
+  --page-size N                 List up to N objects per request, 0 lists
+                                everything at once [default: 500].
+  --raw-json                    Decode services and deployments as plain
+                                JSON, caching only the fields the operator
+                                reads.
+
+Metrics Options:
+  --metrics-port N              Serve Prometheus metrics on port N
+                                [default: 9150].
+
+Tracing Options:
+  --trace-file PATH             Append traces of sampled reconciles to PATH
+                                as OpenTelemetry JSON lines.
+  --trace-sample-rate RATE      Trace this fraction of all reconciles
+                                [default: 0.01].
+  --trace-min-duration N        Only keep traces of reconciles taking at
+                                least N seconds [default: 0].
+  --trace-buffer N              Keep only the latest N traces in memory,
+                                written to the trace file on shutdown.
+
+Profiling Options:
+  --profile-dir DIR             Write profiles triggered by SIGUSR2 to DIR
+                                [default: /tmp].
+  --profile-seconds N           Sample stacks and allocations for N seconds
+                                [default: 30].
+  --profile-port N              Serve profiles on
+                                http://ADDR:N/debug/profile?seconds=N.
+  --profile-address ADDR        Bind the profile server to ADDR, it has no
+                                authentication [default: 127.0.0.1].
+  --tracemalloc                 Trace allocations from startup, so that
+                                profiles show all allocated memory.
+
 General Options:
   --loglevel LOGLEVEL           Desired loglevel [default: INFO].
   --version                     Show version.
@@ -18,64 +96,231 @@ General Options:
 
 """
 
+# Imported first, the time to the first reconcile is measured from here
+from memcached_operator.metrics import QUEUE_DEPTH
+
+import functools
 import logging
+import socket
 import threading
-from time import sleep
 from sys import exit
 
 from docopt import docopt
 from kubernetes import config
+from prometheus_client import start_http_server
 
-from memcached_operator.periodical import periodical_check
-from memcached_operator.events import event_listener
+from memcached_operator.plan import configure_executor
+from memcached_operator.periodical import (periodical_check,
+                                           check_existing,
+                                           PeriodicCheck)
+from memcached_operator.events import event_listener, child_event
+from memcached_operator.informers import get_informers, get_thread_name
+from memcached_operator.kubernetes_helpers import (configure_api_client,
+                                                   configure_page_size)
+from memcached_operator.reconciler import worker
+from memcached_operator.rollout import ROLLOUTS
+from memcached_operator.scope import SCOPE, parse_namespaces
+from memcached_operator.state import load_state, save_state
+from memcached_operator.tracing import TRACER
+from memcached_operator.workqueue import WorkQueue
 
 
 class MemcachedOperator(object):
 
     def __init__(self):
         self.shutting_down = threading.Event()
+        SCOPE.configure(
+            parse_namespaces(args['--namespaces']), args['--selector'])
+        self.queue = WorkQueue()
+        QUEUE_DEPTH.set_function(lambda: len(self.queue))
         config.load_incluster_config()
+        configure_api_client(
+            args['--connection-pool-size'],
+            args['--keep-alive'],
+            float(args['--qps']),
+            int(args['--burst']))
+        configure_page_size(args['--page-size'])
+        ROLLOUTS.configure(args['--max-rolling'])
+        configure_executor(args['--child-concurrency'])
+        if args['--state-file']:
+            load_state(args['--state-file'])
+        if args['--trace-file']:
+            TRACER.configure(
+                args['--trace-sample-rate'],
+                args['--trace-file'],
+                args['--trace-min-duration'],
+                args['--trace-buffer'])
+        self.setup_profiling()
 
+        self.periodic_check = PeriodicCheck(
+            args['--periodic-check-interval'],
+            args['--max-check-interval'],
+            args['--resync-rate'],
+            args['--gc-budget'],
+            args['--state-file'])
         self.periodic_check_thread = threading.Thread(
             name='PeriodicCheck',
             target=periodical_check,
             args=(
                 self.shutting_down,
-                args['--periodic-check-interval']))
+                self.periodic_check,
+                self.queue))
 
-        self.event_listener_thread = threading.Thread(
-            name='EventListener',
-            target=event_listener,
-            args=(
-                self.shutting_down,
-                args['--event-listener-timeout']))
+        self.event_listener_threads = []
+        for namespace in SCOPE.get_namespaces():
+            self.event_listener_threads.append(threading.Thread(
+                name=get_thread_name('EventListener', namespace),
+                target=event_listener,
+                args=(
+                    self.shutting_down,
+                    args['--event-listener-timeout'],
+                    self.queue,
+                    namespace)))
+
+        self.worker_threads = []
+        for i in range(int(args['--workers'])):
+            self.worker_threads.append(threading.Thread(
+                name='Worker-{}'.format(i),
+                target=worker,
+                args=(
+                    self.shutting_down,
+                    self.queue,
+                    args['--server-side-apply'])))
+
+        self.coordination_threads = []
+        identity = args['--identity'] or socket.gethostname()
+        if args['--shards']:
+            from memcached_operator.sharding import ShardMembership
+            shard_membership = ShardMembership(
+                identity,
+                args['--lease-namespace'],
+                args['--lease-duration'])
+            self.coordination_threads.append(threading.Thread(
+                name='ShardMembership',
+                target=shard_membership.run,
+                args=(
+                    self.shutting_down,
+                    self.queue,
+                    check_existing)))
+        if args['--leader-elect']:
+            from memcached_operator.leader_election import LeaderElection
+            leader_election = LeaderElection(
+                identity,
+                args['--lease-namespace'],
+                args['--lease-duration'])
+            self.coordination_threads.append(threading.Thread(
+                name='LeaderElection',
+                target=leader_election.run,
+                args=(
+                    self.shutting_down,
+                    self.queue,
+                    check_existing)))
+
+        self.informer_threads = []
+        # Children changed by someone else are repaired right away
+        handler = functools.partial(child_event, self.queue)
+        for name, informer in get_informers(
+                handler, args['--raw-json']).items():
+            self.informer_threads.append(threading.Thread(
+                name=name,
+                target=informer.run,
+                args=(
+                    self.shutting_down,
+                    args['--event-listener-timeout'])))
 
     def run(self):
-        try:
-            while True:
-                if not self.periodic_check_thread.ident:
-                    self.periodic_check_thread.start()
+        import signal
+        # Kubernetes stops pods with SIGTERM, not SIGINT. Neither raises
+        # KeyboardInterrupt, which could cut the shutdown short
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+        start_http_server(int(args['--metrics-port']))
+        while not self.shutting_down.isSet():
+            for informer_thread in self.informer_threads:
+                if not informer_thread.ident:
+                    informer_thread.start()
+
+            for coordination_thread in self.coordination_threads:
+                if not coordination_thread.ident:
+                    coordination_thread.start()
+
+            if not self.periodic_check_thread.ident:
+                self.periodic_check_thread.start()
+
+            for event_listener_thread in self.event_listener_threads:
+                if not event_listener_thread.ident:
+                    event_listener_thread.start()
+
+            for worker_thread in self.worker_threads:
+                if not worker_thread.ident:
+                    worker_thread.start()
+
+            self.shutting_down.wait(5)
+        self.stop_threads()
+
+    def stop(self, signum, frame):
+        logging.info('Received signal {}'.format(signum))
+        self.shutting_down.set()
+
+    def stop_threads(self):
+        logging.info('Stopping threads')
+        self.shutting_down.set()
+        self.queue.shut_down()
+        self.join_threads(
+            [self.periodic_check_thread] +
+            self.coordination_threads +
+            self.worker_threads)
+        # Watches wait for their stream to time out, save the state and
+        # traces first so that they are written within the termination
+        # grace period
+        self.dump_traces()
+        self.save_state()
+        self.join_threads(self.event_listener_threads + self.informer_threads)
+
+    def join_threads(self, threads):
+        for thread in threads:
+            # Threads not started yet when interrupted early
+            if thread.ident:
+                thread.join()
+
+    def setup_profiling(self):
+        import signal
+        signal.signal(signal.SIGUSR2, self.start_profiler)
+        if args['--profile-port']:
+            from memcached_operator.profiling import (PROFILER,
+                                                      start_profile_server)
+            PROFILER.configure(
+                args['--profile-dir'], args['--profile-seconds'])
+            start_profile_server(
+                args['--profile-port'], args['--profile-address'])
+
+    def start_profiler(self, signum, frame):
+        # Imported on first use, most operators are never profiled
+        from memcached_operator.profiling import PROFILER
+        PROFILER.configure(args['--profile-dir'], args['--profile-seconds'])
+        if not PROFILER.start():
+            logging.info('ignoring SIGUSR2, already profiling')
 
-                if not self.event_listener_thread.ident:
-                    self.event_listener_thread.start()
+    def save_state(self):
+        if args['--state-file']:
+            save_state(args['--state-file'])
 
-                sleep(5)
-        except KeyboardInterrupt:
-            logging.info('Stopping threads')
-            self.shutting_down.set()
-            self.periodic_check_thread.join()
-            self.event_listener_thread.join()
+    def dump_traces(self):
+        if args['--trace-file'] and args['--trace-buffer']:
+            TRACER.dump()
 
 
 if __name__ == '__main__':
     args = docopt(__doc__, version='Memcached Operator 0.1')
+    if args['--tracemalloc']:
+        import tracemalloc
+        from memcached_operator.profiling import TRACEMALLOC_FRAMES
+        tracemalloc.start(TRACEMALLOC_FRAMES)
 
     logging.basicConfig(
         level=getattr(logging, args['--loglevel'].upper()),
         format='%(asctime)s %(levelname)s %(threadName)s %(message)s')
-    # Suppress urllib3.connectionpool warnings that seem to come from the
-    # Python kubernetes client
-    logging.getLogger('urllib3.connectionpool').setLevel(logging.ERROR)
 
     try:
         memcached_operator = MemcachedOperator()
@@ -1,41 +1,102 @@
 import logging
 from time import sleep
 
-from kubernetes import watch
+from kubernetes import client, watch
+from urllib3.exceptions import HTTPError
 
-from .kubernetes_helpers import (list_cluster_memcached_object,
-                                 create_service,
-                                 update_service,
+from .kubernetes_helpers import (get_namespaced_memcached_object,
+                                 list_cluster_memcached_object,
+                                 list_pages,
                                  delete_service,
-                                 create_memcached_deployment,
-                                 update_memcached_deployment,
-                                 create_mcrouter_deployment,
-                                 update_mcrouter_deployment,
                                  delete_deployment)
-from .kubernetes_resources import (get_mcrouter_service_object,
-                                   get_memcached_service_object)
-
-
-def event_listener(shutting_down, timeout_seconds):
+from .informers import (MEMCACHED_STORE,
+                        get_resource_key,
+                        get_resource_metadata,
+                        get_watch_timeouts,
+                        is_expired)
+from .kubernetes_resources import get_owner_uid, is_generation_observed
+from .metrics import WATCH_EVENTS, WATCH_RECONNECTS, CHILD_DRIFT
+from .plan import Plan
+from .rollout import ROLLOUTS
+from .scope import SCOPE, get_list_kwargs
+from .sharding import SHARDS
+from .state import CHILD_VERSIONS
+from .workqueue import PRIORITY_URGENT, PRIORITY_DRIFTED, PRIORITY_RESYNC
+
+
+def event_listener(shutting_down, timeout_seconds, queue, namespace=None):
     logging.info('thread started')
-    event_watch = watch.Watch()
+    list_kwargs = get_list_kwargs(namespace, SCOPE.label_selector)
+    resource_version = None
+    watched = False
     while not shutting_down.isSet():
         try:
+            if not resource_version:
+                resource_version = sync_existing(queue, namespace)
+
+            if watched:
+                WATCH_RECONNECTS.labels('memcacheds').inc()
+            watched = True
+
+            watch_timeout, request_timeout = get_watch_timeouts(
+                timeout_seconds)
+            event_watch = watch.Watch()
             for event in event_watch.stream(
                     list_cluster_memcached_object,
-                    _request_timeout=timeout_seconds):
-
-                event_switch(event)
+                    resource_version=resource_version,
+                    allow_watch_bookmarks=True,
+                    timeout_seconds=watch_timeout,
+                    _request_timeout=request_timeout,
+                    **list_kwargs):
+                WATCH_EVENTS.labels('memcacheds', event['type']).inc()
+
+                if event['type'] == 'ERROR' and is_expired(event):
+                    logging.info('resource version {} expired'.format(
+                        resource_version))
+                    resource_version = None
+                    break
+
+                resource_version = event['raw_object']['metadata'][
+                    'resourceVersion']
+                if event['type'] != 'BOOKMARK':
+                    event_switch(event, queue)
+
+                if shutting_down.isSet():
+                    event_watch.stop()
+        except HTTPError as e:
+            # Watch request timed out or the connection was closed,
+            # resume from the last seen resourceVersion
+            logging.debug('watch interrupted: {}'.format(e))
         except Exception as e:
             # Last resort: catch all exceptions to keep the thread alive
             logging.exception(e)
             sleep(int(timeout_seconds))
     else:
-        event_watch.stop()
         logging.info('thread stopped')
 
 
-def event_switch(event):
+def sync_existing(queue, namespace=None):
+    # Queue clusters deleted or changed while we weren't watching first
+    priorities = dict(
+        (get_resource_key(c), PRIORITY_URGENT)
+        for c in MEMCACHED_STORE.list(namespace))
+
+    cluster_objects = []
+    for cluster_list in list_pages(
+            list_cluster_memcached_object,
+            **get_list_kwargs(namespace, SCOPE.label_selector)):
+        cluster_objects.extend(cluster_list['items'])
+        for cluster_object in cluster_list['items']:
+            priorities[get_resource_key(cluster_object)] = \
+                get_event_priority(cluster_object)
+    MEMCACHED_STORE.replace(cluster_objects, namespace)
+    for key in sorted(priorities):
+        queue.add(key, priorities[key])
+
+    return cluster_list['metadata']['resourceVersion']
+
+
+def event_switch(event, queue):
     if 'type' not in event and 'object' not in event:
         # We can't work with that event
         logging.warning('malformed event: {}'.format(event))
@@ -44,41 +105,105 @@ def event_switch(event):
     event_type = event['type']
     cluster_object = event['object']
 
-    if event_type == 'ADDED':
-        add(cluster_object)
-    elif event_type == 'MODIFIED':
-        modify(cluster_object)
+    if event_type == 'MODIFIED':
+        MEMCACHED_STORE.upsert(cluster_object)
+        priority = get_event_priority(cluster_object)
+    elif event_type == 'ADDED':
+        MEMCACHED_STORE.upsert(cluster_object)
+        priority = PRIORITY_URGENT
     elif event_type == 'DELETED':
-        delete(cluster_object)
+        MEMCACHED_STORE.delete(cluster_object)
+        priority = PRIORITY_URGENT
+    else:
+        return
 
+    # Workers reconcile the cluster from the store
+    queue.add(get_resource_key(cluster_object), priority)
 
-def add(cluster_object):
-    # Create services
-    create_service(get_mcrouter_service_object(cluster_object))
-    create_service(get_memcached_service_object(cluster_object))
 
-    # Create deployments
-    create_memcached_deployment(cluster_object)
-    create_mcrouter_deployment(cluster_object)
+def get_event_priority(cluster_object):
+    # Spec changes are visible to users, status updates like our own
+    # observedGeneration only need a routine check
+    if is_generation_observed(cluster_object):
+        return PRIORITY_RESYNC
+    return PRIORITY_URGENT
 
 
-def modify(cluster_object):
-    # Update services
-    update_service(get_mcrouter_service_object(cluster_object))
-    update_service(get_memcached_service_object(cluster_object))
+def child_event(queue, resource, event_type, child):
+    """Queue the cluster of a service or deployment someone else changed.
 
-    # Update deployments
-    update_memcached_deployment(cluster_object)
-    update_mcrouter_deployment(cluster_object)
+    Informers call this for every watch event of a child, so drift is
+    repaired right away instead of on the next periodic check.
+    """
+    if resource == 'deployments':
+        # Rollouts finish with status updates, which may free slots for
+        # deferred clusters
+        ROLLOUTS.requeue_deferred(queue)
+
+    name, namespace, labels, _ = get_resource_metadata(child)
+    if event_type == 'DELETED':
+        CHILD_VERSIONS.forget(resource, name, namespace)
+    elif (event_type != 'MODIFIED' or
+            not CHILD_VERSIONS.is_modified(resource, child)):
+        # Our own writes and status updates
+        return
+
+    cluster = labels.get('cluster')
+    if cluster is None or MEMCACHED_STORE.get(cluster, namespace) is None:
+        # Children of deleted clusters are collected by the garbage check
+        return
+
+    key = '{}/{}'.format(namespace, cluster)
+    if not SHARDS.owns(key):
+        return
+    if event_type == 'DELETED' and not is_owner_alive(
+            cluster, namespace, get_owner_uid(child)):
+        return
+
+    CHILD_DRIFT.labels(resource, event_type).inc()
+    logging.info('{} {} of {} {} by someone else'.format(
+        resource, name, key, event_type.lower()))
+    if event_type == 'DELETED':
+        queue.add(key, PRIORITY_URGENT)
+    else:
+        queue.add(key, PRIORITY_DRIFTED)
+
+
+def is_owner_alive(name, namespace, owner_uid=None):
+    """Ask the apiserver if the cluster of a deleted child still exists.
+
+    The garbage collector deletes the children of a deleted cluster, their
+    events may arrive before the event listener sees the cluster go. Those
+    children must not be recreated, neither for a cluster that was
+    recreated under the same name since.
+    """
+    try:
+        cluster_object = get_namespaced_memcached_object(name, namespace)
+    except client.rest.ApiException as e:
+        if e.status != 404:
+            # The periodic check repairs the child if it has to
+            logging.exception(e)
+        return False
+
+    metadata = cluster_object['metadata']
+    if metadata.get('deletionTimestamp'):
+        return False
+    return owner_uid is None or owner_uid == metadata.get('uid')
 
 
 def delete(cluster_object):
     name = cluster_object['metadata']['name']
     namespace = cluster_object['metadata']['namespace']
-    # Delete service
-    delete_service(name, namespace)
-    delete_service('{}-backend'.format(name), namespace)
-
-    # Delete deployments, replicasets and pods
-    delete_deployment(name, namespace)
-    delete_deployment('{}-router'.format(name), namespace)
+    plan = Plan()
+    # Delete deployments, replicasets and pods. mcrouter goes before the
+    # backend service it resolves memcached through
+    plan.add('deploy/{}'.format(name), delete_deployment, name, namespace)
+    plan.add('deploy/{}-router'.format(name),
+             delete_deployment, '{}-router'.format(name), namespace)
+
+    # Delete services
+    plan.add('svc/{}'.format(name), delete_service, name, namespace)
+    plan.add('svc/{}-backend'.format(name),
+             delete_service, '{}-backend'.format(name), namespace,
+             after=['deploy/{}-router'.format(name)])
+    return all(plan.run().values())
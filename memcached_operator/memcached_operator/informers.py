@@ -0,0 +1,346 @@
+import logging
+import threading
+from time import sleep
+
+from kubernetes import client, watch
+from urllib3.exceptions import HTTPError
+
+from .kubernetes_helpers import (list_cluster_deployment_dict,
+                                 list_cluster_deployment_object,
+                                 list_cluster_service_dict,
+                                 list_cluster_service_object,
+                                 list_pages)
+from .metrics import WATCH_EVENTS, WATCH_RECONNECTS
+from .scope import SCOPE, get_list_kwargs
+
+
+# Fields of raw children the operator reads, everything else is dropped
+SLIM_METADATA = ('name', 'namespace', 'uid', 'resourceVersion', 'generation',
+                 'labels', 'annotations', 'ownerReferences')
+SLIM_SPEC = ('replicas',)
+SLIM_STATUS = ('observedGeneration', 'replicas', 'updatedReplicas',
+               'availableReplicas')
+
+# Seconds the client waits for a watch beyond its server side timeout, so
+# the server ends the watch cleanly instead of the read timing out first
+WATCH_TIMEOUT_MARGIN = 5
+
+
+def get_watch_timeouts(timeout_seconds):
+    """Server side and client read timeout of a watch in seconds."""
+    timeout_seconds = int(timeout_seconds)
+    return timeout_seconds, timeout_seconds + WATCH_TIMEOUT_MARGIN
+
+
+def get_resource_metadata(resource):
+    # Memcached objects are plain dicts, services and deployments are
+    # kubernetes client models
+    if isinstance(resource, dict):
+        metadata = resource['metadata']
+        return (metadata['name'],
+                metadata['namespace'],
+                metadata.get('labels') or {},
+                metadata.get('resourceVersion'))
+
+    metadata = resource.metadata
+    return (metadata.name,
+            metadata.namespace,
+            metadata.labels or {},
+            metadata.resource_version)
+
+
+def get_resource_key(resource):
+    name, namespace, _, _ = get_resource_metadata(resource)
+    return '{}/{}'.format(namespace, name)
+
+
+def split_resource_key(key):
+    namespace, name = key.split('/', 1)
+    return name, namespace
+
+
+def get_list_resource_version(resource_list):
+    if isinstance(resource_list, dict):
+        return resource_list['metadata']['resourceVersion']
+    return resource_list.metadata.resource_version
+
+
+def is_expired(event):
+    """Check a watch ERROR event, raise unless it is a 410 Gone."""
+    status = event['raw_object']
+    if status.get('code') == 410:
+        return True
+    raise client.rest.ApiException(
+        status=status.get('code'), reason=status.get('message'))
+
+
+def get_list_items(resource_list):
+    if isinstance(resource_list, dict):
+        return resource_list['items']
+    return resource_list.items
+
+
+def slim_resource(resource):
+    """Return a raw child reduced to the fields the operator reads.
+
+    Cached specs and statuses of services and deployments make up most
+    of the operator's memory, only what ownership, drift and rollout
+    checks need is kept.
+    """
+    slim = {'metadata': {}}
+    for section, keys in (('metadata', SLIM_METADATA),
+                          ('spec', SLIM_SPEC),
+                          ('status', SLIM_STATUS)):
+        values = resource.get(section) or {}
+        kept = {key: values[key] for key in keys if key in values}
+        if kept or section == 'metadata':
+            slim[section] = kept
+    return slim
+
+
+class Store(object):
+    """Thread safe local copy of a list of kubernetes resources.
+
+    Resources are indexed by (namespace, name) and by the value of their
+    `cluster` label, so that the children of a Memcached object can be
+    found without asking the apiserver.
+
+    Informers scoped to a namespace only replace that namespace, the
+    store is synced once all namespaces in scope were listed.
+    """
+
+    def __init__(self):
+        self.synced = threading.Event()
+        self._lock = threading.Lock()
+        self._resources = {}
+        self._cluster_index = {}
+        self._synced_namespaces = set()
+
+    def replace(self, resources, namespace=None):
+        with self._lock:
+            if namespace is None:
+                self._resources = {}
+                self._cluster_index = {}
+            else:
+                for key, resource in list(self._resources.items()):
+                    if key[0] == namespace:
+                        self._remove(resource)
+            for resource in resources:
+                self._add(resource)
+            self._synced_namespaces.add(namespace)
+            synced = (namespace is None or
+                      self._synced_namespaces.issuperset(
+                          SCOPE.get_namespaces()))
+        if synced:
+            self.synced.set()
+
+    def upsert(self, resource):
+        with self._lock:
+            self._remove(resource)
+            self._add(resource)
+
+    def delete(self, resource):
+        with self._lock:
+            self._remove(resource)
+
+    def get(self, name, namespace):
+        with self._lock:
+            return self._resources.get((namespace, name))
+
+    def list(self, namespace=None):
+        with self._lock:
+            if namespace is None:
+                return list(self._resources.values())
+            return [resource for key, resource in self._resources.items()
+                    if key[0] == namespace]
+
+    def list_by_cluster(self, cluster, namespace):
+        with self._lock:
+            keys = self._cluster_index.get((namespace, cluster), ())
+            return [self._resources[key] for key in keys]
+
+    def list_cluster_keys(self):
+        with self._lock:
+            return ['{}/{}'.format(namespace, cluster)
+                    for namespace, cluster in self._cluster_index]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._resources)
+
+    def _add(self, resource):
+        name, namespace, labels, _ = get_resource_metadata(resource)
+        key = (namespace, name)
+        self._resources[key] = resource
+        if 'cluster' in labels:
+            cluster_key = (namespace, labels['cluster'])
+            self._cluster_index.setdefault(cluster_key, set()).add(key)
+
+    def _remove(self, resource):
+        name, namespace, _, _ = get_resource_metadata(resource)
+        key = (namespace, name)
+        existing = self._resources.pop(key, None)
+        if existing is None:
+            return
+        _, _, labels, _ = get_resource_metadata(existing)
+        if 'cluster' in labels:
+            cluster_key = (namespace, labels['cluster'])
+            cluster_keys = self._cluster_index.get(cluster_key, set())
+            cluster_keys.discard(key)
+            if not cluster_keys:
+                self._cluster_index.pop(cluster_key, None)
+
+
+MEMCACHED_STORE = Store()
+SERVICE_STORE = Store()
+DEPLOYMENT_STORE = Store()
+
+
+def caches_synced():
+    return all(store.synced.isSet() for store in (
+        MEMCACHED_STORE, SERVICE_STORE, DEPLOYMENT_STORE))
+
+
+class Informer(object):
+    """Keep a Store in sync with the apiserver using list and watch.
+
+    The store is filled from a full list once and then kept up to date
+    by watching from the list's resourceVersion. Watches that time out
+    are resumed from the last seen resourceVersion, only errors and
+    expired versions (410 Gone) cause a relist.
+
+    The optional handler is called with the resource name, event type
+    and object of every watch event once the store was updated. The
+    optional transform is applied to every object before it is stored.
+    """
+
+    def __init__(self, store, list_func, return_type=None, resource='',
+                 namespace=None, handler=None, transform=None):
+        self.store = store
+        self.list_func = list_func
+        self.return_type = return_type
+        self.resource = resource
+        self.namespace = namespace
+        self.handler = handler
+        self.transform = transform
+        self.resource_version = None
+
+    def run(self, shutting_down, timeout_seconds):
+        logging.info('thread started')
+        watched = False
+        while not shutting_down.isSet():
+            try:
+                if not self.resource_version:
+                    self.relist()
+                if watched:
+                    WATCH_RECONNECTS.labels(self.resource).inc()
+                watched = True
+                self.watch(shutting_down, timeout_seconds)
+            except HTTPError as e:
+                # Watch request timed out or the connection was closed,
+                # resume from the last seen resourceVersion
+                logging.debug('watch interrupted: {}'.format(e))
+            except Exception as e:
+                # Last resort: catch all exceptions to keep the thread alive
+                logging.exception(e)
+                self.resource_version = None
+                sleep(int(timeout_seconds))
+        else:
+            logging.info('thread stopped')
+
+    def relist(self):
+        resources = []
+        for resource_list in list_pages(
+                self.list_func, **get_list_kwargs(self.namespace)):
+            # Transform each page, so only slim objects are kept around
+            if self.transform is None:
+                resources.extend(get_list_items(resource_list))
+            else:
+                resources.extend(self.transform(resource) for resource in
+                                 get_list_items(resource_list))
+        self.store.replace(resources, self.namespace)
+        self.resource_version = get_list_resource_version(resource_list)
+
+    def watch(self, shutting_down, timeout_seconds):
+        timeout_seconds, request_timeout = get_watch_timeouts(timeout_seconds)
+        resource_watch = watch.Watch(return_type=self.return_type)
+        for event in resource_watch.stream(
+                self.list_func,
+                resource_version=self.resource_version,
+                timeout_seconds=timeout_seconds,
+                _request_timeout=request_timeout,
+                **get_list_kwargs(self.namespace)):
+            WATCH_EVENTS.labels(self.resource, event['type']).inc()
+
+            if event['type'] == 'ERROR' and is_expired(event):
+                # Our resourceVersion is too old, we need to relist
+                logging.info('resource version {} expired'.format(
+                    self.resource_version))
+                self.resource_version = None
+                break
+
+            if event['type'] == 'BOOKMARK':
+                # Bookmarks only carry the latest resourceVersion
+                self.resource_version = event['raw_object']['metadata'][
+                    'resourceVersion']
+                continue
+
+            resource = event['object']
+            if self.transform is not None:
+                resource = self.transform(resource)
+            if event['type'] == 'DELETED':
+                self.store.delete(resource)
+            else:
+                self.store.upsert(resource)
+            self.resource_version = get_resource_metadata(resource)[3]
+            if self.handler is not None:
+                self.handler(self.resource, event['type'], resource)
+
+            if shutting_down.isSet():
+                break
+
+        resource_watch.stop()
+
+
+def get_thread_name(name, namespace=None):
+    if namespace is None:
+        return name
+    return '{}-{}'.format(name, namespace)
+
+
+def get_informers(handler=None, raw=False):
+    # MEMCACHED_STORE is kept up to date by the event listener. Children
+    # carry no labels of their Memcached object, they are only scoped by
+    # namespace.
+    # Raw informers decode children as plain dicts and keep only the
+    # fields we read instead of building kubernetes client models
+    if raw:
+        list_service, service_type = list_cluster_service_dict, None
+        list_deployment, deployment_type = list_cluster_deployment_dict, None
+        transform = slim_resource
+    else:
+        list_service, service_type = list_cluster_service_object, 'V1Service'
+        list_deployment, deployment_type = (list_cluster_deployment_object,
+                                            'V1Deployment')
+        transform = None
+
+    informers = {}
+    for namespace in SCOPE.get_namespaces():
+        informers[get_thread_name('ServiceInformer', namespace)] = Informer(
+            SERVICE_STORE,
+            list_service,
+            return_type=service_type,
+            resource='services',
+            namespace=namespace,
+            handler=handler,
+            transform=transform)
+        informers[get_thread_name('DeploymentInformer', namespace)] = \
+            Informer(
+                DEPLOYMENT_STORE,
+                list_deployment,
+                return_type=deployment_type,
+                resource='deployments',
+                namespace=namespace,
+                handler=handler,
+                transform=transform)
+    return informers
@@ -1,25 +1,172 @@
+import json
 import logging
+import socket
+import threading
 from time import sleep
 
 from kubernetes import client
+from urllib3.connection import HTTPConnection
 
+from .metrics import (CONNECTION_POOL_IN_USE,
+                      CONNECTION_POOL_SIZE,
+                      instrument_rest_client)
+from .ratelimit import TokenBucket, limit_rest_client
 from .kubernetes_resources import (get_default_label_selector,
                                    get_memcached_deployment_object,
                                    get_mcrouter_deployment_object)
 
 
-def list_cluster_memcached_object(**kwargs):
-    custom_object_api = client.CustomObjectsApi()
-    cluster_list = custom_object_api.list_cluster_custom_object(
-        'kubestack.com',
-        'v1',
-        'memcacheds',
-        **kwargs)
-    return cluster_list
+FIELD_MANAGER = 'memcached-operator'
+
+API_CLIENT = None
+API_CLIENT_LOCK = threading.Lock()
+
+# Objects per page of list calls, the kubectl default
+PAGE_SIZE = 500
+
+LIST_QUERY_PARAMS = {
+    '_continue': 'continue',
+    'allow_watch_bookmarks': 'allowWatchBookmarks',
+    'label_selector': 'labelSelector',
+    'limit': 'limit',
+    'resource_version': 'resourceVersion',
+    'timeout_seconds': 'timeoutSeconds',
+    'watch': 'watch'}
+
+
+def configure_api_client(pool_size=None, keep_alive=None, qps=None,
+                         burst=None):
+    """Create the ApiClient shared by all helpers.
+
+    Every ApiClient has its own connection pool, sharing one lets
+    requests reuse connections to the apiserver. The pool should be
+    larger than the number of threads talking to the apiserver.
+
+    With qps all requests but watches share one token bucket.
+    """
+    global API_CLIENT
+    configuration = client.Configuration()
+    if pool_size:
+        configuration.connection_pool_maxsize = int(pool_size)
+    api_client = client.ApiClient(configuration)
+    instrument_rest_client(api_client.rest_client)
+    if qps:
+        # Outside the instrumentation, so that retried 429s are counted
+        limit_rest_client(api_client.rest_client, TokenBucket(qps, burst))
+
+    if keep_alive:
+        # Detect connections the apiserver or a load balancer dropped
+        socket_options = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            socket_options += [
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(keep_alive)),
+                (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(keep_alive))]
+        api_client.rest_client.pool_manager.connection_pool_kw[
+            'socket_options'] = socket_options
+
+    with API_CLIENT_LOCK:
+        API_CLIENT = api_client
+    return api_client
+
+
+def get_api_client():
+    global API_CLIENT
+    with API_CLIENT_LOCK:
+        if API_CLIENT is None:
+            API_CLIENT = client.ApiClient()
+            instrument_rest_client(API_CLIENT.rest_client)
+        return API_CLIENT
+
+
+def get_connection_pool_usage():
+    """Return connections in use and the pool size over all hosts."""
+    pool_manager = get_api_client().rest_client.pool_manager
+    in_use = 0
+    size = 0
+    for key in pool_manager.pools.keys():
+        connection_pool = pool_manager.pools.get(key)
+        if connection_pool is None or connection_pool.pool is None:
+            continue
+        in_use += connection_pool.pool.maxsize - connection_pool.pool.qsize()
+        size += connection_pool.pool.maxsize
+    return in_use, size
+
+
+CONNECTION_POOL_IN_USE.set_function(lambda: get_connection_pool_usage()[0])
+CONNECTION_POOL_SIZE.set_function(lambda: get_connection_pool_usage()[1])
+
+
+def configure_page_size(page_size):
+    global PAGE_SIZE
+    PAGE_SIZE = int(page_size)
+
+
+def get_list_continue(resource_list):
+    if isinstance(resource_list, dict):
+        return resource_list['metadata'].get('continue')
+    return resource_list.metadata._continue
+
+
+def list_pages(list_func, **kwargs):
+    """Call list_func until the last page, yield one page at a time.
+
+    The next page is requested only once the caller is done with the
+    current one, so a large fleet is never held in one response. All
+    pages are of the resourceVersion of the first one.
+    """
+    kwargs.setdefault('limit', PAGE_SIZE or None)
+    while True:
+        resource_list = list_func(**kwargs)
+        yield resource_list
+        # Generated list methods send a None continue token as "None"
+        kwargs['_continue'] = get_list_continue(resource_list)
+        if not kwargs['_continue']:
+            break
+
+
+def list_object(path, **kwargs):
+    """List the resources at path as plain dicts.
+
+    Lists are decoded with `json.loads` only, without building kubernetes
+    client models. Watches stream the undecoded response.
+    """
+    query_params = []
+    for key in sorted(LIST_QUERY_PARAMS):
+        if kwargs.get(key) is None:
+            continue
+        value = kwargs[key]
+        if isinstance(value, bool):
+            value = str(value).lower()
+        query_params.append((LIST_QUERY_PARAMS[key], value))
+
+    api_client = get_api_client()
+    resource_list = api_client.call_api(
+        path,
+        'GET',
+        query_params=query_params,
+        header_params={'Accept': 'application/json'},
+        response_type='object',
+        auth_settings=['BearerToken'],
+        _return_http_data_only=True,
+        _preload_content=kwargs.get('_preload_content', True),
+        _request_timeout=kwargs.get('_request_timeout'))
+    return resource_list
+
+
+def list_cluster_memcached_object(namespace=None, **kwargs):
+    # CustomObjectsApi.list_cluster_custom_object rejects list parameters
+    # like limit, timeoutSeconds and allowWatchBookmarks, so we build the
+    # request ourselves
+    path = '/apis/kubestack.com/v1/memcacheds'
+    if namespace is not None:
+        path = '/apis/kubestack.com/v1/namespaces/{}/memcacheds'.format(
+            namespace)
+    return list_object(path, **kwargs)
 
 
 def get_namespaced_memcached_object(name, namespace):
-    custom_object_api = client.CustomObjectsApi()
+    custom_object_api = client.CustomObjectsApi(get_api_client())
     cluster = custom_object_api.get_namespaced_custom_object(
         'kubestack.com',
         'v1',
@@ -28,10 +175,128 @@ def get_namespaced_memcached_object(name, namespace):
         name)
     return cluster
 
+
+def update_memcached_status(name, namespace, status):
+    # Writes through the status subresource don't bump the generation
+    custom_object_api = client.CustomObjectsApi(get_api_client())
+    try:
+        cluster = custom_object_api.patch_namespaced_custom_object_status(
+            'kubestack.com',
+            'v1',
+            namespace,
+            'memcacheds',
+            name,
+            {'status': status})
+    except client.rest.ApiException as e:
+        logging.exception(e)
+        return False
+    else:
+        logging.debug('updated status of memcached/{} in ns/{}'.format(
+            name, namespace))
+        return cluster
+
+
+def list_cluster_service_object(namespace=None, **kwargs):
+    v1 = client.CoreV1Api(get_api_client())
+    if namespace is not None:
+        return v1.list_namespaced_service(
+            namespace,
+            label_selector=get_default_label_selector(),
+            **kwargs)
+
+    service_list = v1.list_service_for_all_namespaces(
+        label_selector=get_default_label_selector(),
+        **kwargs)
+    return service_list
+
+
+def list_cluster_deployment_object(namespace=None, **kwargs):
+    apps_api = client.AppsV1Api(get_api_client())
+    if namespace is not None:
+        return apps_api.list_namespaced_deployment(
+            namespace,
+            label_selector=get_default_label_selector(),
+            **kwargs)
+
+    deployment_list = apps_api.list_deployment_for_all_namespaces(
+        label_selector=get_default_label_selector(),
+        **kwargs)
+    return deployment_list
+
+
+def list_cluster_service_dict(namespace=None, **kwargs):
+    path = '/api/v1/services'
+    if namespace is not None:
+        path = '/api/v1/namespaces/{}/services'.format(namespace)
+    return list_object(
+        path, label_selector=get_default_label_selector(), **kwargs)
+
+
+def list_cluster_deployment_dict(namespace=None, **kwargs):
+    path = '/apis/apps/v1/deployments'
+    if namespace is not None:
+        path = '/apis/apps/v1/namespaces/{}/deployments'.format(
+            namespace)
+    return list_object(
+        path, label_selector=get_default_label_selector(), **kwargs)
+
+
+def apply_object(path, body, response_type):
+    api_client = get_api_client()
+    # The client only serializes bodies for JSON content types, JSON is
+    # valid YAML though so we send the apply patch as a string
+    body = json.dumps(api_client.sanitize_for_serialization(body))
+    resource = api_client.call_api(
+        path,
+        'PATCH',
+        query_params=[('fieldManager', FIELD_MANAGER), ('force', 'true')],
+        header_params={
+            'Accept': 'application/json',
+            'Content-Type': 'application/apply-patch+yaml'},
+        body=body,
+        response_type=response_type,
+        auth_settings=['BearerToken'],
+        _return_http_data_only=True)
+    return resource
+
+
+def apply_service(service_object):
+    name = service_object['metadata']['name']
+    namespace = service_object['metadata']['namespace']
+    try:
+        service = apply_object(
+            '/api/v1/namespaces/{}/services/{}'.format(namespace, name),
+            service_object,
+            'V1Service')
+    except client.rest.ApiException as e:
+        logging.exception(e)
+        return False
+    else:
+        logging.info('applied svc/{} in ns/{}'.format(name, namespace))
+        return service
+
+
+def apply_deployment(deployment_object):
+    name = deployment_object['metadata']['name']
+    namespace = deployment_object['metadata']['namespace']
+    try:
+        deployment = apply_object(
+            '/apis/apps/v1/namespaces/{}/deployments/{}'.format(
+                namespace, name),
+            deployment_object,
+            'V1Deployment')
+    except client.rest.ApiException as e:
+        logging.exception(e)
+        return False
+    else:
+        logging.info('applied deploy/{} in ns/{}'.format(name, namespace))
+        return deployment
+
+
 def create_service(service_object):
-    name = service_object.metadata.name
-    namespace = service_object.metadata.namespace
-    v1 = client.CoreV1Api()
+    name = service_object['metadata']['name']
+    namespace = service_object['metadata']['namespace']
+    v1 = client.CoreV1Api(get_api_client())
     try:
         service = v1.create_namespaced_service(namespace, service_object)
     except client.rest.ApiException as e:
@@ -48,9 +313,9 @@ def create_service(service_object):
 
 
 def update_service(service_object):
-    name = service_object.metadata.name
-    namespace = service_object.metadata.namespace
-    v1 = client.CoreV1Api()
+    name = service_object['metadata']['name']
+    namespace = service_object['metadata']['namespace']
+    v1 = client.CoreV1Api(get_api_client())
     try:
         service = v1.patch_namespaced_service(name, namespace, service_object)
     except client.rest.ApiException as e:
@@ -62,14 +327,22 @@ def update_service(service_object):
 
 
 def delete_service(name, namespace, delete_options=None):
-    v1 = client.CoreV1Api()
+    v1 = client.CoreV1Api(get_api_client())
     if not delete_options:
         delete_options = client.V1DeleteOptions()
     try:
         v1.delete_namespaced_service(name, namespace, delete_options)
     except client.rest.ApiException as e:
-        logging.exception(e)
-        return False
+        if e.status == 404:
+            # Service does not exist, nothing to delete but
+            # we can consider this a success.
+            logging.debug(
+                'not deleting nonexistent svc/{} from ns/{}'.format(
+                    name, namespace))
+            return True
+        else:
+            logging.exception(e)
+            return False
     else:
         logging.info('deleted svc/{} from ns/{}'.format(name, namespace))
         return True
@@ -78,7 +351,7 @@ def delete_service(name, namespace, delete_options=None):
 def create_memcached_deployment(cluster_object):
     name = cluster_object['metadata']['name']
     namespace = cluster_object['metadata']['namespace']
-    apps_api = client.AppsV1beta1Api()
+    apps_api = client.AppsV1Api(get_api_client())
     body = get_memcached_deployment_object(cluster_object)
     try:
         deployment = apps_api.create_namespaced_deployment(namespace, body)
@@ -98,7 +371,7 @@ def create_memcached_deployment(cluster_object):
 def create_mcrouter_deployment(cluster_object):
     name = '{}-router'.format(cluster_object['metadata']['name'])
     namespace = cluster_object['metadata']['namespace']
-    apps_api = client.AppsV1beta1Api()
+    apps_api = client.AppsV1Api(get_api_client())
     body = get_mcrouter_deployment_object(cluster_object)
     try:
         deployment = apps_api.create_namespaced_deployment(namespace, body)
@@ -118,7 +391,7 @@ def create_mcrouter_deployment(cluster_object):
 def update_memcached_deployment(cluster_object):
     name = cluster_object['metadata']['name']
     namespace = cluster_object['metadata']['namespace']
-    apps_api = client.AppsV1beta1Api()
+    apps_api = client.AppsV1Api(get_api_client())
     body = get_memcached_deployment_object(cluster_object)
     try:
         deployment = apps_api.patch_namespaced_deployment(
@@ -134,7 +407,7 @@ def update_memcached_deployment(cluster_object):
 def update_mcrouter_deployment(cluster_object):
     name = '{}-router'.format(cluster_object['metadata']['name'])
     namespace = cluster_object['metadata']['namespace']
-    apps_api = client.AppsV1beta1Api()
+    apps_api = client.AppsV1Api(get_api_client())
     body = get_mcrouter_deployment_object(cluster_object)
     try:
         deployment = apps_api.patch_namespaced_deployment(
@@ -148,7 +421,7 @@ def update_mcrouter_deployment(cluster_object):
 
 
 def delete_deployment(name, namespace, delete_options=None):
-    apps_api = client.AppsV1beta1Api()
+    apps_api = client.AppsV1Api(get_api_client())
     if not delete_options:
         delete_options = client.V1DeleteOptions(
             propagation_policy='Background')
@@ -170,3 +443,78 @@ def delete_deployment(name, namespace, delete_options=None):
         logging.info('deleted deploy/{} from ns/{}'.format(
             name, namespace))
         return True
+
+
+def list_lease_object(namespace, label_selector):
+    coordination_api = client.CoordinationV1beta1Api(get_api_client())
+    lease_list = coordination_api.list_namespaced_lease(
+        namespace, label_selector=label_selector)
+    return lease_list
+
+
+def read_lease(name, namespace):
+    coordination_api = client.CoordinationV1beta1Api(get_api_client())
+    try:
+        return coordination_api.read_namespaced_lease(name, namespace)
+    except client.rest.ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+
+
+def renew_lease(lease_object):
+    """Patch the lease's spec, create it if it doesn't exist yet.
+
+    With a resourceVersion in the lease's metadata the patch only applies
+    if nobody else changed the lease since.
+    """
+    name = lease_object['metadata']['name']
+    namespace = lease_object['metadata']['namespace']
+    body = {'spec': lease_object['spec']}
+    resource_version = lease_object['metadata'].get('resourceVersion')
+    if resource_version:
+        body['metadata'] = {'resourceVersion': resource_version}
+    coordination_api = client.CoordinationV1beta1Api(get_api_client())
+    try:
+        lease = coordination_api.patch_namespaced_lease(
+            name, namespace, body)
+    except client.rest.ApiException as e:
+        if e.status == 409:
+            logging.info('lease/{} in ns/{} was changed concurrently'.format(
+                name, namespace))
+            return False
+        if e.status != 404:
+            logging.exception(e)
+            return False
+    else:
+        logging.debug('renewed lease/{} in ns/{}'.format(name, namespace))
+        return lease
+
+    try:
+        lease = coordination_api.create_namespaced_lease(
+            namespace, lease_object)
+    except client.rest.ApiException as e:
+        if e.status == 409:
+            logging.info('lease/{} in ns/{} was created concurrently'.format(
+                name, namespace))
+            return False
+        logging.exception(e)
+        return False
+    else:
+        logging.info('created lease/{} in ns/{}'.format(name, namespace))
+        return lease
+
+
+def delete_lease(name, namespace):
+    coordination_api = client.CoordinationV1beta1Api(get_api_client())
+    try:
+        coordination_api.delete_namespaced_lease(
+            name, namespace, client.V1DeleteOptions())
+    except client.rest.ApiException as e:
+        if e.status == 404:
+            return True
+        logging.exception(e)
+        return False
+    else:
+        logging.info('deleted lease/{} in ns/{}'.format(name, namespace))
+        return True
@@ -1,6 +1,16 @@
+import functools
+import hashlib
 import json
+from datetime import datetime, timezone
 
-from kubernetes import client
+from .metrics import RENDER_CACHE_REQUESTS
+from .tracing import TRACER
+
+
+DESIRED_STATE_HASH_ANNOTATION = \
+    'memcached.operator.kubestack.com/desired-state-hash'
+POD_TEMPLATE_HASH_ANNOTATION = \
+    'memcached.operator.kubestack.com/pod-template-hash'
 
 
 def get_default_labels(name=None):
@@ -21,231 +31,394 @@ def get_default_label_selector(name=None):
     return ','.join(default_label_selectors)
 
 
-def get_mcrouter_service_object(cluster_object):
-    name = cluster_object['metadata']['name']
-    namespace = cluster_object['metadata']['namespace']
-    service = client.V1Service()
-
-    # Metadata
-    service.metadata = client.V1ObjectMeta(
-        name=name,
-        namespace=namespace,
-        labels=get_default_labels(name=name))
+class ClusterSpec(object):
+    """The parts of a Memcached object its resources are rendered from.
+
+    Specs compare and hash by value, so rendered resources can be
+    memoized per spec.
+    """
+
+    __slots__ = ('name', 'namespace', 'uid',
+                 'memcached_replicas',
+                 'memcached_limit_cpu',
+                 'memcached_limit_memory',
+                 'mcrouter_replicas',
+                 'mcrouter_limit_cpu',
+                 'mcrouter_limit_memory')
+
+    def __init__(self, name, namespace, uid=None,
+                 memcached_replicas=2,
+                 memcached_limit_cpu='100m',
+                 memcached_limit_memory='64Mi',
+                 mcrouter_replicas=1,
+                 mcrouter_limit_cpu='50m',
+                 mcrouter_limit_memory='32Mi'):
+        self.name = name
+        self.namespace = namespace
+        self.uid = uid
+        self.memcached_replicas = memcached_replicas
+        self.memcached_limit_cpu = memcached_limit_cpu
+        self.memcached_limit_memory = memcached_limit_memory
+        self.mcrouter_replicas = mcrouter_replicas
+        self.mcrouter_limit_cpu = mcrouter_limit_cpu
+        self.mcrouter_limit_memory = mcrouter_limit_memory
+
+    def _values(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        return (isinstance(other, ClusterSpec) and
+                self._values() == other._values())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._values())
+
+
+def get_replicas(component, default):
+    # Autoscaled deployments get their replicas from someone else, e.g. a
+    # HorizontalPodAutoscaler, and must not be scaled back
+    if component.get('autoscaled'):
+        return None
+    return component.get('replicas', default)
+
+
+def parse_cluster_spec(cluster_object):
+    metadata = cluster_object['metadata']
+    spec = cluster_object.get('spec') or {}
+    memcached = spec.get('memcached') or {}
+    mcrouter = spec.get('mcrouter') or {}
+    return ClusterSpec(
+        metadata['name'],
+        metadata['namespace'],
+        uid=metadata.get('uid'),
+        memcached_replicas=get_replicas(memcached, 2),
+        memcached_limit_cpu=memcached.get('memcached_limit_cpu', '100m'),
+        memcached_limit_memory=memcached.get(
+            'memcached_limit_memory', '64Mi'),
+        mcrouter_replicas=get_replicas(mcrouter, 1),
+        mcrouter_limit_cpu=mcrouter.get('mcrouter_limit_cpu', '50m'),
+        mcrouter_limit_memory=mcrouter.get('mcrouter_limit_memory', '32Mi'))
+
+
+def get_owner_references(spec):
+    if not spec.uid:
+        return None
+    # Let the kubernetes garbage collector delete children with the cluster
+    return [{
+        'apiVersion': 'kubestack.com/v1',
+        'kind': 'Memcached',
+        'name': spec.name,
+        'uid': spec.uid,
+        'controller': True,
+        'blockOwnerDeletion': True}]
+
+
+def is_owned(resource):
+    # Rendered resources are dicts, cached children are client models
+    if isinstance(resource, dict):
+        owner_references = resource['metadata'].get('ownerReferences') or []
+        for owner_reference in owner_references:
+            if (owner_reference.get('controller') and
+                    owner_reference.get('kind') == 'Memcached'):
+                return True
+        return False
+
+    for owner_reference in resource.metadata.owner_references or []:
+        if owner_reference.controller and owner_reference.kind == 'Memcached':
+            return True
+    return False
+
+
+def get_owner_uid(resource):
+    """Return the uid of the cluster controlling resource, if any."""
+    if isinstance(resource, dict):
+        owner_references = resource['metadata'].get('ownerReferences') or []
+        for owner_reference in owner_references:
+            if (owner_reference.get('controller') and
+                    owner_reference.get('kind') == 'Memcached'):
+                return owner_reference.get('uid')
+        return None
+
+    for owner_reference in resource.metadata.owner_references or []:
+        if owner_reference.controller and owner_reference.kind == 'Memcached':
+            return owner_reference.uid
+    return None
+
+
+def get_annotation(resource, annotation):
+    if isinstance(resource, dict):
+        annotations = resource['metadata'].get('annotations') or {}
+    else:
+        annotations = resource.metadata.annotations or {}
+    return annotations.get(annotation)
+
+
+def get_desired_state_hash(resource):
+    return get_annotation(resource, DESIRED_STATE_HASH_ANNOTATION)
+
+
+def get_pod_template_hash(resource):
+    return get_annotation(resource, POD_TEMPLATE_HASH_ANNOTATION)
+
+
+def get_hash(value):
+    rendered = json.dumps(value, sort_keys=True)
+    return hashlib.sha256(rendered.encode('utf-8')).hexdigest()
+
+
+def set_desired_state_hash(resource):
+    # Hash the rendered object before it carries the annotation, so that
+    # comparing annotations tells us if a patch would change anything
+    annotations = {DESIRED_STATE_HASH_ANNOTATION: get_hash(resource)}
+    spec = resource.get('spec') or {}
+    if 'template' in spec:
+        # Only changes to these roll the pods of a deployment
+        annotations[POD_TEMPLATE_HASH_ANNOTATION] = get_hash(
+            {'replicas': spec.get('replicas'), 'template': spec['template']})
+    resource['metadata']['annotations'] = annotations
+    return resource
+
+
+RENDER_CACHE = {}
+
+
+def memoize_render(render):
+    """Only render a cluster's resource again when its spec changed.
+
+    The cache holds the last spec and rendering per cluster, rendered
+    resources are shared and must not be modified.
+    """
+    @functools.wraps(render)
+    def memoized_render(spec):
+        with TRACER.span(render.__name__, 'render') as span:
+            cluster_cache = RENDER_CACHE.setdefault(
+                (spec.namespace, spec.name), {})
+            cached = cluster_cache.get(render.__name__)
+            if cached is not None and cached[0] == spec:
+                RENDER_CACHE_REQUESTS.labels('hit').inc()
+                span.set_result('hit')
+                return cached[1]
+
+            RENDER_CACHE_REQUESTS.labels('miss').inc()
+            resource = set_desired_state_hash(render(spec))
+            cluster_cache[render.__name__] = (spec, resource)
+            span.set_result('miss')
+            return resource
+    return memoized_render
+
+
+def forget_rendered(name, namespace):
+    RENDER_CACHE.pop((namespace, name), None)
+
+
+def get_metadata(name, spec, labels):
+    metadata = {
+        'name': name,
+        'namespace': spec.namespace,
+        'labels': labels}
+    owner_references = get_owner_references(spec)
+    if owner_references:
+        metadata['ownerReferences'] = owner_references
+    return metadata
+
+
+def get_resources(cpu, memory):
+    return {
+        'limits': {'cpu': cpu, 'memory': memory},
+        'requests': {'cpu': cpu, 'memory': memory}}
+
+
+def get_deployment_spec(replicas, template):
+    # apps/v1 requires the selector older versions defaulted to
+    spec = {
+        'selector': {'matchLabels': template['metadata']['labels']},
+        'template': template}
+    if replicas is not None:
+        spec['replicas'] = replicas
+    return spec
+
+
+def get_service_ports():
+    return [
+        {'name': 'memcached', 'port': 11211, 'protocol': 'TCP'},
+        {'name': 'metrics', 'port': 9150, 'protocol': 'TCP'}]
+
+
+@memoize_render
+def render_mcrouter_service(spec):
+    labels = get_default_labels(name=spec.name)
     # Add the monitoring label so that metrics get picked up by Prometheus
-    service.metadata.labels['monitoring.kubestack.com'] = 'metrics'
+    labels['monitoring.kubestack.com'] = 'metrics'
 
-    # Spec
-    memcached_port = client.V1ServicePort(
-        name='memcached', port=11211, protocol='TCP')
-    metrics_port = client.V1ServicePort(
-        name='metrics', port=9150, protocol='TCP')
+    selector = get_default_labels(name=spec.name)
+    selector['service-type'] = 'mcrouter'
 
-    service.spec = client.V1ServiceSpec(
-        selector=get_default_labels(name=name),
-        ports=[memcached_port, metrics_port])
-    service.spec.selector['service-type'] = 'mcrouter'
-    return service
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': get_metadata(spec.name, spec, labels),
+        'spec': {
+            'selector': selector,
+            'ports': get_service_ports()}}
 
 
-def get_memcached_service_object(cluster_object):
-    name = cluster_object['metadata']['name']
-    namespace = cluster_object['metadata']['namespace']
-    service = client.V1Service()
-
-    # Metadata
-    service.metadata = client.V1ObjectMeta(
-        name='{}-backend'.format(name),
-        namespace=namespace,
-        labels=get_default_labels(name=name))
+@memoize_render
+def render_memcached_service(spec):
+    labels = get_default_labels(name=spec.name)
     # Add the monitoring label so that metrics get picked up by Prometheus
-    service.metadata.labels['monitoring.kubestack.com'] = 'metrics'
+    labels['monitoring.kubestack.com'] = 'metrics'
 
-    # Spec
-    memcached_port = client.V1ServicePort(
-        name='memcached', port=11211, protocol='TCP')
-    metrics_port = client.V1ServicePort(
-        name='metrics', port=9150, protocol='TCP')
+    selector = get_default_labels(name=spec.name)
+    selector['service-type'] = 'memcached'
 
-    service.spec = client.V1ServiceSpec(
-        cluster_ip='None',
-        selector=get_default_labels(name=name),
-        ports=[memcached_port, metrics_port])
-    service.spec.selector['service-type'] = 'memcached'
-    return service
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Service',
+        'metadata': get_metadata(
+            '{}-backend'.format(spec.name), spec, labels),
+        'spec': {
+            'clusterIP': 'None',
+            'selector': selector,
+            'ports': get_service_ports()}}
 
 
-def get_memcached_deployment_object(cluster_object):
-    name = cluster_object['metadata']['name']
-    namespace = cluster_object['metadata']['namespace']
-
-    try:
-        replicas = cluster_object['spec']['memcached']['replicas']
-    except KeyError:
-        replicas = 2
-
-    try:
-        memcached_limit_cpu = \
-            cluster_object['spec']['memcached']['memcached_limit_cpu']
-    except KeyError:
-        memcached_limit_cpu = '100m'
-
-    try:
-        memcached_limit_memory = \
-            cluster_object['spec']['memcached']['memcached_limit_memory']
-    except KeyError:
-        memcached_limit_memory = '64Mi'
-
-    deployment = client.AppsV1beta1Deployment()
-
-    # Metadata
-    deployment.metadata = client.V1ObjectMeta(
-        name=name,
-        namespace=namespace,
-        labels=get_default_labels(name=name))
-    deployment.metadata.labels['service-type'] = 'memcached'
-
-    # Spec
-    deployment.spec = client.AppsV1beta1DeploymentSpec(
-        replicas=replicas,
-        template=client.V1PodTemplateSpec())
-
-    deployment.spec.template.metadata = client.V1ObjectMeta(
-        labels=deployment.metadata.labels)
-    deployment.spec.template.spec = client.V1PodSpec(containers=[])
+@memoize_render
+def render_memcached_deployment(spec):
+    labels = get_default_labels(name=spec.name)
+    labels['service-type'] = 'memcached'
 
     # Memcached container
-    memcached_port = client.V1ContainerPort(
-        name='memcached', container_port=11211, protocol='TCP')
-    memcached_resources = client.V1ResourceRequirements(
-        limits={
-            'cpu': memcached_limit_cpu, 'memory': memcached_limit_memory},
-        requests={
-            'cpu': memcached_limit_cpu, 'memory': memcached_limit_memory})
-    memcached_container = client.V1Container(
-        name='memcached',
-        command=['memcached', '-p', '11211'],
-        image='memcached:1.4.33',
-        ports=[memcached_port],
-        resources=memcached_resources)
+    memcached_container = {
+        'name': 'memcached',
+        'command': ['memcached', '-p', '11211'],
+        'image': 'memcached:1.4.33',
+        'ports': [{
+            'name': 'memcached', 'containerPort': 11211, 'protocol': 'TCP'}],
+        'resources': get_resources(
+            spec.memcached_limit_cpu, spec.memcached_limit_memory)}
 
     # Metrics container
-    metrics_port = client.V1ContainerPort(
-        name='metrics', container_port=9150, protocol='TCP')
-    metrics_resources = client.V1ResourceRequirements(
-        limits={'cpu': '50m', 'memory': '16Mi'},
-        requests={'cpu': '50m', 'memory': '16Mi'})
-    metrics_container = client.V1Container(
-        name='prometheus-exporter',
-        image='prom/memcached-exporter:v0.3.0',
-        ports=[metrics_port],
-        resources=metrics_resources)
-
-    deployment.spec.template.spec.containers = [
-        memcached_container, metrics_container]
-    return deployment
-
-
-def get_mcrouter_deployment_object(cluster_object):
-    name = cluster_object['metadata']['name']
-    namespace = cluster_object['metadata']['namespace']
-
-    try:
-        replicas = cluster_object['spec']['mcrouter']['replicas']
-    except KeyError:
-        replicas = 1
-
-    try:
-        mcrouter_limit_cpu = \
-            cluster_object['spec']['mcrouter']['mcrouter_limit_cpu']
-    except KeyError:
-        mcrouter_limit_cpu = '50m'
-
-    try:
-        mcrouter_limit_memory = \
-            cluster_object['spec']['mcrouter']['mcrouter_limit_memory']
-    except KeyError:
-        mcrouter_limit_memory = '32Mi'
-
-    deployment = client.AppsV1beta1Deployment()
-
-    # Metadata
-    deployment.metadata = client.V1ObjectMeta(
-        name="{}-router".format(name),
-        namespace=namespace,
-        labels=get_default_labels(name=name))
-    deployment.metadata.labels['service-type'] = 'mcrouter'
-
-    # Spec
-    deployment.spec = client.AppsV1beta1DeploymentSpec(
-        replicas=replicas,
-        template=client.V1PodTemplateSpec())
-
-    deployment.spec.template = client.V1PodTemplateSpec()
-    deployment.spec.template.metadata = client.V1ObjectMeta(
-        labels=deployment.metadata.labels)
-    deployment.spec.template.spec = client.V1PodSpec(containers=[])
+    metrics_container = {
+        'name': 'prometheus-exporter',
+        'image': 'prom/memcached-exporter:v0.3.0',
+        'ports': [{
+            'name': 'metrics', 'containerPort': 9150, 'protocol': 'TCP'}],
+        'resources': get_resources('50m', '16Mi')}
+
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': get_metadata(spec.name, spec, labels),
+        'spec': get_deployment_spec(spec.memcached_replicas, {
+            'metadata': {'labels': labels},
+            'spec': {
+                'containers': [memcached_container, metrics_container]}})}
+
+
+@memoize_render
+def render_mcrouter_deployment(spec):
+    labels = get_default_labels(name=spec.name)
+    labels['service-type'] = 'mcrouter'
 
     # Mcrouter container
-    mcrouter_config_volumemount = client.V1VolumeMount(
-        name='mcrouter-config',
-        read_only=False,
-        mount_path='/etc/mcrouter')
-
-    mcrouter_port = client.V1ContainerPort(
-        name='mcrouter', container_port=11211, protocol='TCP')
-    mcrouter_resources = client.V1ResourceRequirements(
-        limits={
-            'cpu': mcrouter_limit_cpu, 'memory': mcrouter_limit_memory},
-        requests={
-            'cpu': mcrouter_limit_cpu, 'memory': mcrouter_limit_memory})
-    mcrouter_container = client.V1Container(
-        name='mcrouter',
-        command=[
+    mcrouter_config_volumemount = {
+        'name': 'mcrouter-config',
+        'readOnly': False,
+        'mountPath': '/etc/mcrouter'}
+    mcrouter_container = {
+        'name': 'mcrouter',
+        'command': [
             'mcrouter', '-p', '11211', '-f', '/etc/mcrouter/mcrouter.conf'],
-        image='kubestack/mcrouter:v0.36.0-kbst1',
-        ports=[mcrouter_port],
-        volume_mounts=[mcrouter_config_volumemount],
-        resources=mcrouter_resources)
+        'image': 'kubestack/mcrouter:v0.36.0-kbst1',
+        'ports': [{
+            'name': 'mcrouter', 'containerPort': 11211, 'protocol': 'TCP'}],
+        'volumeMounts': [mcrouter_config_volumemount],
+        'resources': get_resources(
+            spec.mcrouter_limit_cpu, spec.mcrouter_limit_memory)}
 
     # Mcrouter config sidecar
-    sidecar_resources = client.V1ResourceRequirements(
-        limits={'cpu': '25m', 'memory': '8Mi'},
-        requests={'cpu': '25m', 'memory': '8Mi'})
-    sidecar_config_volumemount = client.V1VolumeMount(
-        name='mcrouter-config',
-        read_only=True,
-        mount_path='/etc/mcrouter')
-    sidecar_container = client.V1Container(
-        name='config-sidecar',
-        args=[
-            "--debug",
-            "--output=/etc/mcrouter/mcrouter.conf",
-            "{}-backend.{}.svc.cluster.local".format(name, namespace)],
-        image='kubestack/mcrouter_sidecar:v0.1.0',
-        volume_mounts=[mcrouter_config_volumemount],
-        resources=sidecar_resources)
-
-    # Config Map Volume
-    mcrouter_config_volume = client.V1Volume(
-        name='mcrouter-config',
-        empty_dir=client.V1EmptyDirVolumeSource())
-    deployment.spec.template.spec.volumes = [mcrouter_config_volume]
+    sidecar_container = {
+        'name': 'config-sidecar',
+        'args': [
+            '--debug',
+            '--output=/etc/mcrouter/mcrouter.conf',
+            '{}-backend.{}.svc.cluster.local'.format(
+                spec.name, spec.namespace)],
+        'image': 'kubestack/mcrouter_sidecar:v0.1.0',
+        'volumeMounts': [mcrouter_config_volumemount],
+        'resources': get_resources('25m', '8Mi')}
 
     # Metrics container
-    metrics_port = client.V1ContainerPort(
-        name='metrics', container_port=9150, protocol='TCP')
-    metrics_resources = client.V1ResourceRequirements(
-        limits={'cpu': '50m', 'memory': '16Mi'},
-        requests={'cpu': '50m', 'memory': '16Mi'})
-    metrics_container = client.V1Container(
-        name='prometheus-exporter',
-        image='kubestack/mcrouter_exporter:v0.0.1',
-        args=[
+    metrics_container = {
+        'name': 'prometheus-exporter',
+        'image': 'kubestack/mcrouter_exporter:v0.0.1',
+        'args': [
             '-mcrouter.address', 'localhost:11211',
             '-web.listen-address', ':9150'],
-        ports=[metrics_port],
-        resources=metrics_resources)
+        'ports': [{
+            'name': 'metrics', 'containerPort': 9150, 'protocol': 'TCP'}],
+        'resources': get_resources('50m', '16Mi')}
+
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': get_metadata('{}-router'.format(spec.name), spec, labels),
+        'spec': get_deployment_spec(spec.mcrouter_replicas, {
+            'metadata': {'labels': labels},
+            'spec': {
+                # Config Map Volume
+                'volumes': [{'name': 'mcrouter-config', 'emptyDir': {}}],
+                'containers': [
+                    mcrouter_container,
+                    sidecar_container,
+                    metrics_container]}})}
+
+
+def get_mcrouter_service_object(cluster_object):
+    return render_mcrouter_service(parse_cluster_spec(cluster_object))
+
 
-    deployment.spec.template.spec.containers = [
-        mcrouter_container, sidecar_container, metrics_container]
-    return deployment
+def get_memcached_service_object(cluster_object):
+    return render_memcached_service(parse_cluster_spec(cluster_object))
+
+
+def get_memcached_deployment_object(cluster_object):
+    return render_memcached_deployment(parse_cluster_spec(cluster_object))
+
+
+def get_mcrouter_deployment_object(cluster_object):
+    return render_mcrouter_deployment(parse_cluster_spec(cluster_object))
+
+
+def is_generation_observed(cluster_object):
+    """Check whether the status reflects the current spec."""
+    generation = cluster_object['metadata'].get('generation')
+    status = cluster_object.get('status') or {}
+    return (generation is None or
+            status.get('observedGeneration') == generation)
+
+
+def format_micro_time(timestamp):
+    # Lease times are RFC 3339 with microseconds in UTC
+    return timestamp.astimezone(timezone.utc).strftime(
+        '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def get_lease_object(name, namespace, holder_identity, lease_duration,
+                     labels=None, renew_time=None):
+    if renew_time is None:
+        renew_time = datetime.now(timezone.utc)
+    return {
+        'apiVersion': 'coordination.k8s.io/v1beta1',
+        'kind': 'Lease',
+        'metadata': {
+            'name': name,
+            'namespace': namespace,
+            'labels': labels or {}},
+        'spec': {
+            'holderIdentity': holder_identity,
+            'leaseDurationSeconds': int(lease_duration),
+            'renewTime': format_micro_time(renew_time)}}
@@ -0,0 +1,167 @@
+import logging
+from time import monotonic
+
+from .kubernetes_helpers import read_lease, renew_lease
+from .kubernetes_resources import get_lease_object
+from .metrics import LEADER
+from .sharding import SHARDS
+
+
+LEADER_LEASE_NAME = 'memcached-operator-leader'
+
+# How often standbys check the lease and leaders retry failed renewals
+RETRY_INTERVAL = 1
+
+
+class LeaderElection(object):
+    """Reconcile on one replica, keep the others on hot standby.
+
+    Standbys run their informers and event listener like the leader but
+    own no clusters, so they never write. They check the leader's lease
+    every second and take over once it was released or not renewed for
+    its duration. Their caches are warm by then, the new leader only
+    patches clusters that drifted.
+
+    Like client-go, expiry is timed with our own clock from the last
+    observed change of renewTime, so clock skew between nodes doesn't
+    matter.
+    """
+
+    def __init__(self, identity, namespace, lease_duration, shards=SHARDS):
+        self.identity = identity
+        self.namespace = namespace
+        self.lease_duration = int(lease_duration)
+        # Stop writing well before the standbys consider the lease expired
+        self.renew_deadline = self.lease_duration * 2 / 3
+        self.shards = shards
+        self.lease = None
+        self.renewed_at = None
+        self.observed = None
+        self.observed_at = None
+
+        # Stand by until we hold the lease
+        self.shards.set_active(False)
+        LEADER.set(0)
+
+    @property
+    def is_leader(self):
+        return self.renewed_at is not None
+
+    def run(self, shutting_down, queue, rebalance):
+        logging.info('thread started')
+        while not shutting_down.isSet():
+            renewed = False
+            try:
+                renewed = self.sync(queue, rebalance)
+            except Exception as e:
+                # Last resort: catch all exceptions to keep the thread alive
+                logging.exception(e)
+            shutting_down.wait(
+                self.lease_duration / 3 if renewed else RETRY_INTERVAL)
+        else:
+            # Let a standby take over right away
+            self.release()
+            logging.info('thread stopped')
+
+    def sync(self, queue, rebalance):
+        """Renew or try to acquire the lease, return True if we hold it."""
+        now = monotonic()
+        if self.is_leader:
+            current = self.lease
+        else:
+            current = read_lease(LEADER_LEASE_NAME, self.namespace)
+            if self.is_held(current, now):
+                return False
+
+        lease = renew_lease(self.get_lease_object(current))
+        if lease:
+            self.lease = lease
+            leading = self.is_leader
+            self.renewed_at = now
+            if not leading:
+                self.start_leading(queue, rebalance)
+            return True
+
+        if self.is_leader:
+            if now - self.renewed_at >= self.renew_deadline:
+                logging.warning('unable to renew lease/{} in ns/{}, '
+                                'standing by'.format(
+                                    LEADER_LEASE_NAME, self.namespace))
+                self.stop_leading()
+                return False
+
+            # Retry with the current resourceVersion unless the lease was
+            # taken over in the meantime
+            self.lease = read_lease(LEADER_LEASE_NAME, self.namespace)
+            if (self.lease is None or
+                    self.lease.spec.holder_identity != self.identity):
+                logging.warning('lost lease/{} in ns/{}, standing by'.format(
+                    LEADER_LEASE_NAME, self.namespace))
+                self.stop_leading()
+        return False
+
+    def is_held(self, lease, now):
+        """Return True while another replica holds the lease."""
+        if lease is None or not lease.spec.holder_identity:
+            return False
+        if lease.spec.holder_identity == self.identity:
+            # Held by us before a restart
+            return False
+
+        observed = (lease.spec.holder_identity, lease.spec.renew_time)
+        if observed != self.observed:
+            self.observed = observed
+            self.observed_at = now
+        lease_duration = (
+            lease.spec.lease_duration_seconds or self.lease_duration)
+        return now - self.observed_at < lease_duration
+
+    def get_lease_object(self, current):
+        lease_object = get_lease_object(
+            LEADER_LEASE_NAME,
+            self.namespace,
+            self.identity,
+            self.lease_duration)
+        spec = lease_object['spec']
+        if current is None:
+            spec['acquireTime'] = spec['renewTime']
+            spec['leaseTransitions'] = 0
+            return lease_object
+
+        # Only one standby wins when several take over at once
+        lease_object['metadata']['resourceVersion'] = \
+            current.metadata.resource_version
+        if current.spec.holder_identity != self.identity:
+            spec['acquireTime'] = spec['renewTime']
+            spec['leaseTransitions'] = (
+                (current.spec.lease_transitions or 0) + 1)
+        return lease_object
+
+    def start_leading(self, queue, rebalance):
+        logging.info('acquired lease/{} in ns/{}, reconciling clusters'.format(
+            LEADER_LEASE_NAME, self.namespace))
+        self.shards.set_active(True)
+        LEADER.set(1)
+        # Queue all clusters from the warm caches, only drifted ones are
+        # patched
+        rebalance(queue)
+
+    def stop_leading(self):
+        self.shards.set_active(False)
+        LEADER.set(0)
+        self.lease = None
+        self.renewed_at = None
+
+    def release(self):
+        if not self.is_leader:
+            return
+
+        lease = self.lease
+        self.stop_leading()
+        lease_object = self.get_lease_object(lease)
+        # An empty holder marks the lease as free
+        lease_object['spec']['holderIdentity'] = None
+        lease_object['spec']['leaseDurationSeconds'] = 1
+        if renew_lease(lease_object):
+            logging.info('released lease/{} in ns/{}'.format(
+                LEADER_LEASE_NAME, self.namespace))
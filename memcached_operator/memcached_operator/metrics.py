@@ -0,0 +1,199 @@
+import logging
+import threading
+from time import monotonic
+
+from prometheus_client import Counter, Gauge, Histogram
+from urllib3.util import parse_url
+
+from .tracing import SPAN_KIND_CLIENT, TRACER
+
+
+RECONCILE_DURATION = Histogram(
+    'memcached_operator_reconcile_duration_seconds',
+    'Time spent reconciling clusters per phase.',
+    ['phase'])
+
+WORK_IN_FLIGHT = Gauge(
+    'memcached_operator_work_in_flight',
+    'Clusters currently being reconciled.')
+
+QUEUE_DEPTH = Gauge(
+    'memcached_operator_queue_depth',
+    'Clusters waiting to be reconciled.')
+
+API_REQUESTS = Counter(
+    'memcached_operator_apiserver_requests_total',
+    'Requests sent to the apiserver.',
+    ['verb', 'resource', 'status'])
+
+API_REQUEST_DURATION = Histogram(
+    'memcached_operator_apiserver_request_duration_seconds',
+    'Apiserver request latency, watches last until they are closed.',
+    ['verb', 'resource'])
+
+RENDER_CACHE_REQUESTS = Counter(
+    'memcached_operator_render_cache_requests_total',
+    'Rendered resource lookups by result.',
+    ['result'])
+
+WATCH_RECONNECTS = Counter(
+    'memcached_operator_watch_reconnects_total',
+    'Watches started again after the previous one ended.',
+    ['resource'])
+
+WATCH_EVENTS = Counter(
+    'memcached_operator_watch_events_total',
+    'Watch events processed by type.',
+    ['resource', 'type'])
+
+CONNECTION_POOL_IN_USE = Gauge(
+    'memcached_operator_connection_pool_in_use',
+    'Apiserver connections currently in use.')
+
+CONNECTION_POOL_SIZE = Gauge(
+    'memcached_operator_connection_pool_size',
+    'Apiserver connections that can be kept open.')
+
+SHARD_MEMBERS = Gauge(
+    'memcached_operator_shard_members',
+    'Operator replicas the clusters are sharded between.')
+
+LEADER = Gauge(
+    'memcached_operator_leader',
+    'Whether this replica holds the leader lease.')
+
+RATE_LIMITER_DELAY = Histogram(
+    'memcached_operator_rate_limiter_delay_seconds',
+    'Time requests waited for the client side rate limiter.')
+
+ROLLOUTS_IN_PROGRESS = Gauge(
+    'memcached_operator_rollouts_in_progress',
+    'Deployments rolling out a template change started by the operator.')
+
+TIME_TO_FIRST_RECONCILE = Gauge(
+    'memcached_operator_time_to_first_reconcile_seconds',
+    'Seconds from operator start until the first reconcile succeeded.')
+
+CHILD_DRIFT = Counter(
+    'memcached_operator_child_drift_total',
+    'Services and deployments changed or deleted by someone else.',
+    ['resource', 'type'])
+
+RESYNC_INTERVAL = Gauge(
+    'memcached_operator_resync_interval_seconds',
+    'Current interval between routine resyncs of a cluster.')
+
+
+class StartupTimer(object):
+    """Report the time until the first successful reconcile once."""
+
+    def __init__(self, gauge=TIME_TO_FIRST_RECONCILE):
+        self.gauge = gauge
+        self.started = monotonic()
+        self.done = False
+
+    def reconciled(self):
+        if self.done:
+            return
+        self.done = True
+        elapsed = monotonic() - self.started
+        self.gauge.set(elapsed)
+        logging.info('first reconcile {:.3f}s after start'.format(elapsed))
+
+
+# Started when the operator imports its modules
+STARTUP_TIMER = StartupTimer()
+
+
+class ApiPressure(object):
+    """Apiserver latency and throttling since the last collect().
+
+    Watches last until they are closed and are left out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def observe(self, verb, duration, status):
+        if verb == 'WATCH':
+            return
+        with self._lock:
+            self._requests += 1
+            self._duration += duration
+            if status == 429:
+                self._throttled += 1
+
+    def collect(self):
+        """Return requests, their mean duration and 429s, then reset."""
+        with self._lock:
+            requests = self._requests
+            duration = self._duration
+            throttled = self._throttled
+            self._reset()
+        return requests, duration / requests if requests else 0, throttled
+
+    def _reset(self):
+        self._requests = 0
+        self._duration = 0
+        self._throttled = 0
+
+
+API_PRESSURE = ApiPressure()
+
+
+def get_api_verb_and_resource(method, url, query_params):
+    """Map a request to a verb and resource like kubectl would name them.
+
+    Paths look like /api/v1/namespaces/{ns}/services/{name} or
+    /apis/{group}/{version}/memcacheds.
+    """
+    segments = [s for s in (parse_url(url).path or '').split('/') if s]
+    if segments[:1] == ['api']:
+        segments = segments[2:]
+    elif segments[:1] == ['apis']:
+        segments = segments[3:]
+    if segments[:1] == ['namespaces'] and len(segments) > 2:
+        segments = segments[2:]
+    resource = segments[0] if segments else ''
+
+    params = dict(query_params or [])
+    if str(params.get('watch')).lower() == 'true':
+        return 'WATCH', resource
+    if method == 'GET' and len(segments) == 1:
+        return 'LIST', resource
+    return method, resource
+
+
+def instrument_rest_client(rest_client):
+    """Count and time all requests sent by a kubernetes RESTClientObject."""
+    request = rest_client.request
+
+    def instrumented_request(method, url, query_params=None, *args,
+                             **kwargs):
+        verb, resource = get_api_verb_and_resource(
+            method, url, query_params)
+        status = 'error'
+        start = monotonic()
+        with TRACER.span('{} {}'.format(verb, resource), verb.lower(),
+                         SPAN_KIND_CLIENT,
+                         {'http.method': method,
+                          'http.target': parse_url(url).path}) as span:
+            try:
+                response = request(method, url, query_params, *args,
+                                   **kwargs)
+                status = response.status
+                return response
+            except Exception as e:
+                status = getattr(e, 'status', None) or 'error'
+                raise
+            finally:
+                duration = monotonic() - start
+                API_REQUEST_DURATION.labels(verb, resource).observe(duration)
+                API_REQUESTS.labels(verb, resource, str(status)).inc()
+                API_PRESSURE.observe(verb, duration, status)
+                span.set_result(
+                    status, isinstance(status, int) and status < 400)
+
+    rest_client.request = instrumented_request
+    return rest_client
@@ -1,193 +1,332 @@
 import logging
-from time import sleep
+from time import monotonic
 
 from kubernetes import client
 
-from .kubernetes_resources import (get_default_label_selector,
-                                   get_mcrouter_service_object,
-                                   get_memcached_service_object)
+from .kubernetes_resources import (parse_cluster_spec,
+                                   render_mcrouter_service,
+                                   render_memcached_service,
+                                   render_memcached_deployment,
+                                   render_mcrouter_deployment,
+                                   get_desired_state_hash,
+                                   get_pod_template_hash,
+                                   is_generation_observed,
+                                   is_owned)
 from .kubernetes_helpers import (list_cluster_memcached_object,
-                                 get_namespaced_memcached_object,
+                                 list_pages,
+                                 apply_service,
+                                 apply_deployment,
                                  create_service,
                                  update_service,
-                                 delete_service,
                                  create_memcached_deployment,
                                  create_mcrouter_deployment,
                                  update_memcached_deployment,
-                                 update_mcrouter_deployment,
-                                 delete_deployment)
+                                 update_mcrouter_deployment)
+from .metrics import RECONCILE_DURATION
+from .plan import Plan
+from .rollout import ROLLOUTS
+from .resync import AdaptiveInterval, ResyncSchedule
+from .scope import SCOPE, get_list_kwargs
+from .state import CHILD_VERSIONS, save_state
+from .sharding import SHARDS
+from .workqueue import PRIORITY_URGENT, PRIORITY_DRIFTED, PRIORITY_RESYNC
+from .informers import (MEMCACHED_STORE,
+                        SERVICE_STORE,
+                        DEPLOYMENT_STORE,
+                        caches_synced,
+                        get_resource_key,
+                        split_resource_key)
 
 
-def periodical_check(shutting_down, sleep_seconds):
+# Seconds between two runs of the periodic check
+CHECK_TICK = 1
+
+
+def periodical_check(shutting_down, periodic_check, queue):
     logging.info('thread started')
     while not shutting_down.isSet():
         try:
-            # First make sure all expected resources exist
-            check_existing()
-
-            # Then garbage collect resources from deleted clusters
-            collect_garbage()
+            periodic_check.tick(queue)
         except Exception as e:
             # Last resort: catch all exceptions to keep the thread alive
             logging.exception(e)
         finally:
-            sleep(int(sleep_seconds))
+            # Returns as soon as we are shutting down
+            shutting_down.wait(CHECK_TICK)
     else:
         logging.info('thread stopped')
 
 
-VERSION_CACHE = {}
+class PeriodicCheck(object):
+    """Resync clusters as they come due, collect garbage per interval.
 
+    Every tick adapts the interval to the fleet size and apiserver
+    pressure and queues the clusters whose resync is due. With a
+    state file the child versions are saved once per interval as well.
+    """
 
-def is_version_cached(resource):
-    uid = resource.metadata.uid
-    version = resource.metadata.resource_version
+    def __init__(self, min_interval, max_interval=None, resync_rate=None,
+                 gc_budget=None, state_file=None):
+        self.interval = AdaptiveInterval(
+            min_interval, max_interval, resync_rate)
+        self.schedule = ResyncSchedule(self.interval)
+        self.gc_budget = gc_budget
+        self.gc_cursor = None
+        self.next_gc = None
+        self.state_file = state_file
 
-    if uid in VERSION_CACHE and VERSION_CACHE[uid] == version:
-        return True
+    def tick(self, queue):
+        # First queue due clusters to make sure expected resources exist
+        self.interval.update(count_owned_clusters())
+        check_existing(queue, self.schedule)
 
-    return False
+        # Then queue deleted clusters that still have resources
+        now = monotonic()
+        if self.next_gc is None or now >= self.next_gc:
+            with RECONCILE_DURATION.labels('gc').time():
+                self.gc_cursor = collect_garbage(
+                    queue, self.gc_cursor, self.gc_budget)
+            if self.state_file:
+                save_state(self.state_file)
+            self.next_gc = now + self.interval.seconds
 
 
-def cache_version(resource):
-    uid = resource.metadata.uid
-    version = resource.metadata.resource_version
+def count_owned_clusters():
+    # Sharded replicas only resync their share of the fleet
+    return sum(1 for cluster_object in MEMCACHED_STORE.list()
+               if SHARDS.owns(get_resource_key(cluster_object)))
 
-    VERSION_CACHE[uid] = version
 
-
-def check_existing():
-    try:
-        cluster_list = list_cluster_memcached_object()
-    except client.rest.ApiException as e:
-        # If for any reason, k8s api gives us an error here, there is
-        # nothing for us to do but retry later
-        logging.exception(e)
+def check_existing(queue, schedule=None):
+    """Queue all clusters, or only those due according to schedule."""
+    if not caches_synced():
+        # Without complete caches we can't tell what is missing
+        logging.info('waiting for informer caches to sync')
         return False
 
-    core_api = client.CoreV1Api()
-    apps_api = client.AppsV1beta1Api()
-    for cluster_object in cluster_list['items']:
-        name = cluster_object['metadata']['name']
-        namespace = cluster_object['metadata']['namespace']
-
-        service_objects = [
-            get_mcrouter_service_object(cluster_object),
-            get_memcached_service_object(cluster_object)]
-        for service_object in service_objects:
-            # Check service exists
-            service_name = service_object.metadata.name
-            try:
-                service = core_api.read_namespaced_service(service_name, namespace)
-            except client.rest.ApiException as e:
-                if e.status == 404:
-                    # Create missing service
-                    created_service = create_service(service_object)
-                    if created_service:
-                        # Store latest version in cache
-                        cache_version(created_service)
-                else:
-                    logging.exception(e)
+    cluster_objects = MEMCACHED_STORE.list()
+    if schedule is not None:
+        cluster_objects = schedule.get_due(cluster_objects, monotonic())
+    for cluster_object in cluster_objects:
+        key = get_resource_key(cluster_object)
+        if SHARDS.owns(key):
+            queue.add(key, get_priority(cluster_object))
+
+
+def get_priority(cluster_object):
+    """Classify a cluster by what its reconcile would repair.
+
+    Missing children and unobserved spec changes are urgent, outdated
+    children come next and everything else is a routine resync. Renders
+    are memoized, so this costs a few cache lookups per cluster.
+    """
+    if not is_generation_observed(cluster_object):
+        return PRIORITY_URGENT
+
+    namespace = cluster_object['metadata']['namespace']
+    spec = parse_cluster_spec(cluster_object)
+    children = [
+        ('services', SERVICE_STORE, render_mcrouter_service(spec)),
+        ('services', SERVICE_STORE, render_memcached_service(spec)),
+        ('deployments', DEPLOYMENT_STORE, render_memcached_deployment(spec)),
+        ('deployments', DEPLOYMENT_STORE, render_mcrouter_deployment(spec))]
+    priority = PRIORITY_RESYNC
+    for kind, store, desired_object in children:
+        resource = store.get(desired_object['metadata']['name'], namespace)
+        if resource is None:
+            return PRIORITY_URGENT
+        if is_outdated(resource, desired_object, kind):
+            priority = PRIORITY_DRIFTED
+    return priority
+
+
+def is_outdated(resource, desired_object, kind=None):
+    # Children rendered from an unchanged spec carry the same hash, only
+    # patch those that were changed or created by an older operator, or
+    # edited by someone else since we last wrote them
+    return (get_desired_state_hash(resource) !=
+            get_desired_state_hash(desired_object) or
+            (kind is not None and
+             CHILD_VERSIONS.is_modified(kind, resource)))
+
+
+def check_cluster(cluster_object, server_side_apply=False):
+    namespace = cluster_object['metadata']['namespace']
+    spec = parse_cluster_spec(cluster_object)
+    plan = Plan()
+
+    memcached_service = render_memcached_service(spec)
+    service_objects = [render_mcrouter_service(spec), memcached_service]
+    for service_object in service_objects:
+        # Check service exists and matches the spec
+        service = SERVICE_STORE.get(
+            service_object['metadata']['name'], namespace)
+        if service and not is_outdated(service, service_object, 'services'):
+            CHILD_VERSIONS.adopt('services', service)
+            continue
+
+        plan.add(
+            'svc/{}'.format(service_object['metadata']['name']),
+            sync_service, service_object, service, server_side_apply)
+
+    # The mcrouter sidecar resolves the memcached pods through the backend
+    # service, everything else is independent
+    deployments = [
+        ('memcached_deployment',
+         render_memcached_deployment(spec),
+         create_memcached_deployment,
+         update_memcached_deployment,
+         []),
+        ('mcrouter_deployment',
+         render_mcrouter_deployment(spec),
+         create_mcrouter_deployment,
+         update_mcrouter_deployment,
+         ['svc/{}'.format(memcached_service['metadata']['name'])])]
+    for phase, deployment_object, create, update, after in deployments:
+        # Check deployment exists and matches the spec
+        deployment = DEPLOYMENT_STORE.get(
+            deployment_object['metadata']['name'], namespace)
+        if deployment and not is_outdated(
+                deployment, deployment_object, 'deployments'):
+            CHILD_VERSIONS.adopt('deployments', deployment)
+            continue
+
+        plan.add(
+            'deploy/{}'.format(deployment_object['metadata']['name']),
+            sync_deployment, phase, cluster_object, deployment_object,
+            deployment, create, update, server_side_apply, after=after)
+
+    return all(plan.run().values())
+
+
+def sync_service(service_object, service, server_side_apply=False):
+    name = service_object['metadata']['name']
+    namespace = service_object['metadata']['namespace']
+    # Watch events of this write may arrive before we record its version
+    with CHILD_VERSIONS.writing('services', name, namespace):
+        with RECONCILE_DURATION.labels('services').time():
+            if server_side_apply:
+                # Create or update service in a single request
+                result = apply_service(service_object)
+            elif not service:
+                # Create missing service
+                result = create_service(service_object)
             else:
-                if not is_version_cached(service):
-                    # Update since we don't know if it's configured correctly
-                    updated_service = update_service(service_object)
-                    if updated_service:
-                        # Store latest version in cache
-                        cache_version(updated_service)
-
-        # Check memcached deployment exists
-        try:
-            deployment = apps_api.read_namespaced_deployment(name, namespace)
-        except client.rest.ApiException as e:
-            if e.status == 404:
+                # Update service that doesn't match the spec
+                result = update_service(service_object)
+        if not result:
+            return False
+        CHILD_VERSIONS.record('services', result)
+    return True
+
+
+def sync_deployment(phase, cluster_object, deployment_object, deployment,
+                    create, update, server_side_apply=False):
+    name = deployment_object['metadata']['name']
+    namespace = deployment_object['metadata']['namespace']
+    # Spec changes and repairs of edited deployments roll out right away,
+    # template changes of the whole fleet are staged. Changes that don't
+    # touch the pod template, like new annotations, roll nothing
+    staged = (bool(deployment) and
+              is_generation_observed(cluster_object) and
+              get_desired_state_hash(deployment) !=
+              get_desired_state_hash(deployment_object) and
+              get_pod_template_hash(deployment) !=
+              get_pod_template_hash(deployment_object))
+    if staged and not ROLLOUTS.try_start(
+            name, namespace, get_resource_key(cluster_object)):
+        logging.info(
+            'deferring update of deploy/{} in ns/{}, {} rollouts '
+            'in progress'.format(name, namespace, ROLLOUTS.max_rolling))
+        return False
+
+    # Watch events of this write may arrive before we record its version
+    with CHILD_VERSIONS.writing('deployments', name, namespace):
+        with RECONCILE_DURATION.labels(phase).time():
+            if server_side_apply:
+                # Create or update deployment in a single request
+                result = apply_deployment(deployment_object)
+            elif not deployment:
                 # Create missing deployment
-                created_memcached_deployment = create_memcached_deployment(
-                    cluster_object)
-                if created_memcached_deployment:
-                    # Store latest version in cache
-                    cache_version(created_memcached_deployment)
+                result = create(cluster_object)
             else:
-                logging.exception(e)
-        else:
-            if not is_version_cached(deployment):
-                # Update since we don't know if it's configured correctly
-                updated_memcached_deployment = update_memcached_deployment(cluster_object)
-                if updated_memcached_deployment:
-                    # Store latest version in cache
-                    cache_version(updated_memcached_deployment)
-
-        # Check mcrouter deployment exists
+                # Update deployment that doesn't match the spec
+                result = update(cluster_object)
+        if result:
+            CHILD_VERSIONS.record('deployments', result)
+    if not result:
+        if staged:
+            ROLLOUTS.cancel(name, namespace)
+        return False
+    if staged:
+        ROLLOUTS.started(name, namespace, result)
+    return True
+
+
+def has_unowned_children(name, namespace):
+    # Owned children are deleted by the kubernetes garbage collector, only
+    # children created before ownerReferences were set need our help
+    children = (SERVICE_STORE.list_by_cluster(name, namespace) +
+                DEPLOYMENT_STORE.list_by_cluster(name, namespace))
+    return not all(is_owned(child) for child in children)
+
+
+def list_live_cluster_keys():
+    # One paginated list replaces a read per orphan candidate. Clusters
+    # outside our label selector are alive as well, their children
+    # belong to another operator instance
+    cluster_keys = set()
+    for namespace in SCOPE.get_namespaces():
+        for cluster_list in list_pages(
+                list_cluster_memcached_object, **get_list_kwargs(namespace)):
+            for cluster_object in cluster_list['items']:
+                cluster_keys.add(get_resource_key(cluster_object))
+    return cluster_keys
+
+
+def collect_garbage(queue, cursor=None, budget=None):
+    """Queue deleted clusters that still have services or deployments.
+
+    Clusters are checked in key order, at most `budget` per call starting
+    after `cursor`. Returns the cursor for the next call, None once all
+    clusters have been checked.
+    """
+    if not caches_synced():
+        logging.info('waiting for informer caches to sync')
+        return cursor
+
+    cluster_keys = sorted(set(
+        SERVICE_STORE.list_cluster_keys() +
+        DEPLOYMENT_STORE.list_cluster_keys()))
+    if cursor is not None:
+        cluster_keys = [key for key in cluster_keys if key > cursor]
+    if budget is not None and len(cluster_keys) > int(budget):
+        cluster_keys = cluster_keys[:int(budget)]
+        next_cursor = cluster_keys[-1]
+    else:
+        next_cursor = None
+
+    # Children of clusters in the cache are fine and owned children are
+    # deleted by the kubernetes garbage collector. The cache may however
+    # lag behind the child informers for freshly created clusters, so
+    # confirm the rest with the apiserver before deleting anything
+    orphaned_keys = []
+    for key in cluster_keys:
+        name, namespace = split_resource_key(key)
+        if (SHARDS.owns(key) and
+                MEMCACHED_STORE.get(name, namespace) is None and
+                has_unowned_children(name, namespace)):
+            orphaned_keys.append(key)
+    if orphaned_keys:
         try:
-            deployment = apps_api.read_namespaced_deployment(
-                '{}-router'.format(name),
-                namespace)
+            live_cluster_keys = list_live_cluster_keys()
         except client.rest.ApiException as e:
-            if e.status == 404:
-                # Create missing deployment
-                created_mcrouter_deployment = create_mcrouter_deployment(
-                    cluster_object)
-                if created_mcrouter_deployment:
-                    # Store latest version in cache
-                    cache_version(created_mcrouter_deployment)
-            else:
-                logging.exception(e)
-        else:
-            if not is_version_cached(deployment):
-                # Update since we don't know if it's configured correctly
-                updated_mcrouter_deployment = update_mcrouter_deployment(cluster_object)
-                if updated_mcrouter_deployment:
-                    # Store latest version in cache
-                    cache_version(updated_mcrouter_deployment)
-
-
-def collect_garbage():
-    core_api = client.CoreV1Api()
-    apps_api = client.AppsV1beta1Api()
-    label_selector = get_default_label_selector()
-
-    # Find all services that match our labels
-    try:
-        service_list = core_api.list_service_for_all_namespaces(
-            label_selector=label_selector)
-    except client.rest.ApiException as e:
-        logging.exception(e)
-    else:
-        # Check if service belongs to an existing cluster
-        for service in service_list.items:
-            cluster_name = service.metadata.labels['cluster']
-            name = service.metadata.name
-            namespace = service.metadata.namespace
-
-            try:
-                get_namespaced_memcached_object(
-                    cluster_name, namespace)
-            except client.rest.ApiException as e:
-                if e.status == 404:
-                    # Delete service
-                    delete_service(name, namespace)
-                else:
-                    logging.exception(e)
-
-    # Find all deployments that match our labels
-    try:
-        deployment_list = apps_api.list_deployment_for_all_namespaces(
-            label_selector=label_selector)
-    except client.rest.ApiException as e:
-        logging.exception(e)
-    else:
-        # Check if deployment belongs to an existing cluster
-        for deployment in deployment_list.items:
-            cluster_name = deployment.metadata.labels['cluster']
-            name = deployment.metadata.name
-            namespace = deployment.metadata.namespace
-
-            try:
-                get_namespaced_memcached_object(
-                    cluster_name, namespace)
-            except client.rest.ApiException as e:
-                if e.status == 404:
-                    # Delete deployment, replicasets and pods
-                    delete_deployment(name, namespace)
-                else:
-                    logging.exception(e)
+            logging.exception(e)
+            return cursor
+
+        for key in orphaned_keys:
+            if key not in live_cluster_keys:
+                # The worker deletes the cluster's resources
+                queue.add(key, PRIORITY_DRIFTED)
+
+    return next_cursor
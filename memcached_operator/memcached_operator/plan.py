@@ -0,0 +1,111 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic
+
+from .tracing import TRACER
+
+
+# Child operations running at once over all workers
+CHILD_CONCURRENCY = 8
+
+EXECUTOR = None
+EXECUTOR_LOCK = threading.Lock()
+
+
+def configure_executor(max_workers=None):
+    """Create the thread pool shared by all plans."""
+    global EXECUTOR
+    executor = ThreadPoolExecutor(int(max_workers or CHILD_CONCURRENCY))
+    with EXECUTOR_LOCK:
+        previous, EXECUTOR = EXECUTOR, executor
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return executor
+
+
+def get_executor():
+    global EXECUTOR
+    with EXECUTOR_LOCK:
+        if EXECUTOR is None:
+            EXECUTOR = ThreadPoolExecutor(CHILD_CONCURRENCY)
+        return EXECUTOR
+
+
+def run_step(name, func, args, submitted):
+    # Time spent waiting for a free thread shows up in traces
+    with TRACER.span(name, getattr(func, '__name__', name), attributes={
+            'memcached.wait': monotonic() - submitted}) as span:
+        result = func(*args)
+        span.set_result(result)
+        return result
+
+
+class Plan(object):
+    """Child operations of one reconcile and the order they need.
+
+    Steps run concurrently once the steps they come after succeeded,
+    a step whose dependency failed is skipped and fails as well. A
+    step that is the only one ready runs in the calling thread.
+    """
+
+    def __init__(self):
+        self.steps = OrderedDict()
+
+    def add(self, name, func, *args, after=()):
+        # Dependencies that aren't part of the plan are already satisfied
+        self.steps[name] = (
+            func, args, [step for step in after if step in self.steps])
+
+    def run(self, executor=None):
+        """Run all steps, return their results by name."""
+        results = {}
+        pending = OrderedDict(self.steps)
+        running = {}
+        error = None
+        while pending or running:
+            ready = []
+            for name, (func, args, after) in list(pending.items()):
+                if any(step not in results for step in after):
+                    continue
+                del pending[name]
+                if all(results[step] for step in after):
+                    ready.append((name, func, args))
+                else:
+                    logging.info('skipping {}, {} failed'.format(
+                        name, ', '.join(
+                            step for step in after if not results[step])))
+                    results[name] = False
+            if not ready and not running:
+                continue
+
+            if len(ready) == 1 and not running:
+                name, func, args = ready[0]
+                try:
+                    results[name] = run_step(name, func, args, monotonic())
+                except Exception as e:
+                    error = error or e
+                    results[name] = False
+                continue
+
+            for name, func, args in ready:
+                future = (executor or get_executor()).submit(
+                    TRACER.wrap(run_step), name, func, args, monotonic())
+                running[future] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    error = error or e
+                    results[name] = False
+
+        if error is not None:
+            # Workers log unexpected errors and retry the cluster
+            raise error
+        return results
+
+    def __len__(self):
+        return len(self.steps)
@@ -0,0 +1,213 @@
+import logging
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import monotonic, sleep, strftime
+from urllib.parse import parse_qs, urlparse
+
+
+# Seconds between stack samples of all threads
+SAMPLE_INTERVAL = 0.01
+
+# Frames kept per allocation while tracemalloc runs
+TRACEMALLOC_FRAMES = 1
+
+# Longest profile, requests for longer ones are cut short
+MAX_SECONDS = 300
+
+# Lines per section of a report
+TOP = 30
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def sample_stacks(stacks, names, own_ident):
+    """Count the current stack of every thread but our own."""
+    for ident, frame in sys._current_frames().items():
+        if ident == own_ident:
+            continue
+        stack = []
+        while frame is not None:
+            stack.append(get_frame_name(frame))
+            frame = frame.f_back
+        stack.append(names.get(ident) or str(ident))
+        stacks[tuple(reversed(stack))] += 1
+
+
+def format_report(seconds, samples, stacks, snapshot):
+    lines = ['# memcached-operator profile of {:.1f}s, {} samples'.format(
+        seconds, samples)]
+
+    # Frames on top of the stack, idle threads show up as waiting
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack[-1]] += count
+    total = sum(leaves.values()) or 1
+    lines += ['', '## Top frames by thread samples']
+    lines += ['{:>8} {:>6.1%}  {}'.format(count, count / total, name)
+              for name, count in leaves.most_common(TOP)]
+
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        statistics = snapshot.statistics('lineno')
+        lines += ['', '## Top allocations, {:.1f} KiB in {} blocks'.format(
+            sum(stat.size for stat in statistics) / 1024,
+            sum(stat.count for stat in statistics))]
+        lines += ['{:>10.1f} KiB {:>8} blocks  {}'.format(
+            stat.size / 1024, stat.count, stat.traceback)
+            for stat in statistics[:TOP]]
+
+    # Collapsed stacks, the input format of flamegraph.pl
+    lines += ['', '## Stacks']
+    lines += ['{} {}'.format(';'.join(stack), count)
+              for stack, count in sorted(stacks.items())]
+    return '\n'.join(lines) + '\n'
+
+
+class Profiler(object):
+    """Sample where the operator spends its time and allocates memory.
+
+    Stacks of all threads are sampled every SAMPLE_INTERVAL seconds,
+    unlike cProfile this includes the workers and informers and costs
+    little while running. Allocations are traced meanwhile, unless
+    tracemalloc was started with the operator already. In that case
+    the snapshot covers all memory still allocated.
+
+    One profile runs at a time, each is written to its own file.
+    """
+
+    def __init__(self, directory='/tmp', seconds=30):
+        self._lock = threading.Lock()
+        self.running = False
+        self.configure(directory, seconds)
+
+    def configure(self, directory='/tmp', seconds=30):
+        self.directory = directory
+        self.seconds = float(seconds)
+
+    def start(self, seconds=None):
+        """Profile in a background thread, False if already profiling."""
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+        threading.Thread(
+            name='Profiler',
+            target=self._profile,
+            args=(seconds,),
+            daemon=True).start()
+        return True
+
+    def profile(self, seconds=None):
+        """Profile for seconds, return the report or None if busy."""
+        with self._lock:
+            if self.running:
+                return None
+            self.running = True
+        return self._profile(seconds)
+
+    def _profile(self, seconds=None):
+        try:
+            seconds = min(float(seconds or self.seconds), MAX_SECONDS)
+            logging.info('profiling for {}s'.format(seconds))
+            trace_allocations = not tracemalloc.is_tracing()
+            if trace_allocations:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+
+            stacks = Counter()
+            samples = 0
+            own_ident = threading.get_ident()
+            deadline = monotonic() + seconds
+            try:
+                while monotonic() < deadline:
+                    names = dict((thread.ident, thread.name)
+                                 for thread in threading.enumerate())
+                    sample_stacks(stacks, names, own_ident)
+                    samples += 1
+                    sleep(SAMPLE_INTERVAL)
+                snapshot = tracemalloc.take_snapshot()
+            finally:
+                if trace_allocations:
+                    tracemalloc.stop()
+
+            report = format_report(seconds, samples, stacks, snapshot)
+            self.write(report)
+            return report
+        except Exception as e:
+            # Profiling must never take the operator down
+            logging.exception(e)
+            return None
+        finally:
+            with self._lock:
+                self.running = False
+
+    def write(self, report):
+        path = os.path.join(
+            self.directory,
+            'memcached-operator-{}.profile'.format(strftime('%Y%m%d-%H%M%S')))
+        try:
+            with open(path, 'w') as profile_file:
+                profile_file.write(report)
+        except (IOError, OSError) as e:
+            logging.exception(e)
+            return None
+        logging.info('wrote profile to {}'.format(path))
+        return path
+
+
+PROFILER = Profiler()
+
+
+class ProfileHandler(BaseHTTPRequestHandler):
+    """Serve GET /debug/profile?seconds=N with a fresh profile."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/debug/profile':
+            self.send_error(404)
+            return
+        try:
+            seconds = float(parse_qs(url.query).get('seconds', [0])[0])
+        except ValueError:
+            self.send_error(400, 'seconds must be a number')
+            return
+
+        report = PROFILER.profile(seconds)
+        if report is None:
+            self.send_error(409, 'profile in progress or failed')
+            return
+        body = report.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info('profile request: {}'.format(format % args))
+
+
+class ProfileServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_profile_server(port, addr='127.0.0.1'):
+    # Anyone reaching the port can keep the operator busy profiling, so
+    # only local clients can by default
+    server = ProfileServer((addr, int(port)), ProfileHandler)
+    threading.Thread(
+        name='ProfileServer',
+        target=server.serve_forever,
+        daemon=True).start()
+    return server
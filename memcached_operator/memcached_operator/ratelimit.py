@@ -0,0 +1,107 @@
+import logging
+import threading
+from time import monotonic, sleep
+
+from kubernetes import client
+from urllib3.util import parse_url
+
+from .metrics import RATE_LIMITER_DELAY, get_api_verb_and_resource
+
+
+# Retries of requests the apiserver rejected with 429 Too Many Requests
+MAX_RETRIES = 3
+
+# Retry-After bounds in seconds, the apiserver usually sends 1
+DEFAULT_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+# Leader election and shard leases must be renewed within seconds, their
+# requests skip the limiter and any pause
+UNLIMITED_PATH_PREFIXES = ('/apis/coordination.k8s.io/',)
+
+
+class TokenBucket(object):
+    """Allow `qps` requests per second in bursts of up to `burst`.
+
+    Callers reserve a token and sleep until it becomes available, so
+    concurrent callers are served in order. pause() holds back all
+    callers, for example when the apiserver asked us to retry later.
+    """
+
+    def __init__(self, qps, burst=None, clock=monotonic, sleep=sleep):
+        self.qps = float(qps)
+        self.burst = max(int(burst or self.qps), 1)
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._paused_until = 0
+
+    def acquire(self):
+        """Block until the next request may be sent, return the delay."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self._tokens + (now - self._updated) * self.qps, self.burst)
+            self._updated = now
+            self._tokens -= 1
+            delay = max(-self._tokens / self.qps, self._paused_until - now)
+        RATE_LIMITER_DELAY.observe(max(delay, 0))
+        if delay > 0:
+            self.sleep(delay)
+        return max(delay, 0)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, self.clock() + seconds)
+
+
+def get_retry_after(api_exception):
+    headers = api_exception.headers or {}
+    try:
+        retry_after = int(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        retry_after = DEFAULT_RETRY_AFTER
+    return min(max(retry_after, 0), MAX_RETRY_AFTER)
+
+
+def is_limited(method, url, query_params):
+    verb, _ = get_api_verb_and_resource(method, url, query_params)
+    if verb == 'WATCH':
+        return False
+    return not (parse_url(url).path or '').startswith(
+        UNLIMITED_PATH_PREFIXES)
+
+
+def limit_rest_client(rest_client, limiter, max_retries=MAX_RETRIES):
+    """Send all requests of a RESTClientObject through limiter.
+
+    Requests rejected with 429 pause the limiter for their Retry-After
+    and are sent again. Watches stay open for minutes and are not
+    limited, neither are Lease requests. A pause while throttled must not
+    make the leader miss its renew deadline.
+    """
+    request = rest_client.request
+
+    def limited_request(method, url, query_params=None, *args, **kwargs):
+        if not is_limited(method, url, query_params):
+            return request(method, url, query_params, *args, **kwargs)
+
+        retries = 0
+        while True:
+            limiter.acquire()
+            try:
+                return request(method, url, query_params, *args, **kwargs)
+            except client.rest.ApiException as e:
+                if e.status != 429 or retries >= max_retries:
+                    raise
+                retries += 1
+                retry_after = get_retry_after(e)
+                logging.info('throttled by the apiserver, retrying {} {} '
+                             'in {}s'.format(method, url, retry_after))
+                limiter.pause(retry_after)
+
+    rest_client.request = limited_request
+    return rest_client
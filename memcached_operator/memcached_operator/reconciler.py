@@ -0,0 +1,113 @@
+import logging
+
+from kubernetes import client
+
+from .events import delete
+from .informers import MEMCACHED_STORE, caches_synced, split_resource_key
+from .kubernetes_helpers import (get_namespaced_memcached_object,
+                                 update_memcached_status)
+from .kubernetes_resources import forget_rendered, is_generation_observed
+from .metrics import WORK_IN_FLIGHT, STARTUP_TIMER
+from .periodical import check_cluster, has_unowned_children
+from .scope import SCOPE
+from .sharding import SHARDS
+from .tracing import TRACER
+
+
+# Seconds workers wait between checks of the informer caches at startup
+CACHE_SYNC_POLL = 0.1
+
+
+def reconcile(key, server_side_apply=False):
+    name, namespace = split_resource_key(key)
+    cluster_object = MEMCACHED_STORE.get(name, namespace)
+
+    if cluster_object is None:
+        forget_rendered(name, namespace)
+        if not has_unowned_children(name, namespace):
+            # The kubernetes garbage collector deletes owned resources
+            return True
+        if SCOPE.label_selector and cluster_exists(name, namespace):
+            # Relabeled out of our selector, another operator instance
+            # manages the cluster now
+            return True
+        # Cluster was deleted, remove its resources
+        return delete({'metadata': {'name': name, 'namespace': namespace}})
+
+    # Create missing and update outdated resources
+    if not check_cluster(cluster_object, server_side_apply):
+        return False
+
+    return observe_generation(cluster_object)
+
+
+def cluster_exists(name, namespace):
+    try:
+        get_namespaced_memcached_object(name, namespace)
+    except client.rest.ApiException as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+
+def observe_generation(cluster_object):
+    if is_generation_observed(cluster_object):
+        return True
+
+    # Tell users and tools the current spec has been rolled out
+    metadata = cluster_object['metadata']
+    return bool(update_memcached_status(
+        metadata['name'],
+        metadata['namespace'],
+        {'observedGeneration': metadata['generation']}))
+
+
+def worker(shutting_down, queue, server_side_apply=False):
+    logging.info('thread started')
+    while not shutting_down.isSet():
+        if not caches_synced():
+            # Children missing from incomplete caches would all be created
+            # again, wait for the initial lists
+            shutting_down.wait(CACHE_SYNC_POLL)
+            continue
+
+        key = queue.get(timeout=1)
+        if key is None:
+            continue
+
+        process_key(queue, key, server_side_apply)
+    else:
+        logging.info('thread stopped')
+
+
+def process_key(queue, key, server_side_apply=False):
+    if not SHARDS.owns(key):
+        # Another operator replica is responsible for this cluster, or we
+        # stand by for the leader. Neither counts as a reconcile
+        queue.forget(key)
+        queue.done(key)
+        return True
+
+    try:
+        with WORK_IN_FLIGHT.track_inprogress(), \
+                TRACER.trace('reconcile {}'.format(key), key,
+                             'reconcile') as span:
+            success = reconcile(key, server_side_apply)
+            span.set_result(success)
+    except Exception as e:
+        # Last resort: catch all exceptions to keep the worker alive
+        logging.exception(e)
+        success = False
+
+    try:
+        if success:
+            STARTUP_TIMER.reconciled()
+            queue.forget(key)
+        else:
+            logging.info('retrying {} after {} failures'.format(
+                key, queue.num_requeues(key) + 1))
+            queue.add_rate_limited(key)
+    finally:
+        queue.done(key)
+    return success
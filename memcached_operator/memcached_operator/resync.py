@@ -0,0 +1,145 @@
+import logging
+import math
+import random
+from time import monotonic
+
+from .informers import get_resource_key
+from .metrics import API_PRESSURE, RESYNC_INTERVAL
+from .sharding import get_hash
+
+
+RESYNC_INTERVAL_ANNOTATION = 'memcached.operator.kubestack.com/resync-interval'
+
+# Resync at most this many clusters per second by default
+RESYNC_RATE = 100
+
+# Mean apiserver latency above which resyncs slow down
+LATENCY_TARGET = 0.5
+
+MAX_BACKOFF = 16
+
+# Backoff kept after each interval without throttling or slow responses
+BACKOFF_DECAY = 0.5
+
+
+def get_resync_interval(cluster_object):
+    """Return the interval a cluster requested by annotation, if any."""
+    annotations = cluster_object['metadata'].get('annotations') or {}
+    value = annotations.get(RESYNC_INTERVAL_ANNOTATION)
+    if value is None:
+        return None
+    try:
+        interval = float(value)
+    except ValueError:
+        interval = 0
+    # NaN compares false to everything and would never come due
+    if not math.isfinite(interval) or interval < 1:
+        logging.warning('ignoring {} annotation of {}: {!r}'.format(
+            RESYNC_INTERVAL_ANNOTATION, get_resource_key(cluster_object),
+            value))
+        return None
+    return interval
+
+
+def get_phase(key):
+    # Stable position of a cluster within the interval, between 0 and 1
+    return get_hash(key) % 10000 / 10000
+
+
+class AdaptiveInterval(object):
+    """Interval between routine resyncs of a cluster.
+
+    The interval is long enough to resync the fleet at `resync_rate`
+    clusters per second, but never shorter than `min_seconds`. 429
+    responses double it and slow apiserver responses stretch it by a
+    quarter. Every full interval without either halves that backoff
+    again, so that it lasts long enough for the apiserver to recover.
+    It never exceeds `max_seconds`, which is at least `min_seconds`.
+    """
+
+    def __init__(self, min_seconds, max_seconds=None, resync_rate=None,
+                 latency_target=LATENCY_TARGET, pressure=API_PRESSURE):
+        self.min_seconds = float(min_seconds)
+        self.max_seconds = float(max_seconds or self.min_seconds)
+        if self.max_seconds < self.min_seconds:
+            logging.warning(
+                'raising the maximum resync interval of {}s to the '
+                'minimum of {}s'.format(self.max_seconds, self.min_seconds))
+            self.max_seconds = self.min_seconds
+        self.resync_rate = float(resync_rate or RESYNC_RATE)
+        self.latency_target = latency_target
+        self.pressure = pressure
+        self.backoff = 1.0
+        self.healthy_since = None
+        self.seconds = self.min_seconds
+        RESYNC_INTERVAL.set(self.seconds)
+
+    def update(self, fleet_size, now=None):
+        if now is None:
+            now = monotonic()
+        if self.healthy_since is None:
+            self.healthy_since = now
+
+        requests, latency, throttled = self.pressure.collect()
+        if throttled:
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+            self.healthy_since = now
+        elif requests and latency > self.latency_target:
+            self.backoff = min(self.backoff * 1.25, MAX_BACKOFF)
+            self.healthy_since = now
+        elif now - self.healthy_since >= self.seconds:
+            self.backoff = max(self.backoff * BACKOFF_DECAY, 1.0)
+            self.healthy_since = now
+
+        seconds = max(self.min_seconds, fleet_size / self.resync_rate)
+        self.seconds = min(seconds * self.backoff, self.max_seconds)
+        RESYNC_INTERVAL.set(self.seconds)
+        return self.seconds
+
+
+class ResyncSchedule(object):
+    """Spread routine resyncs of all clusters over the interval.
+
+    Clusters get a stable phase within the interval from the hash of
+    their key, so they aren't resynced in one burst. Every resync is
+    then moved by up to half the jitter in either direction, so that
+    clusters don't stay locked to each other. When a cluster's interval
+    changes, its pending resync is stretched or shrunk to match.
+    """
+
+    def __init__(self, interval, jitter=0.2, rand=random):
+        self.interval = interval
+        self.jitter = jitter
+        self.rand = rand
+        # Key to (scheduled at, due time, interval) of the next resync
+        self._due = {}
+
+    def get_due(self, cluster_objects, now):
+        """Return the clusters whose resync is due."""
+        due = []
+        due_times = {}
+        for cluster_object in cluster_objects:
+            key = get_resource_key(cluster_object)
+            interval = self.get_interval(cluster_object)
+            scheduled = self._due.get(key)
+            if scheduled is None:
+                # First seen, start somewhere within the interval
+                scheduled = (now, now + get_phase(key) * interval, interval)
+            elif scheduled[2] != interval:
+                # Keep phase and jitter, scale the wait to the new interval
+                start, due_time, previous = scheduled
+                scheduled = (start,
+                             start + (due_time - start) * interval / previous,
+                             interval)
+            if scheduled[1] <= now and key in self._due:
+                due.append(cluster_object)
+                scheduled = (now, now + interval * (
+                    1 + self.jitter * (self.rand.random() - 0.5)), interval)
+            due_times[key] = scheduled
+        # Forget deleted clusters
+        self._due = due_times
+        return due
+
+    def get_interval(self, cluster_object):
+        return (get_resync_interval(cluster_object) or
+                self.interval.seconds)
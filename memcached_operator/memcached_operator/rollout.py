@@ -0,0 +1,146 @@
+import threading
+from collections import OrderedDict
+
+from .informers import DEPLOYMENT_STORE
+from .metrics import ROLLOUTS_IN_PROGRESS
+
+
+# Deployments rolling out operator initiated template changes at once
+MAX_ROLLING = 10
+
+# Slot reserved for an update that hasn't returned yet
+PENDING = object()
+
+
+def get_generation(deployment):
+    if isinstance(deployment, dict):
+        generation = deployment.get('metadata', {}).get('generation')
+    else:
+        generation = getattr(getattr(deployment, 'metadata', None),
+                             'generation', None)
+    return generation if isinstance(generation, int) else None
+
+
+def get_rollout_status(deployment):
+    """Return desired, observed generation, current, updated and available.
+
+    Deployments from the informer cache are kubernetes client models,
+    rendered ones are plain dicts.
+    """
+    if isinstance(deployment, dict):
+        spec = deployment.get('spec') or {}
+        status = deployment.get('status') or {}
+        return (spec.get('replicas') or 0,
+                status.get('observedGeneration') or 0,
+                status.get('replicas') or 0,
+                status.get('updatedReplicas') or 0,
+                status.get('availableReplicas') or 0)
+
+    status = deployment.status
+    if status is None:
+        return (deployment.spec.replicas or 0, 0, 0, 0, 0)
+    return (deployment.spec.replicas or 0,
+            status.observed_generation or 0,
+            status.replicas or 0,
+            status.updated_replicas or 0,
+            status.available_replicas or 0)
+
+
+def is_rolled_out(deployment, generation=None):
+    """Check a deployment like `kubectl rollout status` does."""
+    generation = max(generation or 0, get_generation(deployment) or 0)
+    desired, observed, replicas, updated, available = get_rollout_status(
+        deployment)
+    return (observed >= generation and
+            updated >= desired and
+            replicas <= updated and
+            available >= updated)
+
+
+class RolloutGate(object):
+    """Limit how many deployments roll out template changes at once.
+
+    A change to the rendered templates or a new operator version
+    outdates every deployment of the fleet. Updating them all at once
+    would restart every memcached pod together, so only `max_rolling`
+    deployments may roll at a time. A rollout holds its slot until the
+    deployment is available again, a rollout that never finishes halts
+    the remaining ones.
+
+    Clusters whose update was deferred are queued again in the order they
+    waited once slots are free, instead of after their retry backoff.
+    """
+
+    def __init__(self, max_rolling=MAX_ROLLING, store=DEPLOYMENT_STORE):
+        self.max_rolling = int(max_rolling)
+        self.store = store
+        self._lock = threading.Lock()
+        self._rolling = {}
+        self._deferred = OrderedDict()
+
+    def configure(self, max_rolling):
+        self.max_rolling = int(max_rolling)
+
+    def try_start(self, name, namespace, cluster_key=None):
+        """Reserve a slot for updating a deployment, False if none is free.
+
+        The cluster_key of a deferred update is handed to requeue_deferred
+        once a slot is free.
+        """
+        with self._lock:
+            self._prune()
+            key = (namespace, name)
+            if key in self._rolling:
+                return True
+            if len(self._rolling) >= self.max_rolling:
+                if cluster_key is not None:
+                    self._deferred[cluster_key] = True
+                return False
+            self._rolling[key] = PENDING
+            ROLLOUTS_IN_PROGRESS.set(len(self._rolling))
+            return True
+
+    def started(self, name, namespace, deployment):
+        """Remember the generation the update produced."""
+        with self._lock:
+            key = (namespace, name)
+            if key in self._rolling:
+                self._rolling[key] = get_generation(deployment)
+
+    def cancel(self, name, namespace):
+        # The update failed, nothing is rolling
+        with self._lock:
+            self._rolling.pop((namespace, name), None)
+            ROLLOUTS_IN_PROGRESS.set(len(self._rolling))
+
+    def requeue_deferred(self, queue):
+        """Queue as many deferred clusters as slots are free."""
+        with self._lock:
+            if not self._deferred:
+                return
+            self._prune()
+            free = self.max_rolling - len(self._rolling)
+            cluster_keys = []
+            while self._deferred and len(cluster_keys) < free:
+                cluster_keys.append(self._deferred.popitem(last=False)[0])
+        for cluster_key in cluster_keys:
+            queue.add(cluster_key)
+
+    def _prune(self):
+        for key, generation in list(self._rolling.items()):
+            if generation is PENDING:
+                continue
+            namespace, name = key
+            deployment = self.store.get(name, namespace)
+            # Deleted deployments don't roll anymore
+            if deployment is None or is_rolled_out(deployment, generation):
+                del self._rolling[key]
+        ROLLOUTS_IN_PROGRESS.set(len(self._rolling))
+
+    def __len__(self):
+        with self._lock:
+            self._prune()
+            return len(self._rolling)
+
+
+ROLLOUTS = RolloutGate()
@@ -0,0 +1,40 @@
+class Scope(object):
+    """The namespaces and Memcached labels this operator instance manages.
+
+    Without namespaces the operator watches the whole cluster. A single
+    watch covers one namespace or all of them, so every namespace gets
+    its own informers and event listener.
+    """
+
+    def __init__(self):
+        self.namespaces = None
+        self.label_selector = None
+
+    def configure(self, namespaces=None, label_selector=None):
+        self.namespaces = sorted(set(namespaces)) if namespaces else None
+        self.label_selector = label_selector or None
+
+    def get_namespaces(self):
+        # None stands for all namespaces
+        return self.namespaces or [None]
+
+
+SCOPE = Scope()
+
+
+def get_list_kwargs(namespace=None, label_selector=None):
+    """Return the arguments restricting a list or watch call."""
+    list_kwargs = {}
+    if namespace is not None:
+        list_kwargs['namespace'] = namespace
+    if label_selector is not None:
+        list_kwargs['label_selector'] = label_selector
+    return list_kwargs
+
+
+def parse_namespaces(value):
+    """Split a comma separated list of namespaces."""
+    if not value:
+        return None
+    return [namespace.strip() for namespace in value.split(',')
+            if namespace.strip()]
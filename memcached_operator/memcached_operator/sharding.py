@@ -0,0 +1,176 @@
+import bisect
+import hashlib
+import logging
+import threading
+from time import monotonic
+
+from .kubernetes_helpers import list_lease_object, renew_lease, delete_lease
+from .kubernetes_resources import get_lease_object
+from .metrics import SHARD_MEMBERS
+
+
+SHARD_LABEL = 'memcached.operator.kubestack.com/shard'
+
+
+def get_hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """Consistent hash ring mapping cluster keys to operator replicas.
+
+    Every member is placed on the ring many times, so keys spread evenly
+    and only the keys of a member that joins or leaves move.
+    """
+
+    def __init__(self, members, points=64):
+        self.members = frozenset(members)
+        ring = sorted(
+            (get_hash('{}-{}'.format(member, i)), member)
+            for member in self.members for i in range(points))
+        self._hashes = [h for h, _ in ring]
+        self._members = [member for _, member in ring]
+
+    def get_member(self, key):
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, get_hash(key)) % len(self._hashes)
+        return self._members[i]
+
+
+class Shards(object):
+    """The clusters this operator replica is responsible for.
+
+    Without a ring, that is unless sharding is enabled, the replica owns
+    all clusters. Inactive replicas, like leader election standbys, own
+    none.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.identity = None
+        self.ring = None
+        self.active = True
+
+    def owns(self, key):
+        with self._lock:
+            if not self.active:
+                return False
+            ring = self.ring
+            identity = self.identity
+        return ring is None or ring.get_member(key) == identity
+
+    def set_active(self, active):
+        with self._lock:
+            self.active = active
+
+    def set_members(self, identity, members):
+        """Rebuild the ring, return True if the members changed."""
+        with self._lock:
+            if (self.ring is not None and identity == self.identity and
+                    self.ring.members == frozenset(members)):
+                return False
+            self.identity = identity
+            self.ring = HashRing(members)
+        SHARD_MEMBERS.set(len(members))
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.identity = None
+            self.ring = None
+
+
+SHARDS = Shards()
+
+
+class ShardMembership(object):
+    """Announce this replica with a Lease and track the other replicas.
+
+    Replicas are alive while the renewTime of their lease keeps changing.
+    Like client-go we time that with our own clock, so clock skew between
+    nodes doesn't matter.
+
+    Until the first renewal succeeds the replica owns no clusters, and it
+    drops them again once renewals keep failing for the renew deadline.
+    By the time the others consider its lease expired and take over, it
+    stopped writing.
+    """
+
+    def __init__(self, identity, namespace, lease_duration, shards=SHARDS):
+        self.identity = identity
+        self.namespace = namespace
+        self.lease_duration = int(lease_duration)
+        # Stop writing well before the others consider the lease expired
+        self.renew_deadline = self.lease_duration * 2 / 3
+        self.lease_name = 'memcached-operator-shard-{}'.format(identity)
+        self.shards = shards
+        self.observed = {}
+        self.renewed_at = None
+
+        # Own nothing until we know the other replicas
+        self.shards.set_members(identity, ())
+
+    def run(self, shutting_down, queue, rebalance):
+        logging.info('thread started')
+        while not shutting_down.isSet():
+            try:
+                self.sync(queue, rebalance)
+            except Exception as e:
+                # Last resort: catch all exceptions to keep the thread alive
+                logging.exception(e)
+            shutting_down.wait(self.lease_duration / 3)
+        else:
+            # Let the other replicas take over our clusters right away
+            delete_lease(self.lease_name, self.namespace)
+            logging.info('thread stopped')
+
+    def sync(self, queue, rebalance):
+        now = monotonic()
+        lease_object = get_lease_object(
+            self.lease_name,
+            self.namespace,
+            self.identity,
+            self.lease_duration,
+            labels={SHARD_LABEL: 'true'})
+        if not renew_lease(lease_object):
+            # Keep the current shards while the others still count us in
+            if (self.renewed_at is not None and
+                    now - self.renewed_at >= self.renew_deadline):
+                logging.warning('unable to renew lease/{} in ns/{}, '
+                                'dropping all clusters'.format(
+                                    self.lease_name, self.namespace))
+                self.renewed_at = None
+                self.shards.set_members(self.identity, ())
+            return
+
+        self.renewed_at = now
+        members = self.get_live_members()
+        if self.shards.set_members(self.identity, members):
+            logging.info('sharding clusters between {}'.format(
+                ', '.join(sorted(members))))
+            # Pick up the clusters we just became responsible for
+            rebalance(queue)
+
+    def get_live_members(self):
+        lease_list = list_lease_object(
+            self.namespace, '{}=true'.format(SHARD_LABEL))
+        now = monotonic()
+        members = {self.identity}
+        observed = {}
+        for lease in lease_list.items:
+            holder = lease.spec.holder_identity
+            if not holder or holder == self.identity:
+                continue
+
+            renew_time, observed_at = self.observed.get(holder, (None, now))
+            if lease.spec.renew_time != renew_time:
+                observed_at = now
+            observed[holder] = (lease.spec.renew_time, observed_at)
+
+            lease_duration = (
+                lease.spec.lease_duration_seconds or self.lease_duration)
+            if now - observed_at < lease_duration:
+                members.add(holder)
+        self.observed = observed
+        return members
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from .informers import get_resource_metadata
+
+
+STATE_FORMAT_VERSION = 1
+
+
+def get_version(resource):
+    """Return the version of a child that changes with every edit.
+
+    Deployments bump their generation on spec changes only, so status
+    updates during a rollout don't count. Services have no generation,
+    their resourceVersion changes with any write.
+    """
+    if isinstance(resource, dict):
+        metadata = resource.get('metadata') or {}
+        version = metadata.get('generation') or metadata.get(
+            'resourceVersion')
+    else:
+        metadata = getattr(resource, 'metadata', None)
+        version = (getattr(metadata, 'generation', None) or
+                   getattr(metadata, 'resource_version', None))
+    if isinstance(version, (int, str)) and not isinstance(version, bool):
+        return str(version)
+    return None
+
+
+class ChildVersions(object):
+    """Versions of the services and deployments the operator wrote last.
+
+    Someone scaling a deployment by hand leaves the desired state hash
+    annotation untouched. A child whose version differs from the one
+    our own create or patch returned was edited by someone else and is
+    outdated. Up to date children we didn't write are adopted with
+    their current version, the state file carries versions over
+    restarts so that edits made in between are noticed too.
+
+    Watch events of our own writes may arrive before the write returned
+    its version. Children are marked while we write them, so that those
+    events don't count as edits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._writing = {}
+
+    def record(self, kind, resource):
+        version = get_version(resource)
+        if version is None:
+            return
+        name, namespace, _, _ = get_resource_metadata(resource)
+        with self._lock:
+            self._versions[(kind, namespace, name)] = version
+
+    def adopt(self, kind, resource):
+        """Start tracking an up to date child we didn't write."""
+        version = get_version(resource)
+        if version is None:
+            return
+        name, namespace, _, _ = get_resource_metadata(resource)
+        with self._lock:
+            self._versions.setdefault((kind, namespace, name), version)
+
+    @contextmanager
+    def writing(self, kind, name, namespace):
+        """Mark a child as ours until the write and record are done."""
+        key = (kind, namespace, name)
+        with self._lock:
+            self._writing[key] = self._writing.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._writing[key] -= 1
+                if not self._writing[key]:
+                    del self._writing[key]
+
+    def forget(self, kind, name, namespace):
+        with self._lock:
+            self._versions.pop((kind, namespace, name), None)
+
+    def is_modified(self, kind, resource):
+        name, namespace, _, _ = get_resource_metadata(resource)
+        key = (kind, namespace, name)
+        with self._lock:
+            if key in self._writing:
+                return False
+            version = self._versions.get(key)
+        return version is not None and version != get_version(resource)
+
+    def dump(self):
+        with self._lock:
+            return {'version': STATE_FORMAT_VERSION,
+                    'children': ['/'.join(key) + '=' + version
+                                 for key, version in sorted(
+                                     self._versions.items())]}
+
+    def restore(self, state):
+        versions = {}
+        for child in state.get('children', []):
+            key, version = child.rsplit('=', 1)
+            kind, namespace, name = key.split('/', 2)
+            versions[(kind, namespace, name)] = version
+        with self._lock:
+            self._versions = versions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._versions)
+
+
+CHILD_VERSIONS = ChildVersions()
+
+
+def save_state(path, versions=CHILD_VERSIONS):
+    """Write versions to path, replacing it atomically."""
+    tmp_path = '{}.tmp'.format(path)
+    try:
+        with open(tmp_path, 'w') as state_file:
+            json.dump(versions.dump(), state_file)
+        os.replace(tmp_path, path)
+    except (IOError, OSError) as e:
+        logging.exception(e)
+        return False
+    return True
+
+
+def load_state(path, versions=CHILD_VERSIONS):
+    """Restore versions saved by a previous operator process."""
+    try:
+        with open(path) as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        logging.info('no state file at {}, starting fresh'.format(path))
+        return False
+    except (IOError, OSError, ValueError) as e:
+        logging.exception(e)
+        return False
+
+    if state.get('version') != STATE_FORMAT_VERSION:
+        logging.warning('ignoring state file {} of version {}'.format(
+            path, state.get('version')))
+        return False
+    versions.restore(state)
+    logging.info('restored {} child versions from {}'.format(
+        len(versions), path))
+    return True
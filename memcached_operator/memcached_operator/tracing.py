@@ -0,0 +1,264 @@
+import functools
+import json
+import logging
+import os
+import random
+import threading
+from binascii import hexlify
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic, time
+
+
+SERVICE_NAME = 'memcached-operator'
+SCOPE_NAME = 'memcached_operator'
+
+# OpenTelemetry span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def get_id(size):
+    return hexlify(os.urandom(size)).decode('ascii')
+
+
+def get_attribute_value(value):
+    """Encode an attribute value like OTLP/JSON does."""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP/JSON
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Trace(object):
+    """Spans of one reconcile, exported together once the root ends."""
+
+    def __init__(self, cluster):
+        self.trace_id = get_id(16)
+        self.cluster = cluster
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+class Span(object):
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start',
+                 'end', 'started', 'attributes', 'status', 'message')
+
+    def __init__(self, trace, name, verb, parent_id=None,
+                 kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = get_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = int(time() * 1e9)
+        self.end = None
+        self.started = monotonic()
+        self.attributes = {'memcached.cluster': trace.cluster,
+                           'memcached.verb': verb}
+        self.attributes.update(attributes or {})
+        self.status = STATUS_UNSET
+        self.message = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_result(self, result, ok=None):
+        """Record a result, falsy results are errors unless ok is given."""
+        self.attributes['memcached.result'] = str(result)
+        if ok is None:
+            ok = bool(result)
+        self.status = STATUS_OK if ok else STATUS_ERROR
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.message = '{}: {}'.format(type(error).__name__, error)
+
+    def finish(self):
+        # Wall clock start plus monotonic duration, robust to clock jumps
+        self.end = self.start + int((monotonic() - self.started) * 1e9)
+        self.trace.add(self)
+
+    @property
+    def duration(self):
+        return (self.end - self.start) / 1e9
+
+    def to_json(self):
+        status = {'code': self.status}
+        if self.message:
+            status['message'] = self.message
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [
+                {'key': key, 'value': get_attribute_value(value)}
+                for key, value in sorted(self.attributes.items())],
+            'status': status}
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class NoopSpan(object):
+    """Stands in for spans of traces that aren't sampled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_result(self, result, ok=None):
+        pass
+
+    def set_error(self, error):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer(object):
+    """Sample reconciles and export their spans as OTLP/JSON lines.
+
+    A sampled reconcile starts a trace, spans started by the same thread
+    while it runs become part of it. Other threads join the trace through
+    `wrap`. Outside of sampled traces spans cost a thread local lookup.
+
+    Each finished trace is one line of the OTLP/JSON file exporter
+    format appended to the trace file. With a buffer size only the latest
+    traces are kept in memory until they are dumped. Traces faster than
+    `min_duration` seconds are dropped, so that only slow reconciles are
+    kept.
+    """
+
+    def __init__(self, sample_rate=0, path=None, min_duration=0,
+                 buffer_size=0):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.configure(sample_rate, path, min_duration, buffer_size)
+
+    def configure(self, sample_rate=0, path=None, min_duration=0,
+                  buffer_size=0):
+        with self._lock:
+            self.sample_rate = float(sample_rate or 0)
+            self.path = path
+            self.min_duration = float(min_duration or 0)
+            self.buffer = None
+            if buffer_size:
+                self.buffer = deque(maxlen=int(buffer_size))
+
+    def current(self):
+        return getattr(self._local, 'span', None)
+
+    @contextmanager
+    def _activate(self, span):
+        parent = self.current()
+        self._local.span = span
+        try:
+            yield span
+        except Exception as e:
+            span.set_error(e)
+            raise
+        finally:
+            self._local.span = parent
+            span.finish()
+
+    def trace(self, name, cluster, verb, attributes=None):
+        """Start a trace for cluster if it is sampled."""
+        # Checked without a generator, unsampled reconciles stay cheap
+        if (not self.sample_rate or self.current() is not None or
+                random.random() >= self.sample_rate):
+            return NOOP_SPAN
+        return self._trace(Span(Trace(cluster), name, verb,
+                                attributes=attributes))
+
+    @contextmanager
+    def _trace(self, span):
+        try:
+            with self._activate(span):
+                yield span
+        finally:
+            self.export(span.trace, span)
+
+    def span(self, name, verb, kind=SPAN_KIND_INTERNAL, attributes=None):
+        """Add a span to the current trace, if there is one."""
+        parent = self.current()
+        if parent is None:
+            return NOOP_SPAN
+        return self._activate(Span(parent.trace, name, verb, parent.span_id,
+                                   kind, attributes))
+
+    def wrap(self, func):
+        """Run func as part of the current trace in another thread."""
+        parent = self.current()
+        if parent is None:
+            return func
+
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            previous, self._local.span = self.current(), parent
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.span = previous
+        return traced
+
+    def export(self, trace, root):
+        if root.duration < self.min_duration:
+            return
+        document = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name',
+                 'value': get_attribute_value(SERVICE_NAME)}]},
+            'scopeSpans': [{
+                'scope': {'name': SCOPE_NAME},
+                'spans': [span.to_json() for span in trace.spans]}]}]})
+        with self._lock:
+            if self.buffer is not None:
+                self.buffer.append(document)
+                return
+            if not self.path:
+                return
+            try:
+                with open(self.path, 'a') as trace_file:
+                    trace_file.write(document + '\n')
+            except (IOError, OSError) as e:
+                logging.exception(e)
+
+    def dump(self, path=None):
+        """Write the buffered traces to path, the trace file by default."""
+        with self._lock:
+            documents = list(self.buffer or ())
+        try:
+            with open(path or self.path, 'w') as trace_file:
+                for document in documents:
+                    trace_file.write(document + '\n')
+        except (IOError, OSError) as e:
+            logging.exception(e)
+            return False
+        logging.info('wrote {} traces to {}'.format(
+            len(documents), path or self.path))
+        return True
+
+
+TRACER = Tracer()
+
@@ -0,0 +1,148 @@
+import heapq
+import itertools
+import threading
+from collections import deque
+from time import monotonic
+
+
+# Missing children and spec changes first, then drifted children, then
+# routine resyncs
+PRIORITY_URGENT = 0
+PRIORITY_DRIFTED = 1
+PRIORITY_RESYNC = 2
+PRIORITIES = (PRIORITY_URGENT, PRIORITY_DRIFTED, PRIORITY_RESYNC)
+
+
+class WorkQueue(object):
+    """Deduplicating priority work queue of cluster keys.
+
+    A key is queued at most once while it is pending and handed to at
+    most one worker at a time. Keys added while they are processed are
+    queued again once the worker calls done(). Failed keys can be
+    requeued with a per key exponential backoff.
+
+    Keys are handed out by priority and in order within a priority.
+    Adding a pending key with a higher priority moves it up, its old
+    entry is skipped once it comes up.
+    """
+
+    def __init__(self, base_delay=0.5, max_delay=300):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._queues = [deque() for _ in PRIORITIES]
+        # Priority of keys to process and of keys being processed
+        self._dirty = {}
+        self._processing = {}
+        self._queued = set()
+        self._waiting = []
+        self._counter = itertools.count()
+        self._failures = {}
+        self._shutting_down = False
+
+    def add(self, key, priority=PRIORITY_RESYNC):
+        with self._cond:
+            self._add(key, priority)
+
+    def add_after(self, key, delay, priority=PRIORITY_RESYNC):
+        with self._cond:
+            if self._shutting_down:
+                return
+            heapq.heappush(
+                self._waiting,
+                (monotonic() + delay, next(self._counter), key, priority))
+            self._notify()
+
+    def add_rate_limited(self, key):
+        with self._cond:
+            failures = self._failures.get(key, 0)
+            self._failures[key] = failures + 1
+            # Retries keep the priority the key was handed out with
+            priority = self._processing.get(key, PRIORITY_RESYNC)
+        self.add_after(
+            key, min(self.base_delay * 2 ** failures, self.max_delay),
+            priority)
+
+    def forget(self, key):
+        with self._cond:
+            self._failures.pop(key, None)
+
+    def num_requeues(self, key):
+        with self._cond:
+            return self._failures.get(key, 0)
+
+    def get(self, timeout=None):
+        """Return the next key or None on timeout and shutdown."""
+        with self._cond:
+            deadline = None if timeout is None else monotonic() + timeout
+            while True:
+                self._promote_waiting()
+                key = self._pop()
+                if key is not None:
+                    return key
+
+                if self._shutting_down:
+                    return None
+
+                wait = None
+                if self._waiting:
+                    wait = self._waiting[0][0] - monotonic()
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def done(self, key):
+        with self._cond:
+            self._processing.pop(key, None)
+            if key in self._dirty:
+                self._queued.add(key)
+                self._queues[self._dirty[key]].append(key)
+                self._notify()
+
+    def shut_down(self):
+        with self._cond:
+            self._shutting_down = True
+            self._notify(wake_all=True)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._queued)
+
+    def _add(self, key, priority):
+        if self._shutting_down:
+            return
+        if key in self._dirty and self._dirty[key] <= priority:
+            return
+        self._dirty[key] = priority
+        if key in self._processing:
+            return
+        self._queued.add(key)
+        self._queues[priority].append(key)
+        self._notify()
+
+    def _pop(self):
+        for priority, queue in zip(PRIORITIES, self._queues):
+            while queue:
+                key = queue.popleft()
+                if key in self._queued and self._dirty[key] == priority:
+                    self._queued.discard(key)
+                    del self._dirty[key]
+                    self._processing[key] = priority
+                    return key
+        return None
+
+    def _notify(self, wake_all=False):
+        # Called with the lock held whenever a key may be ready
+        if wake_all:
+            self._cond.notify_all()
+        else:
+            self._cond.notify()
+
+    def _promote_waiting(self):
+        now = monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, key, priority = heapq.heappop(self._waiting)
+            self._add(key, priority)
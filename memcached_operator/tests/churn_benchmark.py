@@ -0,0 +1,190 @@
+"""Time until the operator repairs changes to a running fleet.
+
+Not collected by nose, run them with pytest-benchmark:
+
+    pytest -s memcached_operator/tests/churn_benchmark.py
+
+A scripted trace of cluster creates, edits and deletes, deleted child
+deployments and injected apiserver errors is replayed against a fake
+apiserver. For every change the time until the apiserver state matches
+the spec again, including the observedGeneration, is recorded.
+"""
+import bisect
+import math
+import random
+from collections import deque
+from itertools import accumulate
+from time import monotonic, sleep
+
+from .fake_apiserver import FakeApiServer
+from .fleet_benchmark import LATENCY, WATCH_TIMEOUT, Operator
+
+
+CLUSTERS = 500
+MUTATIONS = 200
+DURATION = 20
+CHECK_INTERVAL = 25
+POLL_INTERVAL = 0.05
+
+# Seconds for p50 and p99 per action, measured with some headroom.
+# Changes converge within a reconcile, about 0.06s. The p99 includes
+# injected errors, which are retried after 0.5s and then 1s
+BUDGETS = {
+    'create': (0.25, 2),
+    'edit': (0.25, 2),
+    'delete': (0.05, 0.25),
+    'delete_child': (0.25, 2)}
+
+# Missed events are only repaired by the next periodic check, a watch
+# error delays everything by another event listener timeout
+REPLAY_TIMEOUT = 2 * (CHECK_INTERVAL + WATCH_TIMEOUT)
+
+ACTIONS = (
+    ('create', 0.2),
+    ('edit', 0.35),
+    ('delete', 0.15),
+    ('delete_child', 0.2),
+    ('error', 0.1))
+
+ERRORS = (
+    ('POST', 'deployments', 500),
+    ('PATCH', 'deployments', 500),
+    ('POST', 'services', 409),
+    ('PATCH', 'memcacheds', 409),
+    ('LIST', 'memcacheds', 500))
+
+
+def get_churn_trace(clusters=CLUSTERS, mutations=MUTATIONS,
+                    duration=DURATION, seed=0):
+    """Return (offset, action, args) tuples ordered by offset.
+
+    Every existing cluster is changed at most once, so that each change
+    converges on its own.
+    """
+    rand = random.Random(seed)
+    names = ['cluster{}'.format(i) for i in range(clusters)]
+    rand.shuffle(names)
+    actions, weights = zip(*ACTIONS)
+    # random.choices needs Python 3.6
+    cumulative = list(accumulate(weights))
+
+    trace = []
+    for i in range(mutations):
+        offset = round(rand.uniform(0, duration), 3)
+        action = actions[bisect.bisect(
+            cumulative, rand.random() * cumulative[-1])]
+        if action == 'error':
+            args = rand.choice(ERRORS)
+        elif action == 'create':
+            args = ('namespace{}'.format(i % 100), 'churn{}'.format(i))
+        else:
+            name = names.pop()
+            args = ('namespace{}'.format(int(name[7:]) % 100), name)
+        trace.append((offset, action, args))
+    return sorted(trace)
+
+
+def apply(server, action, args):
+    if action == 'error':
+        server.inject_errors(args)
+        return None
+
+    namespace, name = args
+    if action == 'create':
+        server.create('memcacheds', namespace, {
+            'metadata': {'name': name},
+            'spec': {'memcached': {'replicas': 2},
+                     'mcrouter': {'replicas': 1}}})
+    elif action == 'edit':
+        server.patch('memcacheds', namespace, name,
+                     {'spec': {'memcached': {'replicas': 3}}})
+    elif action == 'delete':
+        server.delete('memcacheds', namespace, name)
+    elif action == 'delete_child':
+        server.delete('deployments', namespace, name)
+    return namespace, name
+
+
+def replay(server, trace, timeout):
+    """Apply the trace and return convergence times per action."""
+    durations = {action: [] for action, _ in ACTIONS if action != 'error'}
+    pending = {}
+    trace = deque(trace)
+    start = monotonic()
+    deadline = start + (trace[-1][0] if trace else 0) + timeout
+
+    while trace or pending:
+        while trace and trace[0][0] <= monotonic() - start:
+            _, action, args = trace.popleft()
+            key = apply(server, action, args)
+            if key:
+                pending[key] = (action, monotonic())
+
+        if pending:
+            keys = list(pending)
+            for key, converged in zip(keys, server.converged(keys)):
+                if converged:
+                    action, mutated = pending.pop(key)
+                    durations[action].append(monotonic() - mutated)
+
+        if monotonic() > deadline:
+            raise AssertionError('not converged: {}'.format(
+                sorted('/'.join(key) for key in pending)))
+        sleep(POLL_INTERVAL)
+
+    return durations
+
+
+def percentile(values, percent):
+    # Nearest rank, good enough for a few hundred samples
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(percent / 100 * len(values))) - 1)]
+
+
+def summarize(durations):
+    summary = {}
+    everything = [d for values in durations.values() for d in values]
+    for action, values in sorted(durations.items()) + [('all', everything)]:
+        summary[action] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p99': percentile(values, 99)}
+    return summary
+
+
+def report(summary):
+    print('\nseconds to converge')
+    for action, result in summary.items():
+        if not result['count']:
+            continue
+        print('  {:<14} {:>5} changes  p50 {:>7.3f}  p99 {:>7.3f}'.format(
+            action, result['count'], result['p50'], result['p99']))
+
+
+def test_churn(benchmark):
+    server = FakeApiServer()
+    server.set_latency(LATENCY)
+    server.seed(CLUSTERS)
+    operator = Operator(server, check_interval=CHECK_INTERVAL)
+    try:
+        operator.start()
+        operator.start_workers()
+        operator.settle()
+
+        durations = benchmark.pedantic(
+            replay,
+            args=(server, get_churn_trace(), REPLAY_TIMEOUT),
+            rounds=1)
+    finally:
+        operator.stop()
+        server.stop()
+
+    summary = summarize(durations)
+    benchmark.extra_info.update(summary)
+    report(summary)
+
+    for action, (p50_budget, p99_budget) in sorted(BUDGETS.items()):
+        assert summary[action]['p50'] <= p50_budget, action
+        assert summary[action]['p99'] <= p99_budget, action
@@ -1,121 +1,424 @@
 from unittest.mock import patch, call, MagicMock
 from copy import deepcopy
+from threading import Event
 
-from ..memcached_operator.events import (event_switch, add, modify, delete)
-from ..memcached_operator.kubernetes_resources import (
-    get_mcrouter_service_object,
-    get_memcached_service_object)
+from kubernetes import client
+
+from ..memcached_operator.events import (event_listener, sync_existing,
+                                         event_switch, child_event, delete,
+                                         is_owner_alive)
+from ..memcached_operator.informers import MEMCACHED_STORE
+from ..memcached_operator.scope import SCOPE
+from ..memcached_operator.state import ChildVersions
+from ..memcached_operator.workqueue import (PRIORITY_URGENT,
+                                            PRIORITY_DRIFTED,
+                                            PRIORITY_RESYNC)
 
 class TestEvents():
     def setUp(self):
         self.base_event = {'type': '', 'object': {}}
         self.name = 'testname123'
         self.namespace = 'testnamespace456'
+        self.key = '{}/{}'.format(self.namespace, self.name)
         self.cluster_object = {'metadata':{'name': self.name,
                                            'namespace': self.namespace}}
+        self.queue = MagicMock()
+        MEMCACHED_STORE.replace([])
 
-    @patch('memcached_operator.memcached_operator.events.delete')
-    @patch('memcached_operator.memcached_operator.events.modify')
-    @patch('memcached_operator.memcached_operator.events.add')
     @patch('memcached_operator.memcached_operator.events.logging')
-    def test_malformed_event(self, mock_logging, mock_add, mock_modify, mock_delete):
+    def test_malformed_event(self, mock_logging):
         event = {}
 
-        event_switch(event)
+        event_switch(event, self.queue)
 
         mock_logging.warning.assert_called_once_with('malformed event: {}')
-        assert mock_add.called is False
-        assert mock_modify.called is False
-        assert mock_delete.called is False
-
-    @patch('memcached_operator.memcached_operator.events.delete')
-    @patch('memcached_operator.memcached_operator.events.modify')
-    @patch('memcached_operator.memcached_operator.events.add')
-    def test_add_event(self, mock_add, mock_modify, mock_delete):
+        assert self.queue.add.called is False
+
+    def test_add_event(self):
         event = deepcopy(self.base_event)
         event['type'] = 'ADDED'
+        event['object'] = self.cluster_object
 
-        event_switch(event)
+        event_switch(event, self.queue)
 
-        mock_add.assert_called_once_with({})
-        assert mock_modify.called is False
-        assert mock_delete.called is False
+        assert MEMCACHED_STORE.get(self.name, self.namespace) == self.cluster_object
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_URGENT)
 
-    @patch('memcached_operator.memcached_operator.events.delete')
-    @patch('memcached_operator.memcached_operator.events.modify')
-    @patch('memcached_operator.memcached_operator.events.add')
-    def test_modify_event(self, mock_add, mock_modify, mock_delete):
+    def test_modify_event(self):
+        MEMCACHED_STORE.replace([self.cluster_object])
+        modified_object = deepcopy(self.cluster_object)
+        modified_object['metadata']['generation'] = 2
+        modified_object['spec'] = {'memcached': {'replicas': 4}}
         event = deepcopy(self.base_event)
         event['type'] = 'MODIFIED'
+        event['object'] = modified_object
 
-        event_switch(event)
+        event_switch(event, self.queue)
 
-        assert mock_add.called is False
-        mock_modify.assert_called_once_with({})
-        assert mock_delete.called is False
+        assert MEMCACHED_STORE.get(self.name, self.namespace) == modified_object
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_URGENT)
 
-    @patch('memcached_operator.memcached_operator.events.delete')
-    @patch('memcached_operator.memcached_operator.events.modify')
-    @patch('memcached_operator.memcached_operator.events.add')
-    def test_delete_event(self, mock_add, mock_modify, mock_delete):
+    def test_status_modify_event(self):
+        modified_object = deepcopy(self.cluster_object)
+        modified_object['metadata']['generation'] = 2
+        modified_object['status'] = {'observedGeneration': 2}
+        event = deepcopy(self.base_event)
+        event['type'] = 'MODIFIED'
+        event['object'] = modified_object
+
+        event_switch(event, self.queue)
+
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_RESYNC)
+
+    def test_delete_event(self):
+        MEMCACHED_STORE.replace([self.cluster_object])
         event = deepcopy(self.base_event)
         event['type'] = 'DELETED'
+        event['object'] = self.cluster_object
 
-        event_switch(event)
+        event_switch(event, self.queue)
 
-        assert mock_add.called is False
-        assert mock_modify.called is False
-        mock_delete.assert_called_once_with({})
+        assert MEMCACHED_STORE.get(self.name, self.namespace) is None
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_URGENT)
 
-    @patch('memcached_operator.memcached_operator.events.delete')
-    @patch('memcached_operator.memcached_operator.events.modify')
-    @patch('memcached_operator.memcached_operator.events.add')
-    def test_unknown_event(self, mock_add, mock_modify, mock_delete):
+    def test_unknown_event(self):
         event = deepcopy(self.base_event)
         event['type'] = 'UNKNOWN'
+        event['object'] = self.cluster_object
 
-        event_switch(event)
-
-        assert mock_add.called is False
-        assert mock_modify.called is False
-        assert mock_delete.called is False
-
-    @patch('memcached_operator.memcached_operator.events.create_memcached_deployment')
-    @patch('memcached_operator.memcached_operator.events.create_mcrouter_deployment')
-    @patch('memcached_operator.memcached_operator.events.create_service')
-    def test_add(self, mock_create_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment):
-        add(self.cluster_object)
-
-        create_service_calls = [
-            call(get_mcrouter_service_object(self.cluster_object)),
-            call(get_memcached_service_object(self.cluster_object))]
-        mock_create_service.assert_has_calls(create_service_calls)
-        mock_create_memcached_deployment.assert_called_once_with(self.cluster_object)
-        mock_create_mcrouter_deployment.assert_called_once_with(self.cluster_object)
-
-    @patch('memcached_operator.memcached_operator.events.update_memcached_deployment')
-    @patch('memcached_operator.memcached_operator.events.update_mcrouter_deployment')
-    @patch('memcached_operator.memcached_operator.events.update_service')
-    def test_modify(self, mock_update_service, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        modify(self.cluster_object)
-
-        update_service_calls = [
-            call(get_mcrouter_service_object(self.cluster_object)),
-            call(get_memcached_service_object(self.cluster_object))]
-        mock_update_service.assert_has_calls(update_service_calls)
-        mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
-        mock_update_mcrouter_deployment.assert_called_once_with(self.cluster_object)
+        event_switch(event, self.queue)
 
-    @patch('memcached_operator.memcached_operator.events.delete_deployment')
-    @patch('memcached_operator.memcached_operator.events.delete_service')
+        assert len(MEMCACHED_STORE) == 0
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.events.delete_deployment', return_value=True)
+    @patch('memcached_operator.memcached_operator.events.delete_service', return_value=True)
     def test_delete(self, mock_delete_service, mock_delete_deployment):
-        delete(self.cluster_object)
+        result = delete(self.cluster_object)
 
         delete_service_calls = [
             call(self.name, self.namespace),
             call('{}-backend'.format(self.name), self.namespace)]
-        mock_delete_service.assert_has_calls(delete_service_calls)
+        mock_delete_service.assert_has_calls(delete_service_calls, any_order=True)
         delete_deployment_calls = [
             call(self.name, self.namespace),
             call('{}-router'.format(self.name), self.namespace)]
-        mock_delete_deployment.assert_has_calls(delete_deployment_calls)
+        mock_delete_deployment.assert_has_calls(delete_deployment_calls, any_order=True)
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.events.delete_deployment', return_value=True)
+    @patch('memcached_operator.memcached_operator.events.delete_service', return_value=False)
+    def test_delete_failure(self, mock_delete_service, mock_delete_deployment):
+        result = delete(self.cluster_object)
+
+        assert mock_delete_deployment.call_count == 2
+        assert result is False
+
+    @patch('memcached_operator.memcached_operator.plan.logging')
+    @patch('memcached_operator.memcached_operator.events.delete_deployment')
+    @patch('memcached_operator.memcached_operator.events.delete_service', return_value=True)
+    def test_delete_router_first(self, mock_delete_service, mock_delete_deployment, mock_logging):
+        mock_delete_deployment.side_effect = lambda name, namespace: (
+            not name.endswith('-router'))
+
+        result = delete(self.cluster_object)
+
+        # The backend service stays until mcrouter is gone
+        mock_delete_service.assert_called_once_with(self.name, self.namespace)
+        assert result is False
+
+
+class TestEventListener():
+    def setUp(self):
+        self.name = 'testname123'
+        self.namespace = 'testnamespace456'
+        self.key = '{}/{}'.format(self.namespace, self.name)
+        self.cluster_object = {'metadata':{'name': self.name,
+                                           'namespace': self.namespace,
+                                           'resourceVersion': '5'}}
+        self.cluster_list = {'metadata': {'resourceVersion': '3'},
+                             'items': [self.cluster_object]}
+        self.shutting_down = Event()
+        self.queue = MagicMock()
+        MEMCACHED_STORE.replace([])
+
+    def stream(self, *events):
+        # Stop the listener once the watch has been consumed
+        def stream(*args, **kwargs):
+            for event in events:
+                yield event
+            self.shutting_down.set()
+        return stream
+
+    @patch('memcached_operator.memcached_operator.events.list_cluster_memcached_object')
+    def test_sync_existing(self, mock_list_cluster_memcached_object):
+        deleted_object = {'metadata':{'name': 'deleted',
+                                      'namespace': self.namespace}}
+        MEMCACHED_STORE.replace([deleted_object])
+        mock_list_cluster_memcached_object.return_value = self.cluster_list
+
+        resource_version = sync_existing(self.queue)
+
+        assert resource_version == '3'
+        assert MEMCACHED_STORE.list() == [self.cluster_object]
+        queue_calls = [
+            call('{}/deleted'.format(self.namespace), PRIORITY_URGENT),
+            call(self.key, PRIORITY_RESYNC)]
+        self.queue.add.assert_has_calls(queue_calls)
+
+    @patch('memcached_operator.memcached_operator.events.list_cluster_memcached_object')
+    def test_sync_existing_pages(self, mock_list_cluster_memcached_object):
+        other_object = {'metadata': {'name': 'other',
+                                     'namespace': self.namespace}}
+        mock_list_cluster_memcached_object.side_effect = [
+            {'metadata': {'resourceVersion': '3', 'continue': 'page-2'},
+             'items': [other_object]},
+            self.cluster_list]
+
+        resource_version = sync_existing(self.queue)
+
+        assert resource_version == '3'
+        assert len(MEMCACHED_STORE) == 2
+        list_calls = [
+            call(limit=500),
+            call(limit=500, _continue='page-2')]
+        mock_list_cluster_memcached_object.assert_has_calls(list_calls)
+        assert self.queue.add.call_count == 2
+
+    @patch('memcached_operator.memcached_operator.events.list_cluster_memcached_object')
+    def test_sync_existing_namespace(self, mock_list_cluster_memcached_object):
+        other_object = {'metadata':{'name': self.name,
+                                    'namespace': 'other'}}
+        MEMCACHED_STORE.replace([other_object])
+        mock_list_cluster_memcached_object.return_value = self.cluster_list
+        SCOPE.configure([self.namespace, 'other'], 'tenant=a')
+        try:
+            sync_existing(self.queue, self.namespace)
+        finally:
+            SCOPE.configure()
+
+        mock_list_cluster_memcached_object.assert_called_once_with(
+            namespace=self.namespace, label_selector='tenant=a', limit=500)
+        assert len(MEMCACHED_STORE) == 2
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_RESYNC)
+
+    @patch('memcached_operator.memcached_operator.events.event_switch')
+    @patch('memcached_operator.memcached_operator.events.watch.Watch')
+    @patch('memcached_operator.memcached_operator.events.list_cluster_memcached_object')
+    def test_resumes_from_resource_version(self, mock_list_cluster_memcached_object, mock_watch, mock_event_switch):
+        mock_list_cluster_memcached_object.return_value = self.cluster_list
+        modified_event = {'type': 'MODIFIED',
+                          'object': self.cluster_object,
+                          'raw_object': self.cluster_object}
+        bookmark_event = {'type': 'BOOKMARK',
+                          'object': {},
+                          'raw_object': {'metadata': {'resourceVersion': '9'}}}
+        mock_watch.return_value.stream.side_effect = [
+            iter([modified_event, bookmark_event]),
+            self.stream()()]
+
+        event_listener(self.shutting_down, '25', self.queue)
+
+        mock_list_cluster_memcached_object.assert_called_once_with(
+            limit=500)
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_RESYNC)
+        mock_event_switch.assert_called_once_with(modified_event, self.queue)
+        stream_calls = [
+            call(mock_list_cluster_memcached_object, resource_version='3',
+                 allow_watch_bookmarks=True, timeout_seconds=25,
+                 _request_timeout=30),
+            call(mock_list_cluster_memcached_object, resource_version='9',
+                 allow_watch_bookmarks=True, timeout_seconds=25,
+                 _request_timeout=30)]
+        mock_watch.return_value.stream.assert_has_calls(stream_calls)
+
+    @patch('memcached_operator.memcached_operator.events.event_switch')
+    @patch('memcached_operator.memcached_operator.events.watch.Watch')
+    @patch('memcached_operator.memcached_operator.events.list_cluster_memcached_object')
+    def test_relists_on_gone(self, mock_list_cluster_memcached_object, mock_watch, mock_event_switch):
+        mock_list_cluster_memcached_object.return_value = self.cluster_list
+        gone_event = {'type': 'ERROR',
+                      'object': {},
+                      'raw_object': {'code': 410}}
+        mock_watch.return_value.stream.side_effect = [
+            iter([gone_event]),
+            self.stream()()]
+
+        event_listener(self.shutting_down, 25, self.queue)
+
+        assert mock_list_cluster_memcached_object.call_count == 2
+        assert self.queue.add.call_count == 2
+        assert mock_event_switch.called is False
+
+    @patch('memcached_operator.memcached_operator.events.sleep')
+    @patch('memcached_operator.memcached_operator.events.logging')
+    @patch('memcached_operator.memcached_operator.events.event_switch')
+    @patch('memcached_operator.memcached_operator.events.watch.Watch')
+    @patch('memcached_operator.memcached_operator.events.list_cluster_memcached_object')
+    def test_watch_error(self, mock_list_cluster_memcached_object, mock_watch, mock_event_switch, mock_logging, mock_sleep):
+        mock_list_cluster_memcached_object.return_value = self.cluster_list
+        error_event = {'type': 'ERROR',
+                       'object': {},
+                       'raw_object': {'code': 500}}
+        mock_watch.return_value.stream.side_effect = [
+            iter([error_event]),
+            self.stream()()]
+
+        event_listener(self.shutting_down, 25, self.queue)
+
+        assert mock_logging.exception.called is True
+        mock_sleep.assert_called_once_with(25)
+        # The resourceVersion is kept, no relist needed
+        mock_list_cluster_memcached_object.assert_called_once_with(
+            limit=500)
+
+
+class TestChildEvent():
+    def setUp(self):
+        self.name = 'testname123'
+        self.namespace = 'testnamespace456'
+        self.key = '{}/{}'.format(self.namespace, self.name)
+        self.cluster_object = {'metadata': {'name': self.name,
+                                            'namespace': self.namespace}}
+        self.deployment = {'metadata': {'name': self.name,
+                                        'namespace': self.namespace,
+                                        'labels': {'cluster': self.name},
+                                        'ownerReferences': [{
+                                            'kind': 'Memcached',
+                                            'controller': True,
+                                            'uid': 'uid1'}],
+                                        'generation': 2}}
+        self.queue = MagicMock()
+        MEMCACHED_STORE.replace([self.cluster_object])
+
+        self.versions = ChildVersions()
+        self.versions_patcher = patch(
+            'memcached_operator.memcached_operator.events.CHILD_VERSIONS',
+            self.versions)
+        self.versions_patcher.start()
+
+    def tearDown(self):
+        self.versions_patcher.stop()
+
+    def edit(self):
+        edited = deepcopy(self.deployment)
+        edited['metadata']['generation'] = 3
+        return edited
+
+    @patch('memcached_operator.memcached_operator.events.logging')
+    def test_modified_by_others(self, mock_logging):
+        self.versions.record('deployments', self.deployment)
+
+        child_event(self.queue, 'deployments', 'MODIFIED', self.edit())
+
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_DRIFTED)
+
+    def test_own_write(self):
+        self.versions.record('deployments', self.deployment)
+
+        child_event(self.queue, 'deployments', 'MODIFIED', self.deployment)
+
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.events.ROLLOUTS')
+    def test_requeues_deferred_rollouts(self, mock_rollouts):
+        child_event(self.queue, 'deployments', 'MODIFIED', self.deployment)
+        child_event(self.queue, 'services', 'MODIFIED', self.deployment)
+
+        mock_rollouts.requeue_deferred.assert_called_once_with(self.queue)
+
+    def test_unknown_version(self):
+        child_event(self.queue, 'deployments', 'MODIFIED', self.edit())
+
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.events.logging')
+    @patch('memcached_operator.memcached_operator.events.is_owner_alive', return_value=True)
+    def test_deleted(self, mock_is_owner_alive, mock_logging):
+        self.versions.record('deployments', self.deployment)
+
+        child_event(self.queue, 'deployments', 'DELETED', self.deployment)
+
+        mock_is_owner_alive.assert_called_once_with(
+            self.name, self.namespace, 'uid1')
+        self.queue.add.assert_called_once_with(self.key, PRIORITY_URGENT)
+        assert len(self.versions) == 0
+
+    @patch('memcached_operator.memcached_operator.events.is_owner_alive', return_value=False)
+    def test_deleted_with_cluster(self, mock_is_owner_alive):
+        # Collected before the cluster's DELETED event arrived
+        child_event(self.queue, 'deployments', 'DELETED', self.deployment)
+
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.events.is_owner_alive')
+    def test_deleted_cluster(self, mock_is_owner_alive):
+        MEMCACHED_STORE.replace([])
+        self.versions.record('deployments', self.deployment)
+
+        child_event(self.queue, 'deployments', 'DELETED', self.deployment)
+
+        assert mock_is_owner_alive.called is False
+        assert self.queue.add.called is False
+        assert len(self.versions) == 0
+
+    @patch('memcached_operator.memcached_operator.events.is_owner_alive')
+    def test_unlabeled(self, mock_is_owner_alive):
+        del self.deployment['metadata']['labels']
+
+        child_event(self.queue, 'deployments', 'DELETED', self.deployment)
+
+        assert mock_is_owner_alive.called is False
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.events.SHARDS')
+    @patch('memcached_operator.memcached_operator.events.is_owner_alive')
+    def test_other_shard(self, mock_is_owner_alive, mock_shards):
+        mock_shards.owns.return_value = False
+
+        child_event(self.queue, 'deployments', 'DELETED', self.deployment)
+
+        assert mock_is_owner_alive.called is False
+        assert self.queue.add.called is False
+
+
+class TestIsOwnerAlive():
+    def setUp(self):
+        self.cluster_object = {'metadata': {'name': 'a',
+                                            'namespace': 'ns',
+                                            'uid': 'uid1'}}
+
+    @patch('memcached_operator.memcached_operator.events.get_namespaced_memcached_object')
+    def test_alive(self, mock_get_namespaced_memcached_object):
+        mock_get_namespaced_memcached_object.return_value = \
+            self.cluster_object
+
+        assert is_owner_alive('a', 'ns', 'uid1') is True
+        assert is_owner_alive('a', 'ns') is True
+        mock_get_namespaced_memcached_object.assert_called_with('a', 'ns')
+
+    @patch('memcached_operator.memcached_operator.events.get_namespaced_memcached_object')
+    def test_recreated(self, mock_get_namespaced_memcached_object):
+        mock_get_namespaced_memcached_object.return_value = \
+            self.cluster_object
+
+        assert is_owner_alive('a', 'ns', 'uid0') is False
+
+    @patch('memcached_operator.memcached_operator.events.get_namespaced_memcached_object')
+    def test_deleting(self, mock_get_namespaced_memcached_object):
+        self.cluster_object['metadata']['deletionTimestamp'] = \
+            '2020-01-01T00:00:00Z'
+        mock_get_namespaced_memcached_object.return_value = \
+            self.cluster_object
+
+        assert is_owner_alive('a', 'ns', 'uid1') is False
+
+    @patch('memcached_operator.memcached_operator.events.get_namespaced_memcached_object', side_effect=client.rest.ApiException(status=404))
+    def test_deleted(self, mock_get_namespaced_memcached_object):
+        assert is_owner_alive('a', 'ns', 'uid1') is False
+
+    @patch('memcached_operator.memcached_operator.events.logging')
+    @patch('memcached_operator.memcached_operator.events.get_namespaced_memcached_object', side_effect=client.rest.ApiException(status=500))
+    def test_error(self, mock_get_namespaced_memcached_object, mock_logging):
+        assert is_owner_alive('a', 'ns', 'uid1') is False
+        assert mock_logging.exception.called is True
@@ -0,0 +1,533 @@
+"""Stand-in kubernetes apiserver for benchmarks.
+
+Implements list, watch, get, create, patch and delete for memcacheds,
+services and apps/v1 deployments, which is all the operator uses.
+Memcacheds have a status subresource like the shipped CRD.
+The server runs in its own process so that it doesn't compete with the
+operator for the GIL or inflate its memory usage. Benchmarks control it
+through FakeApiServer, which talks to the /_control endpoints.
+"""
+import bisect
+import copy
+import json
+import multiprocessing
+import re
+import threading
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlparse
+from urllib.request import Request, urlopen
+
+from ..memcached_operator.kubernetes_resources import (
+    get_desired_state_hash,
+    parse_cluster_spec,
+    render_mcrouter_service,
+    render_memcached_service,
+    render_memcached_deployment,
+    render_mcrouter_deployment)
+
+
+PATH_PATTERN = re.compile(
+    r'^/(?:api/v1|apis/[^/]+/[^/]+)'
+    r'(?:/namespaces/(?P<namespace>[^/]+))?'
+    r'/(?P<resource>memcacheds|services|deployments)'
+    r'(?:/(?P<name>[^/]+)(?:/(?P<subresource>status))?)?$')
+
+RENDERERS = (
+    ('services', render_mcrouter_service),
+    ('services', render_memcached_service),
+    ('deployments', render_memcached_deployment),
+    ('deployments', render_mcrouter_deployment))
+
+KINDS = {
+    'memcacheds': ('kubestack.com/v1', 'Memcached'),
+    'services': ('v1', 'Service'),
+    'deployments': ('apps/v1', 'Deployment')}
+
+
+# Custom resources with a status subresource
+STATUS_SUBRESOURCES = ('memcacheds',)
+
+
+def get_generation_fields(resource, obj):
+    """Return what bumps an object's generation when changed."""
+    if resource in STATUS_SUBRESOURCES:
+        # Custom resources count everything but metadata and status
+        return dict((key, value) for key, value in obj.items()
+                    if key not in ('apiVersion', 'kind', 'metadata',
+                                   'status'))
+    return obj.get('spec')
+
+
+class ApiError(Exception):
+    def __init__(self, code, message):
+        super(ApiError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def merge(target, patch):
+    # Good enough for the full objects the operator sends, lists are
+    # replaced instead of merged by key
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+def matches_selector(resource, label_selector):
+    labels = resource['metadata'].get('labels') or {}
+    for requirement in filter(None, (label_selector or '').split(',')):
+        key, value = requirement.split('=', 1)
+        if labels.get(key) != value:
+            return False
+    return True
+
+
+class FakeCluster(object):
+    """In memory objects and watch events of all resources."""
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.resource_version = 1
+        self.objects = {resource: {} for resource in KINDS}
+        self.events = {resource: [] for resource in KINDS}
+        self.event_versions = {resource: [] for resource in KINDS}
+        self.compacted = {resource: 0 for resource in KINDS}
+        self.requests = Counter()
+        self.latency = 0.0
+        self.errors = []
+
+    def count(self, verb, resource):
+        with self.lock:
+            self.requests[(verb, resource)] += 1
+
+    def take_error(self, verb, resource):
+        with self.lock:
+            for i, (error_verb, error_resource, code) in enumerate(
+                    self.errors):
+                if error_verb == verb and error_resource == resource:
+                    del self.errors[i]
+                    return code
+        return None
+
+    def _record(self, resource, event_type, obj):
+        self.resource_version += 1
+        obj['metadata']['resourceVersion'] = str(self.resource_version)
+        self.events[resource].append(
+            (self.resource_version, event_type, copy.deepcopy(obj)))
+        self.event_versions[resource].append(self.resource_version)
+        self.lock.notify_all()
+
+    def list(self, resource, namespace, label_selector, limit, _continue):
+        with self.lock:
+            keys = sorted(
+                key for key, obj in self.objects[resource].items()
+                if (namespace is None or key[0] == namespace) and
+                matches_selector(obj, label_selector))
+            start = int(_continue or 0)
+            end = start + limit if limit else len(keys)
+            metadata = {'resourceVersion': str(self.resource_version)}
+            if end < len(keys):
+                metadata['continue'] = str(end)
+            api_version, kind = KINDS[resource]
+            return {
+                'apiVersion': api_version,
+                'kind': '{}List'.format(kind),
+                'metadata': metadata,
+                'items': [copy.deepcopy(self.objects[resource][key])
+                          for key in keys[start:end]]}
+
+    def get(self, resource, namespace, name):
+        with self.lock:
+            obj = self.objects[resource].get((namespace, name))
+            if obj is None:
+                raise ApiError(404, '{} {} not found'.format(resource, name))
+            return copy.deepcopy(obj)
+
+    def create(self, resource, namespace, body):
+        with self.lock:
+            return self._create(resource, namespace, body)
+
+    def _create(self, resource, namespace, body):
+        obj = copy.deepcopy(body)
+        metadata = obj.setdefault('metadata', {})
+        metadata['namespace'] = namespace
+        key = (namespace, metadata['name'])
+        if key in self.objects[resource]:
+            raise ApiError(409, '{} {} already exists'.format(
+                resource, metadata['name']))
+        metadata['uid'] = str(uuid.uuid4())
+        metadata['generation'] = 1
+        api_version, kind = KINDS[resource]
+        obj.setdefault('apiVersion', api_version)
+        obj.setdefault('kind', kind)
+        self.objects[resource][key] = obj
+        self._record(resource, 'ADDED', obj)
+        return copy.deepcopy(obj)
+
+    def patch(self, resource, namespace, name, body, upsert=False,
+              subresource=None):
+        with self.lock:
+            obj = self.objects[resource].get((namespace, name))
+            if obj is None:
+                if upsert:
+                    return self._create(resource, namespace, body)
+                raise ApiError(404, '{} {} not found'.format(resource, name))
+            if resource in STATUS_SUBRESOURCES:
+                # The status subresource only writes status, the main
+                # resource ignores it
+                if subresource == 'status':
+                    body = {'status': body.get('status')}
+                else:
+                    body = dict((key, value) for key, value in body.items()
+                                if key != 'status')
+            fields = copy.deepcopy(get_generation_fields(resource, obj))
+            merge(obj, body)
+            if get_generation_fields(resource, obj) != fields:
+                obj['metadata']['generation'] += 1
+            self._record(resource, 'MODIFIED', obj)
+            return copy.deepcopy(obj)
+
+    def delete(self, resource, namespace, name):
+        with self.lock:
+            self._delete(resource, namespace, name)
+
+    def _delete(self, resource, namespace, name):
+        obj = self.objects[resource].pop((namespace, name), None)
+        if obj is None:
+            raise ApiError(404, '{} {} not found'.format(resource, name))
+        self._record(resource, 'DELETED', obj)
+
+        # Cascade like the kubernetes garbage collector
+        uid = obj['metadata']['uid']
+        for child_resource in ('services', 'deployments'):
+            for key, child in list(self.objects[child_resource].items()):
+                owners = child['metadata'].get('ownerReferences') or []
+                if any(owner['uid'] == uid for owner in owners):
+                    self._delete(child_resource, key[0], key[1])
+
+    def watch_events(self, resource, namespace, resource_version):
+        """Return new events after resource_version, None if expired."""
+        if resource_version < self.compacted[resource]:
+            return None
+        start = bisect.bisect_right(
+            self.event_versions[resource], resource_version)
+        return [(rv, event_type, obj) for rv, event_type, obj in
+                self.events[resource][start:] if
+                (namespace is None or obj['metadata']['namespace'] ==
+                 namespace)]
+
+    def seed(self, clusters, children, orphans, namespaces=100):
+        with self.lock:
+            for i in range(clusters + orphans):
+                namespace = 'namespace{}'.format(i % namespaces)
+                cluster_object = self._create('memcacheds', namespace, {
+                    'metadata': {'name': 'cluster{}'.format(i)},
+                    'spec': {'memcached': {'replicas': 2},
+                             'mcrouter': {'replicas': 1}}})
+                if i < clusters and not children:
+                    continue
+
+                spec = parse_cluster_spec(cluster_object)
+                for resource, render in RENDERERS:
+                    child = copy.deepcopy(render(spec))
+                    if i >= clusters:
+                        # Left behind by an operator without ownerReferences
+                        del child['metadata']['ownerReferences']
+                    self._create(resource, namespace, child)
+
+                if i >= clusters:
+                    del self.objects['memcacheds'][
+                        (namespace, cluster_object['metadata']['name'])]
+            # Start watches from here, seeding happened before the test
+            for resource in KINDS:
+                self.events[resource] = []
+                self.event_versions[resource] = []
+                self.compacted[resource] = self.resource_version
+
+    def is_converged(self, namespace, name):
+        """Check the operator caught up with the cluster's last change."""
+        with self.lock:
+            cluster_object = self.objects['memcacheds'].get((namespace, name))
+            if cluster_object is None:
+                # Only children of deleted clusters are left over
+                return not any(
+                    key[0] == namespace and
+                    (child['metadata'].get('labels') or {}).get(
+                        'cluster') == name
+                    for resource in ('services', 'deployments')
+                    for key, child in self.objects[resource].items())
+
+            status = cluster_object.get('status') or {}
+            if (status.get('observedGeneration') !=
+                    cluster_object['metadata']['generation']):
+                return False
+
+            spec = parse_cluster_spec(cluster_object)
+            for resource, render in RENDERERS:
+                desired = render(spec)
+                child = self.objects[resource].get(
+                    (namespace, desired['metadata']['name']))
+                if (child is None or get_desired_state_hash(child) !=
+                        get_desired_state_hash(desired)):
+                    return False
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': [[verb, resource, count] for (verb, resource),
+                             count in sorted(self.requests.items())],
+                'objects': {resource: len(objects)
+                            for resource, objects in self.objects.items()},
+                'resourceVersion': self.resource_version}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def cluster(self):
+        return self.server.cluster
+
+    def send_json(self, code, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_status(self, code, message):
+        self.send_json(code, {
+            'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure',
+            'message': message, 'code': code})
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        # json.loads only takes bytes from Python 3.6 on
+        return json.loads(self.rfile.read(length).decode('utf-8') or 'null')
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in
+                 parse_qs(url.query).items()}
+
+        if url.path.startswith('/_control/'):
+            return self.handle_control(method, url.path[10:])
+
+        match = PATH_PATTERN.match(url.path)
+        if not match:
+            return self.send_status(404, 'unknown path {}'.format(url.path))
+        resource = match.group('resource')
+        namespace = match.group('namespace')
+        name = match.group('name')
+        subresource = match.group('subresource')
+        if subresource and resource not in STATUS_SUBRESOURCES:
+            return self.send_status(404, 'unknown path {}'.format(url.path))
+        # Always consume the body to keep the connection usable
+        payload = self.read_body() if method != 'GET' else None
+
+        verb = method
+        if method == 'GET' and query.get('watch', '').lower() == 'true':
+            verb = 'WATCH'
+        elif method == 'GET' and name is None:
+            verb = 'LIST'
+        self.cluster.count(verb, resource)
+
+        if self.cluster.latency:
+            sleep(self.cluster.latency)
+        error = self.cluster.take_error(verb, resource)
+        if error:
+            return self.send_status(error, 'injected error')
+
+        try:
+            if verb == 'WATCH':
+                return self.watch(resource, namespace, query)
+            if verb == 'LIST':
+                body = self.cluster.list(
+                    resource, namespace, query.get('labelSelector'),
+                    int(query.get('limit') or 0), query.get('continue'))
+            elif method == 'GET':
+                body = self.cluster.get(resource, namespace, name)
+            elif method == 'POST':
+                body = self.cluster.create(resource, namespace, payload)
+            elif method == 'PATCH':
+                apply = 'apply-patch' in self.headers.get('Content-Type', '')
+                body = self.cluster.patch(
+                    resource, namespace, name, payload, upsert=apply,
+                    subresource=subresource)
+            else:
+                self.cluster.delete(resource, namespace, name)
+                body = {'kind': 'Status', 'status': 'Success'}
+        except ApiError as e:
+            return self.send_status(e.code, e.message)
+        self.send_json(201 if method == 'POST' else 200, body)
+
+    def write_chunk(self, data):
+        self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii'))
+        self.wfile.write(data + b'\r\n')
+        self.wfile.flush()
+
+    def watch(self, resource, namespace, query):
+        resource_version = int(query.get('resourceVersion') or 0)
+        timeout = float(query.get('timeoutSeconds') or 3600)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        deadline = monotonic() + timeout
+        lock = self.cluster.lock
+        try:
+            while monotonic() < deadline:
+                with lock:
+                    events = self.cluster.watch_events(
+                        resource, namespace, resource_version)
+                    if not events and events is not None:
+                        lock.wait(deadline - monotonic())
+                        continue
+
+                if events is None:
+                    self.write_chunk(json.dumps({
+                        'type': 'ERROR',
+                        'object': {'kind': 'Status', 'code': 410,
+                                   'message': 'too old resource version'}
+                    }).encode('utf-8') + b'\n')
+                    break
+
+                for rv, event_type, obj in events:
+                    self.write_chunk(json.dumps({
+                        'type': event_type,
+                        'object': obj}).encode('utf-8') + b'\n')
+                    resource_version = rv
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def handle_control(self, method, command):
+        if command == 'stats':
+            return self.send_json(200, self.cluster.stats())
+
+        body = self.read_body() or {}
+        if command == 'seed':
+            self.cluster.seed(body['clusters'], body.get('children', True),
+                              body.get('orphans', 0))
+        elif command == 'reset':
+            with self.cluster.lock:
+                self.cluster.requests.clear()
+        elif command == 'latency':
+            self.cluster.latency = body['seconds']
+        elif command == 'errors':
+            with self.cluster.lock:
+                self.cluster.errors.extend(
+                    tuple(error) for error in body['errors'])
+        elif command == 'converged':
+            return self.send_json(200, [
+                self.cluster.is_converged(namespace, name)
+                for namespace, name in body['clusters']])
+        elif command in ('get', 'create', 'patch', 'delete'):
+            try:
+                return self.send_json(200, getattr(self.cluster, command)(
+                    *body['args']))
+            except ApiError as e:
+                return self.send_status(e.code, e.message)
+        else:
+            return self.send_status(404, 'unknown command')
+        self.send_json(200, {})
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server only has its own from Python 3.7 on
+    daemon_threads = True
+
+
+def serve(port_queue):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.cluster = FakeCluster()
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeApiServer(object):
+    """Run the fake apiserver in a child process."""
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        port_queue = context.Queue()
+        self.process = context.Process(
+            target=serve, args=(port_queue,), daemon=True)
+        self.process.start()
+        self.url = 'http://127.0.0.1:{}'.format(port_queue.get(timeout=30))
+
+    def control(self, command, body=None):
+        request = Request(
+            '{}/_control/{}'.format(self.url, command),
+            data=json.dumps(body or {}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST')
+        with urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def seed(self, clusters, children=True, orphans=0):
+        """Create clusters and the children of deleted clusters."""
+        self.control('seed', {'clusters': clusters, 'children': children,
+                              'orphans': orphans})
+
+    def stats(self):
+        return self.control('stats')
+
+    def reset(self):
+        self.control('reset')
+
+    def set_latency(self, seconds):
+        self.control('latency', {'seconds': seconds})
+
+    def inject_errors(self, *errors):
+        """Fail the next requests matching (verb, resource, code)."""
+        self.control('errors', {'errors': errors})
+
+    def create(self, resource, namespace, obj):
+        return self.control('create', {'args': [resource, namespace, obj]})
+
+    def patch(self, resource, namespace, name, patch):
+        return self.control(
+            'patch', {'args': [resource, namespace, name, patch]})
+
+    def delete(self, resource, namespace, name):
+        return self.control('delete', {'args': [resource, namespace, name]})
+
+    def converged(self, cluster_keys):
+        """Return for each (namespace, name) if the operator caught up."""
+        return self.control('converged', {'clusters': cluster_keys})
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
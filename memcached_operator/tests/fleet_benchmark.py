@@ -0,0 +1,203 @@
+"""Operator throughput against a fake apiserver.
+
+Not collected by nose, run them with pytest-benchmark:
+
+    pytest -s memcached_operator/tests/fleet_benchmark.py
+
+Every fleet is seeded without children. Once the caches are synced the
+first cycle creates them, the following ones find everything up to
+date. API calls are counted by
+the fake apiserver, RSS is that of the operator process only.
+"""
+import functools
+import resource
+import threading
+from time import monotonic, sleep
+
+import pytest
+from kubernetes import client
+from prometheus_client import REGISTRY
+
+from ..memcached_operator.events import event_listener, child_event
+from ..memcached_operator.informers import (MEMCACHED_STORE,
+                                            SERVICE_STORE,
+                                            DEPLOYMENT_STORE,
+                                            get_informers)
+from ..memcached_operator.kubernetes_helpers import configure_api_client
+from ..memcached_operator.kubernetes_resources import RENDER_CACHE
+from ..memcached_operator.periodical import (check_existing,
+                                             collect_garbage,
+                                             periodical_check,
+                                             PeriodicCheck)
+from ..memcached_operator.reconciler import worker
+from ..memcached_operator.workqueue import WorkQueue
+from .fake_apiserver import FakeApiServer
+
+
+LATENCY = 0.002
+WORKERS = 4
+WATCH_TIMEOUT = 25
+
+
+def get_rss():
+    """Return current and peak RSS in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20, peak
+    except (IOError, OSError):
+        return None, peak
+
+
+def wait_until(condition, timeout=600):
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            raise AssertionError('timed out waiting for the operator')
+        sleep(0.05)
+
+
+def is_idle(queue):
+    # Keys are popped just before the worker marks them in flight
+    for _ in range(2):
+        if (len(queue) or
+                REGISTRY.get_sample_value(
+                    'memcached_operator_work_in_flight')):
+            return False
+        sleep(0.05)
+    return True
+
+
+def get_request_counts(server):
+    return {'{} {}'.format(verb, resource): count
+            for verb, resource, count in server.stats()['requests']}
+
+
+class Operator(object):
+    """Informers, event listener and workers of a running operator."""
+
+    def __init__(self, server, check_interval=None, raw=False):
+        configuration = client.Configuration()
+        configuration.host = server.url
+        client.Configuration.set_default(configuration)
+        configure_api_client(pool_size=WORKERS + 4)
+
+        for store in (MEMCACHED_STORE, SERVICE_STORE, DEPLOYMENT_STORE):
+            store.replace([])
+        RENDER_CACHE.clear()
+
+        self.server = server
+        self.queue = WorkQueue()
+        self.shutting_down = threading.Event()
+        handler = functools.partial(child_event, self.queue)
+        self.threads = [threading.Thread(
+            target=informer.run,
+            args=(self.shutting_down, WATCH_TIMEOUT),
+            daemon=True) for informer in get_informers(
+                handler, raw).values()]
+        self.threads.append(threading.Thread(
+            target=event_listener,
+            args=(self.shutting_down, WATCH_TIMEOUT, self.queue),
+            daemon=True))
+        self.workers = [threading.Thread(
+            target=worker,
+            args=(self.shutting_down, self.queue),
+            daemon=True) for _ in range(WORKERS)]
+        if check_interval:
+            self.workers.append(threading.Thread(
+                target=periodical_check,
+                args=(self.shutting_down, PeriodicCheck(check_interval),
+                      self.queue),
+                daemon=True))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        wait_until(self.is_synced)
+
+    def start_workers(self):
+        for thread in self.workers:
+            thread.start()
+
+    def stop(self):
+        self.shutting_down.set()
+        self.queue.shut_down()
+
+    def is_synced(self):
+        # Stores match the apiserver once all watch events arrived
+        objects = self.server.stats()['objects']
+        return (len(MEMCACHED_STORE) == objects['memcacheds'] and
+                len(SERVICE_STORE) == objects['services'] and
+                len(DEPLOYMENT_STORE) == objects['deployments'])
+
+    def settle(self):
+        wait_until(lambda: self.is_synced() and is_idle(self.queue))
+
+    def cycle(self):
+        """Run one periodic check and wait for the workers to finish."""
+        check_existing(self.queue)
+        collect_garbage(self.queue)
+        wait_until(lambda: is_idle(self.queue))
+
+
+def measure(server, func):
+    server.reset()
+    start = monotonic()
+    func()
+    wall_time = monotonic() - start
+    rss, peak_rss = get_rss()
+    requests = get_request_counts(server)
+    return {
+        'wall_time': round(wall_time, 3),
+        'api_calls': sum(requests.values()),
+        'requests': requests,
+        'rss_mib': rss and round(rss, 1),
+        'peak_rss_mib': round(peak_rss, 1)}
+
+
+def report(name, results):
+    print('\n{}'.format(name))
+    for phase, result in results.items():
+        print('  {:<8} {:>8.3f}s {:>7} calls  rss {} MiB (peak {} MiB)'
+              .format(phase, result['wall_time'], result['api_calls'],
+                      result['rss_mib'], result['peak_rss_mib']))
+        for request, count in sorted(result['requests'].items()):
+            print('  {:<8} {:>26} {:>7}'.format('', request, count))
+
+
+@pytest.fixture
+def server():
+    server = FakeApiServer()
+    server.set_latency(LATENCY)
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize('raw', [False, True], ids=['models', 'raw'])
+@pytest.mark.parametrize('clusters', [1000, 10000])
+def test_fleet(benchmark, server, clusters, raw):
+    # One percent of the fleet was deleted and left unowned children
+    server.seed(clusters, children=False, orphans=clusters // 100)
+    operator = Operator(server, raw=raw)
+    results = {}
+
+    results['sync'] = measure(server, operator.start)
+
+    def converge():
+        operator.start_workers()
+        operator.cycle()
+        operator.settle()
+    results['converge'] = measure(server, converge)
+
+    try:
+        results['steady'] = measure(server, lambda: benchmark.pedantic(
+            operator.cycle, rounds=3))
+    finally:
+        operator.stop()
+
+    benchmark.extra_info.update(results)
+    report('{} clusters{}'.format(clusters, ', raw' if raw else ''),
+           results)
+
+    assert results['steady']['requests'] == {}
@@ -0,0 +1,372 @@
+from unittest.mock import patch, MagicMock
+from threading import Event
+
+from kubernetes import client
+from prometheus_client import REGISTRY
+
+from ..memcached_operator.informers import (Store, Informer,
+                                            get_informers,
+                                            get_resource_metadata,
+                                            get_watch_timeouts,
+                                            slim_resource)
+from ..memcached_operator.scope import SCOPE
+from ..memcached_operator.kubernetes_resources import (
+    get_mcrouter_service_object,
+    get_memcached_service_object)
+
+
+class TestGetWatchTimeouts():
+    def test_request_outlasts_watch(self):
+        assert get_watch_timeouts('25') == (25, 30)
+
+
+class TestGetResourceMetadata():
+    def test_dict(self):
+        resource = {'metadata': {'name': 'testname123',
+                                 'namespace': 'testnamespace456',
+                                 'resourceVersion': '1'}}
+
+        metadata = get_resource_metadata(resource)
+
+        assert metadata == ('testname123', 'testnamespace456', {}, '1')
+
+    def test_model(self):
+        resource = client.V1Service(metadata=client.V1ObjectMeta(
+            name='testname123',
+            namespace='testnamespace456',
+            labels={'cluster': 'testname123'},
+            resource_version='1'))
+
+        metadata = get_resource_metadata(resource)
+
+        assert metadata == ('testname123', 'testnamespace456',
+                            {'cluster': 'testname123'}, '1')
+
+
+class TestSlimResource():
+    def test_deployment(self):
+        deployment = {
+            'kind': 'Deployment',
+            'metadata': {'name': 'a', 'namespace': 'b', 'uid': 'c',
+                         'resourceVersion': '4', 'generation': 2,
+                         'labels': {'cluster': 'a'},
+                         'annotations': {'x': 'y'},
+                         'managedFields': [{'manager': 'kubectl'}]},
+            'spec': {'replicas': 3, 'template': {'spec': {}}},
+            'status': {'observedGeneration': 2, 'replicas': 3,
+                       'updatedReplicas': 3, 'availableReplicas': 1,
+                       'conditions': []}}
+
+        assert slim_resource(deployment) == {
+            'metadata': {'name': 'a', 'namespace': 'b', 'uid': 'c',
+                         'resourceVersion': '4', 'generation': 2,
+                         'labels': {'cluster': 'a'},
+                         'annotations': {'x': 'y'}},
+            'spec': {'replicas': 3},
+            'status': {'observedGeneration': 2, 'replicas': 3,
+                       'updatedReplicas': 3, 'availableReplicas': 1}}
+
+    def test_service(self):
+        service = {'metadata': {'name': 'a', 'namespace': 'b'},
+                   'spec': {'ports': [{'port': 11211}]}}
+
+        assert slim_resource(service) == {
+            'metadata': {'name': 'a', 'namespace': 'b'}}
+
+
+class TestStore():
+    def setUp(self):
+        self.name = 'testname123'
+        self.namespace = 'testnamespace456'
+        self.cluster_object = {'metadata': {'name': self.name,
+                                            'namespace': self.namespace}}
+        self.mcrouter_service = get_mcrouter_service_object(
+            self.cluster_object)
+        self.memcached_service = get_memcached_service_object(
+            self.cluster_object)
+        self.store = Store()
+
+    def test_not_synced(self):
+        assert self.store.synced.isSet() is False
+
+    def test_replace(self):
+        self.store.replace([self.mcrouter_service])
+
+        assert self.store.synced.isSet() is True
+        assert self.store.get(self.name, self.namespace) is self.mcrouter_service
+        assert len(self.store) == 1
+
+    def test_replace_drops_old(self):
+        self.store.replace([self.mcrouter_service])
+        self.store.replace([self.memcached_service])
+
+        assert self.store.get(self.name, self.namespace) is None
+        assert self.store.list() == [self.memcached_service]
+
+    def test_replace_namespace(self):
+        other_object = {'metadata': {'name': self.name,
+                                     'namespace': 'other'}}
+        SCOPE.configure([self.namespace, 'other'])
+        try:
+            self.store.replace([self.mcrouter_service], self.namespace)
+            assert self.store.synced.isSet() is False
+
+            self.store.replace([other_object], 'other')
+            assert self.store.synced.isSet() is True
+
+            # Only resources in the relisted namespace are dropped
+            self.store.replace([self.memcached_service], self.namespace)
+        finally:
+            SCOPE.configure()
+
+        assert self.store.list(self.namespace) == [self.memcached_service]
+        assert self.store.list('other') == [other_object]
+        assert len(self.store) == 2
+
+    def test_get_missing(self):
+        assert self.store.get(self.name, self.namespace) is None
+
+    def test_list_by_cluster(self):
+        self.store.replace([self.mcrouter_service, self.memcached_service])
+
+        services = self.store.list_by_cluster(self.name, self.namespace)
+
+        assert len(services) == 2
+        assert self.mcrouter_service in services
+        assert self.memcached_service in services
+        assert self.store.list_by_cluster(self.name, 'other') == []
+
+    def test_list_cluster_keys(self):
+        self.store.replace([self.mcrouter_service, self.memcached_service])
+
+        assert self.store.list_cluster_keys() == [
+            '{}/{}'.format(self.namespace, self.name)]
+
+    def test_upsert(self):
+        self.store.upsert(self.mcrouter_service)
+        updated_service = get_mcrouter_service_object(self.cluster_object)
+        self.store.upsert(updated_service)
+
+        assert self.store.get(self.name, self.namespace) is updated_service
+        assert self.store.list_by_cluster(self.name, self.namespace) == [
+            updated_service]
+
+    def test_delete(self):
+        self.store.replace([self.mcrouter_service, self.memcached_service])
+        self.store.delete(self.mcrouter_service)
+
+        assert self.store.get(self.name, self.namespace) is None
+        assert self.store.list_by_cluster(self.name, self.namespace) == [
+            self.memcached_service]
+
+    def test_delete_missing(self):
+        self.store.delete(self.mcrouter_service)
+
+        assert len(self.store) == 0
+
+
+class TestInformer():
+    def setUp(self):
+        self.name = 'testname123'
+        self.namespace = 'testnamespace456'
+        self.cluster_object = {'metadata': {'name': self.name,
+                                            'namespace': self.namespace,
+                                            'resourceVersion': '5'}}
+        self.list_func = MagicMock(return_value={
+            'metadata': {'resourceVersion': '3'},
+            'items': [self.cluster_object]})
+        self.store = Store()
+        self.informer = Informer(self.store, self.list_func)
+
+    def test_relist(self):
+        self.informer.relist()
+
+        assert self.store.get(self.name, self.namespace) == self.cluster_object
+        assert self.informer.resource_version == '3'
+
+    def test_relist_model_list(self):
+        service = get_mcrouter_service_object(self.cluster_object)
+        service_list = client.V1ServiceList(
+            items=[service],
+            metadata=client.V1ListMeta(resource_version='7'))
+        self.list_func.return_value = service_list
+
+        self.informer.relist()
+
+        assert self.store.get(self.name, self.namespace) is service
+        assert self.informer.resource_version == '7'
+
+    def test_relist_pages(self):
+        other_object = {'metadata': {'name': 'other',
+                                     'namespace': self.namespace},
+                        'spec': {'ports': []}}
+        self.list_func.side_effect = [
+            {'metadata': {'resourceVersion': '3', 'continue': 'page-2'},
+             'items': [other_object]},
+            self.list_func.return_value]
+        informer = Informer(self.store, self.list_func,
+                            transform=slim_resource)
+
+        informer.relist()
+
+        assert self.list_func.call_count == 2
+        self.list_func.assert_called_with(limit=500, _continue='page-2')
+        assert self.store.get('other', self.namespace) == {
+            'metadata': other_object['metadata']}
+        assert self.store.get(self.name, self.namespace) == \
+            self.cluster_object
+        assert informer.resource_version == '3'
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_watch_events(self, mock_watch):
+        deleted_object = {'metadata': {'name': 'deleted',
+                                       'namespace': self.namespace,
+                                       'resourceVersion': '6'}}
+        self.store.replace([deleted_object])
+        self.informer.resource_version = '3'
+        mock_watch.return_value.stream.return_value = [
+            {'type': 'ADDED', 'object': self.cluster_object},
+            {'type': 'DELETED', 'object': deleted_object}]
+
+        self.informer.watch(Event(), 25)
+
+        mock_watch.return_value.stream.assert_called_once_with(
+            self.list_func, resource_version='3', timeout_seconds=25,
+            _request_timeout=30)
+        assert self.store.get(self.name, self.namespace) == self.cluster_object
+        assert self.store.get('deleted', self.namespace) is None
+        assert self.informer.resource_version == '6'
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_namespaced(self, mock_watch):
+        informer = Informer(self.store, self.list_func,
+                            namespace=self.namespace)
+        mock_watch.return_value.stream.return_value = []
+
+        informer.relist()
+        informer.watch(Event(), 25)
+
+        self.list_func.assert_called_once_with(
+            namespace=self.namespace, limit=500)
+        mock_watch.return_value.stream.assert_called_once_with(
+            self.list_func, resource_version='3', timeout_seconds=25,
+            _request_timeout=30,
+            namespace=self.namespace)
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_watch_handler(self, mock_watch):
+        handler = MagicMock()
+        informer = Informer(self.store, self.list_func, resource='tests',
+                            handler=handler)
+        mock_watch.return_value.stream.return_value = [
+            {'type': 'MODIFIED', 'object': self.cluster_object}]
+
+        informer.watch(Event(), 25)
+
+        handler.assert_called_once_with(
+            'tests', 'MODIFIED', self.cluster_object)
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_transform(self, mock_watch):
+        modified_object = {'metadata': {'name': self.name,
+                                        'namespace': self.namespace,
+                                        'resourceVersion': '6'},
+                           'spec': {'ports': []}}
+        informer = Informer(self.store, self.list_func,
+                            transform=slim_resource)
+        mock_watch.return_value.stream.return_value = [
+            {'type': 'MODIFIED', 'object': modified_object}]
+
+        informer.relist()
+        assert self.store.get(self.name, self.namespace) == \
+            self.cluster_object
+        informer.watch(Event(), 25)
+
+        assert self.store.get(self.name, self.namespace) == {
+            'metadata': modified_object['metadata']}
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_watch_events_counted(self, mock_watch):
+        informer = Informer(self.store, self.list_func, resource='tests')
+        mock_watch.return_value.stream.return_value = [
+            {'type': 'ADDED', 'object': self.cluster_object},
+            {'type': 'MODIFIED', 'object': self.cluster_object},
+            {'type': 'MODIFIED', 'object': self.cluster_object}]
+
+        informer.watch(Event(), 25)
+
+        assert REGISTRY.get_sample_value(
+            'memcached_operator_watch_events_total',
+            {'resource': 'tests', 'type': 'MODIFIED'}) == 2
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_watch_bookmark(self, mock_watch):
+        self.informer.resource_version = '3'
+        mock_watch.return_value.stream.return_value = [
+            {'type': 'BOOKMARK',
+             'object': {},
+             'raw_object': {'metadata': {'resourceVersion': '8'}}}]
+
+        self.informer.watch(Event(), 25)
+
+        assert self.informer.resource_version == '8'
+        assert len(self.store) == 0
+
+    @patch('memcached_operator.memcached_operator.informers.watch.Watch')
+    def test_watch_gone(self, mock_watch):
+        self.informer.resource_version = '3'
+        mock_watch.return_value.stream.return_value = [
+            {'type': 'ERROR', 'object': {}, 'raw_object': {'code': 410}},
+            {'type': 'ADDED', 'object': self.cluster_object}]
+
+        self.informer.watch(Event(), 25)
+
+        assert self.informer.resource_version is None
+        assert self.store.get(self.name, self.namespace) is None
+
+    @patch('memcached_operator.memcached_operator.informers.sleep')
+    @patch('memcached_operator.memcached_operator.informers.logging')
+    def test_run_exception_relists(self, mock_logging, mock_sleep):
+        shutting_down = Event()
+        self.informer.watch = MagicMock(
+            side_effect=lambda *args: shutting_down.set())
+        self.list_func.side_effect = [
+            client.rest.ApiException(status=500),
+            self.list_func.return_value]
+
+        self.informer.run(shutting_down, 25)
+
+        assert mock_logging.exception.called is True
+        mock_sleep.assert_called_once_with(25)
+        assert self.list_func.call_count == 2
+        assert self.informer.resource_version == '3'
+
+
+class TestGetInformers():
+    def tearDown(self):
+        SCOPE.configure()
+
+    def test_cluster_wide(self):
+        informers = get_informers()
+
+        assert sorted(informers) == ['DeploymentInformer', 'ServiceInformer']
+        assert informers['ServiceInformer'].namespace is None
+        assert informers['ServiceInformer'].return_type == 'V1Service'
+        assert informers['ServiceInformer'].transform is None
+
+    def test_raw(self):
+        informers = get_informers(raw=True)
+
+        for informer in informers.values():
+            assert informer.return_type is None
+            assert informer.transform is slim_resource
+
+    def test_namespaces(self):
+        SCOPE.configure(['b', 'a'])
+
+        informers = get_informers()
+
+        assert sorted(informers) == [
+            'DeploymentInformer-a', 'DeploymentInformer-b',
+            'ServiceInformer-a', 'ServiceInformer-b']
+        assert informers['ServiceInformer-b'].namespace == 'b'
@@ -1,10 +1,25 @@
-from unittest.mock import patch, call
+import json
+import socket
+from unittest.mock import patch, call, MagicMock
 from copy import deepcopy
 from random import randint
 
 from kubernetes import client
 
 from ..memcached_operator.kubernetes_helpers import (
+    configure_api_client,
+    get_api_client,
+    get_connection_pool_usage,
+    configure_page_size,
+    list_pages,
+    list_cluster_memcached_object,
+    list_cluster_service_object,
+    list_cluster_service_dict,
+    list_cluster_deployment_object,
+    list_cluster_deployment_dict,
+    update_memcached_status,
+    apply_service,
+    apply_deployment,
     create_service,
     update_service,
     delete_service,
@@ -12,8 +27,12 @@ from ..memcached_operator.kubernetes_helpers import (
     create_mcrouter_deployment,
     update_memcached_deployment,
     update_mcrouter_deployment,
-    delete_deployment)
+    delete_deployment,
+    read_lease,
+    renew_lease,
+    delete_lease)
 from ..memcached_operator.kubernetes_resources import (
+    get_lease_object,
     get_mcrouter_service_object,
     get_memcached_service_object,
     get_default_label_selector,
@@ -23,6 +42,254 @@ from ..memcached_operator.kubernetes_resources import (
 BASE_CLUSTER_OBJECT = {'metadata': {'name': 'testname123',
                                        'namespace': 'testnamespace456'}}
 
+class TestListPages():
+    def tearDown(self):
+        configure_page_size(500)
+
+    def test_dict_pages(self):
+        list_func = MagicMock(side_effect=[
+            {'metadata': {'continue': 'page-2'}, 'items': [1]},
+            {'metadata': {}, 'items': [2]}])
+
+        pages = list(list_pages(list_func, namespace='a'))
+
+        assert [page['items'] for page in pages] == [[1], [2]]
+        list_func.assert_has_calls([
+            call(namespace='a', limit=500),
+            call(namespace='a', limit=500, _continue='page-2')])
+
+    def test_model_pages(self):
+        list_func = MagicMock(side_effect=[
+            client.V1ServiceList(
+                items=[], metadata=client.V1ListMeta(_continue='page-2')),
+            client.V1ServiceList(items=[], metadata=client.V1ListMeta())])
+
+        assert len(list(list_pages(list_func, limit=2))) == 2
+        list_func.assert_called_with(limit=2, _continue='page-2')
+
+    def test_lazy(self):
+        list_func = MagicMock(return_value={
+            'metadata': {'continue': 'next'}, 'items': []})
+
+        pages = list_pages(list_func)
+        next(pages)
+        next(pages)
+        # The next page is only requested once the caller asks for it
+        assert list_func.call_count == 2
+
+    def test_unlimited(self):
+        configure_page_size(0)
+        list_func = MagicMock(return_value={'metadata': {}, 'items': []})
+
+        list(list_pages(list_func))
+
+        list_func.assert_called_once_with(limit=None)
+
+
+class TestListClusterMemcachedObject():
+    @patch('kubernetes.client.ApiClient.call_api')
+    def test_list(self, mock_call_api):
+        list_cluster_memcached_object()
+
+        args, kwargs = mock_call_api.call_args
+        assert args == ('/apis/kubestack.com/v1/memcacheds', 'GET')
+        assert kwargs['query_params'] == []
+        assert kwargs['_preload_content'] is True
+
+    @patch('kubernetes.client.ApiClient.call_api')
+    def test_watch_params(self, mock_call_api):
+        list_cluster_memcached_object(
+            watch=True,
+            resource_version='3',
+            allow_watch_bookmarks=True,
+            timeout_seconds=25,
+            _preload_content=False,
+            _request_timeout=25)
+
+        args, kwargs = mock_call_api.call_args
+        assert kwargs['query_params'] == [
+            ('allowWatchBookmarks', 'true'),
+            ('resourceVersion', '3'),
+            ('timeoutSeconds', 25),
+            ('watch', 'true')]
+        assert kwargs['_preload_content'] is False
+        assert kwargs['_request_timeout'] == 25
+
+    @patch('kubernetes.client.ApiClient.call_api')
+    def test_pagination_params(self, mock_call_api):
+        list_cluster_memcached_object(limit=500, _continue='page-2')
+
+        args, kwargs = mock_call_api.call_args
+        assert kwargs['query_params'] == [
+            ('continue', 'page-2'),
+            ('limit', 500)]
+
+    @patch('kubernetes.client.ApiClient.call_api')
+    def test_namespaced(self, mock_call_api):
+        list_cluster_memcached_object(
+            namespace='testnamespace456', label_selector='tenant=a')
+
+        args, kwargs = mock_call_api.call_args
+        assert args == (
+            '/apis/kubestack.com/v1/namespaces/testnamespace456/memcacheds',
+            'GET')
+        assert kwargs['query_params'] == [('labelSelector', 'tenant=a')]
+
+
+class TestListClusterChildren():
+    @patch('kubernetes.client.CoreV1Api.list_namespaced_service')
+    @patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces')
+    def test_services(self, mock_list_all, mock_list_namespaced):
+        list_cluster_service_object()
+        list_cluster_service_object(namespace='testnamespace456')
+
+        mock_list_all.assert_called_once_with(
+            label_selector=get_default_label_selector())
+        mock_list_namespaced.assert_called_once_with(
+            'testnamespace456', label_selector=get_default_label_selector())
+
+    @patch('kubernetes.client.AppsV1Api.list_namespaced_deployment')
+    @patch('kubernetes.client.AppsV1Api.list_deployment_for_all_namespaces')
+    def test_deployments(self, mock_list_all, mock_list_namespaced):
+        list_cluster_deployment_object()
+        list_cluster_deployment_object(namespace='testnamespace456')
+
+        mock_list_all.assert_called_once_with(
+            label_selector=get_default_label_selector())
+        mock_list_namespaced.assert_called_once_with(
+            'testnamespace456', label_selector=get_default_label_selector())
+
+    @patch('kubernetes.client.ApiClient.call_api')
+    def test_service_dicts(self, mock_call_api):
+        list_cluster_service_dict()
+        list_cluster_service_dict(namespace='testnamespace456')
+
+        assert [c[0][0] for c in mock_call_api.call_args_list] == [
+            '/api/v1/services',
+            '/api/v1/namespaces/testnamespace456/services']
+        args, kwargs = mock_call_api.call_args
+        assert kwargs['query_params'] == [
+            ('labelSelector', get_default_label_selector())]
+        assert kwargs['response_type'] == 'object'
+
+    @patch('kubernetes.client.ApiClient.call_api')
+    def test_deployment_dicts(self, mock_call_api):
+        list_cluster_deployment_dict()
+        list_cluster_deployment_dict(
+            namespace='testnamespace456', watch=True, _preload_content=False)
+
+        assert [c[0][0] for c in mock_call_api.call_args_list] == [
+            '/apis/apps/v1/deployments',
+            '/apis/apps/v1/namespaces/testnamespace456/deployments']
+        args, kwargs = mock_call_api.call_args
+        assert kwargs['query_params'] == [
+            ('labelSelector', get_default_label_selector()),
+            ('watch', 'true')]
+        assert kwargs['_preload_content'] is False
+
+
+class TestUpdateMemcachedStatus():
+    def setUp(self):
+        self.name = BASE_CLUSTER_OBJECT['metadata']['name']
+        self.namespace = BASE_CLUSTER_OBJECT['metadata']['namespace']
+        self.status = {'observedGeneration': 2}
+
+    @patch('kubernetes.client.CustomObjectsApi.patch_namespaced_custom_object_status', return_value={})
+    def test_success(self, mock_patch_namespaced_custom_object):
+        cluster = update_memcached_status(
+            self.name, self.namespace, self.status)
+
+        mock_patch_namespaced_custom_object.assert_called_once_with(
+            'kubestack.com', 'v1', self.namespace, 'memcacheds', self.name,
+            {'status': self.status})
+        assert cluster == {}
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.CustomObjectsApi.patch_namespaced_custom_object_status', side_effect=client.rest.ApiException(status=500))
+    def test_rest_exception(self, mock_patch_namespaced_custom_object, mock_logging):
+        cluster = update_memcached_status(
+            self.name, self.namespace, self.status)
+
+        assert mock_logging.exception.called is True
+        assert cluster is False
+
+
+class TestApplyService():
+    def setUp(self):
+        self.cluster_object = BASE_CLUSTER_OBJECT
+        self.name = self.cluster_object['metadata']['name']
+        self.namespace = self.cluster_object['metadata']['namespace']
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.ApiClient.call_api', return_value=client.V1Service())
+    def test_success(self, mock_call_api, mock_logging):
+        service_object = get_mcrouter_service_object(self.cluster_object)
+
+        service = apply_service(service_object)
+
+        args, kwargs = mock_call_api.call_args
+        assert args == ('/api/v1/namespaces/{}/services/{}'.format(
+            self.namespace, self.name), 'PATCH')
+        assert kwargs['query_params'] == [
+            ('fieldManager', 'memcached-operator'), ('force', 'true')]
+        assert kwargs['header_params']['Content-Type'] == \
+            'application/apply-patch+yaml'
+        assert kwargs['response_type'] == 'V1Service'
+        body = json.loads(kwargs['body'])
+        assert body['apiVersion'] == 'v1'
+        assert body['kind'] == 'Service'
+        assert body['metadata']['name'] == self.name
+        mock_logging.info.assert_called_once_with(
+            'applied svc/{} in ns/{}'.format(self.name, self.namespace))
+        assert isinstance(service, client.V1Service)
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.ApiClient.call_api', side_effect=client.rest.ApiException(status=500))
+    def test_rest_exception(self, mock_call_api, mock_logging):
+        service = apply_service(
+            get_mcrouter_service_object(self.cluster_object))
+
+        assert mock_logging.exception.called is True
+        assert service is False
+
+
+class TestApplyDeployment():
+    def setUp(self):
+        self.cluster_object = BASE_CLUSTER_OBJECT
+        self.name = self.cluster_object['metadata']['name']
+        self.namespace = self.cluster_object['metadata']['namespace']
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.ApiClient.call_api', return_value=client.V1Deployment())
+    def test_success(self, mock_call_api, mock_logging):
+        deployment_object = get_mcrouter_deployment_object(self.cluster_object)
+
+        deployment = apply_deployment(deployment_object)
+
+        args, kwargs = mock_call_api.call_args
+        assert args == ('/apis/apps/v1/namespaces/{}/deployments/{}-router'.format(
+            self.namespace, self.name), 'PATCH')
+        assert kwargs['response_type'] == 'V1Deployment'
+        body = json.loads(kwargs['body'])
+        assert body['apiVersion'] == 'apps/v1'
+        assert body['kind'] == 'Deployment'
+        assert body['spec']['selector'] == {
+            'matchLabels': body['spec']['template']['metadata']['labels']}
+        mock_logging.info.assert_called_once_with(
+            'applied deploy/{}-router in ns/{}'.format(
+                self.name, self.namespace))
+        assert isinstance(deployment, client.V1Deployment)
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.ApiClient.call_api', side_effect=client.rest.ApiException(status=409))
+    def test_rest_exception(self, mock_call_api, mock_logging):
+        deployment = apply_deployment(
+            get_memcached_deployment_object(self.cluster_object))
+
+        assert mock_logging.exception.called is True
+        assert deployment is False
+
+
 class TestCreateService():
     def setUp(self):
         self.cluster_object = BASE_CLUSTER_OBJECT
@@ -113,6 +380,15 @@ class TestDeleteService():
             'deleted svc/{} from ns/{}'.format(self.name, self.namespace))
         assert service is True
 
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.CoreV1Api.delete_namespaced_service', side_effect=client.rest.ApiException(status=404))
+    def test_nonexistent(self, mock_delete_namespaced_service, mock_logging):
+        service = delete_service(self.name, self.namespace)
+
+        mock_logging.debug.assert_called_once_with(
+            'not deleting nonexistent svc/{} from ns/{}'.format(self.name, self.namespace))
+        assert service is True
+
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
     @patch('kubernetes.client.CoreV1Api.delete_namespaced_service', side_effect=client.rest.ApiException(status=500))
     def test_rest_exception(self, mock_delete_namespaced_service, mock_logging):
@@ -137,7 +413,7 @@ class TestCreateMemcachedDeployment():
         self.replicas = self.cluster_object['memcached']['replicas']
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.create_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
+    @patch('kubernetes.client.AppsV1Api.create_namespaced_deployment', return_value=client.V1Deployment())
     def test_success(self, mock_create_namespaced_deployment, mock_logging):
         deployment = create_memcached_deployment(self.cluster_object)
 
@@ -146,10 +422,10 @@ class TestCreateMemcachedDeployment():
             self.namespace, body)
         mock_logging.info.assert_called_once_with(
             'created deploy/{} in ns/{}'.format(self.name, self.namespace))
-        assert isinstance(deployment, client.AppsV1beta1Deployment)
+        assert isinstance(deployment, client.V1Deployment)
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=409))
+    @patch('kubernetes.client.AppsV1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=409))
     def test_already_exists(self, mock_create_namespaced_deployment, mock_logging):
         deployment = create_memcached_deployment(self.cluster_object)
 
@@ -158,7 +434,7 @@ class TestCreateMemcachedDeployment():
         assert deployment is False
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
+    @patch('kubernetes.client.AppsV1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
     def test_other_rest_exception(self, mock_create_namespaced_deployment, mock_logging):
         deployment = create_memcached_deployment(self.cluster_object)
 
@@ -174,7 +450,7 @@ class TestCreateMcrouterDeployment():
         self.replicas = self.cluster_object['mcrouter']['replicas']
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.create_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
+    @patch('kubernetes.client.AppsV1Api.create_namespaced_deployment', return_value=client.V1Deployment())
     def test_success(self, mock_create_namespaced_deployment, mock_logging):
         deployment = create_mcrouter_deployment(self.cluster_object)
 
@@ -183,10 +459,10 @@ class TestCreateMcrouterDeployment():
             self.namespace, body)
         mock_logging.info.assert_called_once_with(
             'created deploy/{}-router in ns/{}'.format(self.name, self.namespace))
-        assert isinstance(deployment, client.AppsV1beta1Deployment)
+        assert isinstance(deployment, client.V1Deployment)
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=409))
+    @patch('kubernetes.client.AppsV1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=409))
     def test_already_exists(self, mock_create_namespaced_deployment, mock_logging):
         deployment = create_mcrouter_deployment(self.cluster_object)
 
@@ -195,7 +471,7 @@ class TestCreateMcrouterDeployment():
         assert deployment is False
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
+    @patch('kubernetes.client.AppsV1Api.create_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
     def test_other_rest_exception(self, mock_create_namespaced_deployment, mock_logging):
         deployment = create_mcrouter_deployment(self.cluster_object)
 
@@ -211,7 +487,7 @@ class TestUpdateMemcachedDeployment():
         self.replicas = self.cluster_object['memcached']['replicas']
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.patch_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
+    @patch('kubernetes.client.AppsV1Api.patch_namespaced_deployment', return_value=client.V1Deployment())
     def test_success(self, mock_patch_namespaced_deployment, mock_logging):
         deployment = update_memcached_deployment(self.cluster_object)
 
@@ -220,10 +496,10 @@ class TestUpdateMemcachedDeployment():
             self.name, self.namespace, body)
         mock_logging.info.assert_called_once_with(
             'updated deploy/{} in ns/{}'.format(self.name, self.namespace))
-        assert isinstance(deployment, client.AppsV1beta1Deployment)
+        assert isinstance(deployment, client.V1Deployment)
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.patch_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
+    @patch('kubernetes.client.AppsV1Api.patch_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
     def test_rest_exception(self, mock_patch_namespaced_deployment, mock_logging):
         deployment = update_memcached_deployment(self.cluster_object)
 
@@ -239,7 +515,7 @@ class TestUpdateMcrouterDeployment():
         self.replicas = self.cluster_object['mcrouter']['replicas']
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.patch_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
+    @patch('kubernetes.client.AppsV1Api.patch_namespaced_deployment', return_value=client.V1Deployment())
     def test_success(self, mock_patch_namespaced_deployment, mock_logging):
         deployment = update_mcrouter_deployment(self.cluster_object)
 
@@ -248,10 +524,10 @@ class TestUpdateMcrouterDeployment():
             '{}-router'.format(self.name), self.namespace, body)
         mock_logging.info.assert_called_once_with(
             'updated deploy/{}-router in ns/{}'.format(self.name, self.namespace))
-        assert isinstance(deployment, client.AppsV1beta1Deployment)
+        assert isinstance(deployment, client.V1Deployment)
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.patch_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
+    @patch('kubernetes.client.AppsV1Api.patch_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
     def test_rest_exception(self, mock_patch_namespaced_deployment, mock_logging):
         deployment = update_mcrouter_deployment(self.cluster_object)
 
@@ -265,7 +541,7 @@ class TestDeleteDeployment():
         self.namespace = 'testnamespace456'
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.delete_namespaced_deployment')
+    @patch('kubernetes.client.AppsV1Api.delete_namespaced_deployment')
     def test_success(self, mock_delete_namespaced_deployment, mock_logging):
         response = delete_deployment(self.name, self.namespace)
 
@@ -277,7 +553,7 @@ class TestDeleteDeployment():
         assert response is True
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.delete_namespaced_deployment', side_effect=client.rest.ApiException(status=404))
+    @patch('kubernetes.client.AppsV1Api.delete_namespaced_deployment', side_effect=client.rest.ApiException(status=404))
     def test_nonexistent(self, mock_delete_namespaced_service, mock_logging):
         response = delete_deployment(self.name, self.namespace)
 
@@ -286,9 +562,165 @@ class TestDeleteDeployment():
         assert response is True
 
     @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
-    @patch('kubernetes.client.AppsV1beta1Api.delete_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
+    @patch('kubernetes.client.AppsV1Api.delete_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
     def test_rest_exception(self, mock_delete_namespaced_service, mock_logging):
         response = delete_deployment(self.name, self.namespace)
 
         assert mock_logging.exception.called is True
         assert response is False
+
+
+class TestRenewLease():
+    def setUp(self):
+        self.lease_object = get_lease_object(
+            'testlease', 'testnamespace456', 'replica-a', 15)
+
+    @patch('kubernetes.client.CoordinationV1beta1Api.create_namespaced_lease')
+    @patch('kubernetes.client.CoordinationV1beta1Api.patch_namespaced_lease')
+    def test_renew(self, mock_patch_namespaced_lease, mock_create_namespaced_lease):
+        response = renew_lease(self.lease_object)
+
+        mock_patch_namespaced_lease.assert_called_once_with(
+            'testlease', 'testnamespace456',
+            {'spec': self.lease_object['spec']})
+        assert mock_create_namespaced_lease.called is False
+        assert response is mock_patch_namespaced_lease.return_value
+
+    @patch('kubernetes.client.CoordinationV1beta1Api.create_namespaced_lease')
+    @patch('kubernetes.client.CoordinationV1beta1Api.patch_namespaced_lease', side_effect=client.rest.ApiException(status=404))
+    def test_create_missing(self, mock_patch_namespaced_lease, mock_create_namespaced_lease):
+        response = renew_lease(self.lease_object)
+
+        mock_create_namespaced_lease.assert_called_once_with(
+            'testnamespace456', self.lease_object)
+        assert response is mock_create_namespaced_lease.return_value
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.CoordinationV1beta1Api.create_namespaced_lease')
+    @patch('kubernetes.client.CoordinationV1beta1Api.patch_namespaced_lease', side_effect=client.rest.ApiException(status=500))
+    def test_renew_500(self, mock_patch_namespaced_lease, mock_create_namespaced_lease, mock_logging):
+        response = renew_lease(self.lease_object)
+
+        assert mock_create_namespaced_lease.called is False
+        assert mock_logging.exception.called is True
+        assert response is False
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.CoordinationV1beta1Api.create_namespaced_lease', side_effect=client.rest.ApiException(status=409))
+    @patch('kubernetes.client.CoordinationV1beta1Api.patch_namespaced_lease', side_effect=client.rest.ApiException(status=404))
+    def test_create_409(self, mock_patch_namespaced_lease, mock_create_namespaced_lease, mock_logging):
+        response = renew_lease(self.lease_object)
+
+        assert mock_logging.exception.called is False
+        assert response is False
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.CoordinationV1beta1Api.create_namespaced_lease', side_effect=client.rest.ApiException(status=500))
+    @patch('kubernetes.client.CoordinationV1beta1Api.patch_namespaced_lease', side_effect=client.rest.ApiException(status=404))
+    def test_create_500(self, mock_patch_namespaced_lease, mock_create_namespaced_lease, mock_logging):
+        response = renew_lease(self.lease_object)
+
+        assert mock_logging.exception.called is True
+        assert response is False
+
+    @patch('kubernetes.client.CoordinationV1beta1Api.create_namespaced_lease')
+    @patch('kubernetes.client.CoordinationV1beta1Api.patch_namespaced_lease', side_effect=client.rest.ApiException(status=409))
+    def test_renew_conflict(self, mock_patch_namespaced_lease, mock_create_namespaced_lease):
+        self.lease_object['metadata']['resourceVersion'] = '42'
+
+        response = renew_lease(self.lease_object)
+
+        mock_patch_namespaced_lease.assert_called_once_with(
+            'testlease', 'testnamespace456',
+            {'metadata': {'resourceVersion': '42'},
+             'spec': self.lease_object['spec']})
+        assert mock_create_namespaced_lease.called is False
+        assert response is False
+
+
+class TestReadLease():
+    @patch('kubernetes.client.CoordinationV1beta1Api.read_namespaced_lease')
+    def test_read(self, mock_read_namespaced_lease):
+        response = read_lease('testlease', 'testnamespace456')
+
+        mock_read_namespaced_lease.assert_called_once_with(
+            'testlease', 'testnamespace456')
+        assert response is mock_read_namespaced_lease.return_value
+
+    @patch('kubernetes.client.CoordinationV1beta1Api.read_namespaced_lease', side_effect=client.rest.ApiException(status=404))
+    def test_read_404(self, mock_read_namespaced_lease):
+        assert read_lease('testlease', 'testnamespace456') is None
+
+
+class TestDeleteLease():
+    @patch('kubernetes.client.CoordinationV1beta1Api.delete_namespaced_lease')
+    def test_delete(self, mock_delete_namespaced_lease):
+        response = delete_lease('testlease', 'testnamespace456')
+
+        args, _ = mock_delete_namespaced_lease.call_args
+        assert args[:2] == ('testlease', 'testnamespace456')
+        assert response is True
+
+    @patch('kubernetes.client.CoordinationV1beta1Api.delete_namespaced_lease', side_effect=client.rest.ApiException(status=404))
+    def test_delete_404(self, mock_delete_namespaced_lease):
+        assert delete_lease('testlease', 'testnamespace456') is True
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.logging')
+    @patch('kubernetes.client.CoordinationV1beta1Api.delete_namespaced_lease', side_effect=client.rest.ApiException(status=500))
+    def test_delete_500(self, mock_delete_namespaced_lease, mock_logging):
+        response = delete_lease('testlease', 'testnamespace456')
+
+        assert mock_logging.exception.called is True
+        assert response is False
+
+
+class TestApiClient():
+    def tearDown(self):
+        configure_api_client()
+
+    def test_shared(self):
+        assert get_api_client() is get_api_client()
+
+    def test_configure(self):
+        api_client = configure_api_client(pool_size=8, keep_alive=30)
+
+        assert get_api_client() is api_client
+        assert api_client.configuration.connection_pool_maxsize == 8
+        pool_kw = api_client.rest_client.pool_manager.connection_pool_kw
+        assert pool_kw['maxsize'] == 8
+        assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in \
+            pool_kw['socket_options']
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.limit_rest_client')
+    def test_rate_limited(self, mock_limit_rest_client):
+        api_client = configure_api_client(qps=5, burst=10)
+
+        rest_client, limiter = mock_limit_rest_client.call_args[0]
+        assert rest_client is api_client.rest_client
+        assert limiter.qps == 5
+        assert limiter.burst == 10
+
+    @patch('memcached_operator.memcached_operator.kubernetes_helpers.limit_rest_client')
+    def test_not_rate_limited(self, mock_limit_rest_client):
+        configure_api_client()
+
+        assert mock_limit_rest_client.called is False
+
+    def test_helpers_use_shared_client(self):
+        api_client = configure_api_client()
+
+        with patch('kubernetes.client.CoreV1Api') as mock_core_v1_api:
+            update_service(get_mcrouter_service_object(BASE_CLUSTER_OBJECT))
+
+        mock_core_v1_api.assert_called_once_with(api_client)
+
+    def test_connection_pool_usage(self):
+        api_client = configure_api_client(pool_size=4)
+        connection_pool = api_client.rest_client.pool_manager \
+            .connection_from_url('https://127.0.0.1:6443/')
+        connection = connection_pool._get_conn()
+
+        assert get_connection_pool_usage() == (1, 4)
+
+        connection_pool._put_conn(connection)
+        assert get_connection_pool_usage() == (0, 4)
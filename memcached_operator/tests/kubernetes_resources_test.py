@@ -1,13 +1,24 @@
 import json
 from unittest.mock import patch, call, MagicMock
 from copy import deepcopy
+from datetime import datetime, timezone
 
 from kubernetes import client
 
 from ..memcached_operator.kubernetes_resources import (
+    DESIRED_STATE_HASH_ANNOTATION,
+    parse_cluster_spec,
+    forget_rendered,
+    get_desired_state_hash,
+    get_pod_template_hash,
+    get_owner_references,
+    get_owner_uid,
+    is_owned,
     get_default_labels,
     get_default_label_selector,
+    get_lease_object,
     get_mcrouter_service_object,
+    get_memcached_service_object,
     get_memcached_deployment_object,
     get_mcrouter_deployment_object)
 
@@ -56,6 +67,200 @@ class TestGetDefaultLabelSelector():
             name=name)
 
 
+class TestOwnerReferences():
+    def setUp(self):
+        self.cluster_object = {'metadata': {'name': 'testname123',
+                                            'namespace': 'testnamespace456',
+                                            'uid': 'test-uid-1234567890'}}
+        self.builders = [
+            get_mcrouter_service_object,
+            get_memcached_service_object,
+            get_memcached_deployment_object,
+            get_mcrouter_deployment_object]
+
+    def test_owner_reference(self):
+        spec = parse_cluster_spec(self.cluster_object)
+        owner_references = get_owner_references(spec)
+
+        assert owner_references == [{
+            'apiVersion': 'kubestack.com/v1',
+            'kind': 'Memcached',
+            'name': 'testname123',
+            'uid': 'test-uid-1234567890',
+            'controller': True,
+            'blockOwnerDeletion': True}]
+
+    def test_no_uid(self):
+        del self.cluster_object['metadata']['uid']
+        spec = parse_cluster_spec(self.cluster_object)
+
+        assert get_owner_references(spec) is None
+
+    def test_children_are_owned(self):
+        spec = parse_cluster_spec(self.cluster_object)
+        for builder in self.builders:
+            resource = builder(self.cluster_object)
+            assert resource['metadata']['ownerReferences'] == \
+                get_owner_references(spec)
+            assert is_owned(resource) is True
+
+    def test_cached_children_are_owned(self):
+        resource = client.V1Service(metadata=client.V1ObjectMeta(
+            owner_references=[client.V1OwnerReference(
+                api_version='kubestack.com/v1', kind='Memcached',
+                name='testname123', uid='test-uid-1234567890',
+                controller=True)]))
+
+        assert is_owned(resource) is True
+        assert get_owner_uid(resource) == 'test-uid-1234567890'
+
+    def test_owner_uid(self):
+        for builder in self.builders:
+            resource = builder(self.cluster_object)
+            assert get_owner_uid(resource) == 'test-uid-1234567890'
+
+    def test_not_owned(self):
+        del self.cluster_object['metadata']['uid']
+
+        for builder in self.builders:
+            resource = builder(self.cluster_object)
+            assert is_owned(resource) is False
+            assert get_owner_uid(resource) is None
+
+
+class TestDesiredStateHash():
+    def setUp(self):
+        self.cluster_object = {'metadata': {'name': 'testname123',
+                                            'namespace': 'testnamespace456'}}
+        self.builders = [
+            get_mcrouter_service_object,
+            get_memcached_service_object,
+            get_memcached_deployment_object,
+            get_mcrouter_deployment_object]
+
+    def test_has_hash_annotation(self):
+        for builder in self.builders:
+            resource = builder(self.cluster_object)
+            annotations = resource['metadata']['annotations']
+            assert DESIRED_STATE_HASH_ANNOTATION in annotations
+            assert get_desired_state_hash(resource) == \
+                annotations[DESIRED_STATE_HASH_ANNOTATION]
+
+    def test_hash_is_stable(self):
+        for builder in self.builders:
+            first = builder(self.cluster_object)
+            second = builder(deepcopy(self.cluster_object))
+            assert get_desired_state_hash(first) == \
+                get_desired_state_hash(second)
+
+    def test_hash_changes_with_spec(self):
+        changed_object = deepcopy(self.cluster_object)
+        changed_object['spec'] = {'memcached': {'replicas': 4}}
+
+        first = get_memcached_deployment_object(self.cluster_object)
+        second = get_memcached_deployment_object(changed_object)
+        assert get_desired_state_hash(first) != get_desired_state_hash(second)
+
+    def test_pod_template_hash(self):
+        deployment = get_memcached_deployment_object(self.cluster_object)
+        changed_object = deepcopy(self.cluster_object)
+        changed_object['spec'] = {'memcached': {'replicas': 4}}
+
+        assert get_pod_template_hash(deployment) is not None
+        assert get_pod_template_hash(deployment) != get_pod_template_hash(
+            get_memcached_deployment_object(changed_object))
+        assert get_pod_template_hash(
+            get_memcached_service_object(self.cluster_object)) is None
+
+    def test_hash_differs_per_resource(self):
+        hashes = set(get_desired_state_hash(builder(self.cluster_object))
+                     for builder in self.builders)
+        assert len(hashes) == len(self.builders)
+
+    def test_cached_resource(self):
+        resource = client.V1Service(metadata=client.V1ObjectMeta(
+            annotations={DESIRED_STATE_HASH_ANNOTATION: 'testhash'}))
+        assert get_desired_state_hash(resource) == 'testhash'
+
+    def test_no_annotation(self):
+        resource = client.V1Service(metadata=client.V1ObjectMeta())
+        assert get_desired_state_hash(resource) is None
+        assert get_desired_state_hash({'metadata': {}}) is None
+
+
+class TestClusterSpec():
+    def setUp(self):
+        self.cluster_object = {'metadata': {'name': 'testname123',
+                                            'namespace': 'testnamespace456'}}
+
+    def test_defaults(self):
+        spec = parse_cluster_spec(self.cluster_object)
+
+        assert spec.name == 'testname123'
+        assert spec.namespace == 'testnamespace456'
+        assert spec.uid is None
+        assert spec.memcached_replicas == 2
+        assert spec.memcached_limit_cpu == '100m'
+        assert spec.memcached_limit_memory == '64Mi'
+        assert spec.mcrouter_replicas == 1
+        assert spec.mcrouter_limit_cpu == '50m'
+        assert spec.mcrouter_limit_memory == '32Mi'
+
+    def test_custom(self):
+        self.cluster_object['metadata']['uid'] = 'test-uid-1234567890'
+        self.cluster_object['spec'] = {
+            'memcached': {'replicas': 4, 'memcached_limit_memory': '1Gi'},
+            'mcrouter': {'mcrouter_limit_cpu': '1'}}
+
+        spec = parse_cluster_spec(self.cluster_object)
+
+        assert spec.uid == 'test-uid-1234567890'
+        assert spec.memcached_replicas == 4
+        assert spec.memcached_limit_memory == '1Gi'
+        assert spec.mcrouter_limit_cpu == '1'
+
+    def test_equality(self):
+        changed_object = deepcopy(self.cluster_object)
+        changed_object['spec'] = {'mcrouter': {'replicas': 3}}
+
+        spec = parse_cluster_spec(self.cluster_object)
+        assert spec == parse_cluster_spec(deepcopy(self.cluster_object))
+        assert hash(spec) == hash(parse_cluster_spec(self.cluster_object))
+        assert spec != parse_cluster_spec(changed_object)
+
+    def test_slots(self):
+        spec = parse_cluster_spec(self.cluster_object)
+        assert not hasattr(spec, '__dict__')
+
+
+class TestMemoizeRender():
+    def setUp(self):
+        self.cluster_object = {'metadata': {'name': 'testname123',
+                                            'namespace': 'testnamespace456'}}
+        forget_rendered('testname123', 'testnamespace456')
+
+    def test_unchanged_spec(self):
+        first = get_memcached_deployment_object(self.cluster_object)
+        second = get_memcached_deployment_object(deepcopy(self.cluster_object))
+        assert first is second
+
+    def test_changed_spec(self):
+        changed_object = deepcopy(self.cluster_object)
+        changed_object['spec'] = {'memcached': {'replicas': 4}}
+
+        first = get_memcached_deployment_object(self.cluster_object)
+        second = get_memcached_deployment_object(changed_object)
+        assert first is not second
+        assert second['spec']['replicas'] == 4
+
+    def test_forget_rendered(self):
+        first = get_memcached_deployment_object(self.cluster_object)
+        forget_rendered('testname123', 'testnamespace456')
+        second = get_memcached_deployment_object(self.cluster_object)
+        assert first is not second
+        assert first == second
+
+
 class TestGetServiceObject():
     def setUp(self):
         self.name = 'testname123'
@@ -65,63 +270,65 @@ class TestGetServiceObject():
 
     def test_returns_v1_service(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert isinstance(service, client.V1Service)
+        assert isinstance(service, dict)
+        assert service['apiVersion'] == 'v1'
+        assert service['kind'] == 'Service'
 
     def test_has_metadata(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert hasattr(service, 'metadata')
-        assert isinstance(service.metadata, client.V1ObjectMeta)
+        assert 'metadata' in service
+        assert isinstance(service['metadata'], dict)
 
     def test_has_metadata_name(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert service.metadata.name == self.name
+        assert service['metadata']['name'] == self.name
 
     def test_has_metadata_namespace(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert service.metadata.namespace == self.namespace
+        assert service['metadata']['namespace'] == self.namespace
 
     def test_has_metadata_labels(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert hasattr(service.metadata, 'labels')
-        assert isinstance(service.metadata.labels, dict)
+        assert 'labels' in service['metadata']
+        assert isinstance(service['metadata']['labels'], dict)
         default_labels = get_default_labels(name=self.name)
         for label in default_labels:
-            assert label in service.metadata.labels
-            assert service.metadata.labels[label] == default_labels[label]
+            assert label in service['metadata']['labels']
+            assert service['metadata']['labels'][label] == default_labels[label]
 
     def test_has_monitoring_label(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert 'monitoring.kubestack.com' in service.metadata.labels
-        assert service.metadata.labels['monitoring.kubestack.com'] == 'metrics'
+        assert 'monitoring.kubestack.com' in service['metadata']['labels']
+        assert service['metadata']['labels']['monitoring.kubestack.com'] == 'metrics'
 
     def test_has_spec(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert hasattr(service, 'spec')
-        assert isinstance(service.spec, client.V1ServiceSpec)
+        assert 'spec' in service
+        assert isinstance(service['spec'], dict)
 
     def test_has_spec_selector(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert hasattr(service.spec, 'selector')
-        assert isinstance(service.spec.selector, dict)
+        assert 'selector' in service['spec']
+        assert isinstance(service['spec']['selector'], dict)
         labels = get_default_labels(name=self.name)
         labels['service-type'] = 'mcrouter'
-        assert service.spec.selector == labels
+        assert service['spec']['selector'] == labels
 
     def test_has_spec_ports(self):
         service = get_mcrouter_service_object(self.cluster_object)
-        assert hasattr(service.spec, 'ports')
-        assert isinstance(service.spec.ports, list)
-        assert len(service.spec.ports) == 2
+        assert 'ports' in service['spec']
+        assert isinstance(service['spec']['ports'], list)
+        assert len(service['spec']['ports']) == 2
 
-        assert isinstance(service.spec.ports[0], client.V1ServicePort)
-        assert service.spec.ports[0].name == 'memcached'
-        assert service.spec.ports[0].port == 11211
-        assert service.spec.ports[0].protocol == 'TCP'
+        assert isinstance(service['spec']['ports'][0], dict)
+        assert service['spec']['ports'][0]['name'] == 'memcached'
+        assert service['spec']['ports'][0]['port'] == 11211
+        assert service['spec']['ports'][0]['protocol'] == 'TCP'
 
-        assert isinstance(service.spec.ports[1], client.V1ServicePort)
-        assert service.spec.ports[1].name == 'metrics'
-        assert service.spec.ports[1].port == 9150
-        assert service.spec.ports[1].protocol == 'TCP'
+        assert isinstance(service['spec']['ports'][1], dict)
+        assert service['spec']['ports'][1]['name'] == 'metrics'
+        assert service['spec']['ports'][1]['port'] == 9150
+        assert service['spec']['ports'][1]['protocol'] == 'TCP'
 
 
 TEST_POD_1 = client.V1Pod(status=client.V1PodStatus(pod_ip='1.1.1.1'))
@@ -136,140 +343,154 @@ class TestGetMemcachedDeploymentObject():
         self.cluster_object = {'metadata': {'name': self.name,
                                             'namespace': self.namespace}}
 
-    def test_returns_v1beta1_deployment(self):
+    def test_returns_v1_deployment(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert isinstance(deployment, client.AppsV1beta1Deployment)
+        assert isinstance(deployment, dict)
+        assert deployment['apiVersion'] == 'apps/v1'
+        assert deployment['kind'] == 'Deployment'
 
     def test_has_metadata(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert hasattr(deployment, 'metadata')
-        assert isinstance(deployment.metadata, client.V1ObjectMeta)
+        assert 'metadata' in deployment
+        assert isinstance(deployment['metadata'], dict)
 
     def test_has_metadata_name(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert deployment.metadata.name == self.name
+        assert deployment['metadata']['name'] == self.name
 
     def test_has_metadata_namespace(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert deployment.metadata.namespace == self.namespace
+        assert deployment['metadata']['namespace'] == self.namespace
 
     def test_has_metadata_labels(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert hasattr(deployment.metadata, 'labels')
-        assert isinstance(deployment.metadata.labels, dict)
+        assert 'labels' in deployment['metadata']
+        assert isinstance(deployment['metadata']['labels'], dict)
         labels = get_default_labels(name=self.name)
         labels['service-type'] = 'memcached'
-        assert deployment.metadata.labels == labels
+        assert deployment['metadata']['labels'] == labels
 
     def test_has_spec(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert hasattr(deployment, 'spec')
-        assert isinstance(deployment.spec, client.AppsV1beta1DeploymentSpec)
+        assert 'spec' in deployment
+        assert isinstance(deployment['spec'], dict)
 
     def test_has_spec_default_replicas(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert deployment.spec.replicas == 2
+        assert deployment['spec']['replicas'] == 2
 
     def test_has_spec_custom_replicas(self):
         cluster_object = deepcopy(self.cluster_object)
         replicas = 8
         cluster_object['spec'] = {'memcached': {'replicas': replicas}}
         deployment = get_memcached_deployment_object(cluster_object)
-        assert deployment.spec.replicas == replicas
+        assert deployment['spec']['replicas'] == replicas
+
+    def test_autoscaled_leaves_replicas_out(self):
+        cluster_object = deepcopy(self.cluster_object)
+        cluster_object['spec'] = {'memcached': {'replicas': 8, 'autoscaled': True}}
+        deployment = get_memcached_deployment_object(cluster_object)
+        assert 'replicas' not in deployment['spec']
+
+    def test_has_spec_selector(self):
+        deployment = get_memcached_deployment_object(self.cluster_object)
+        assert deployment['spec']['selector'] == {
+            'matchLabels': deployment['spec']['template']['metadata'][
+                'labels']}
 
     def test_has_spec_template(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert hasattr(deployment.spec, 'template')
-        assert isinstance(deployment.spec.template, client.V1PodTemplateSpec)
+        assert 'template' in deployment['spec']
+        assert isinstance(deployment['spec']['template'], dict)
 
     def test_has_spec_template_metadata(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        assert hasattr(deployment.spec.template, 'metadata')
+        assert 'metadata' in deployment['spec']['template']
         assert isinstance(
-            deployment.spec.template.metadata, client.V1ObjectMeta)
+            deployment['spec']['template']['metadata'], dict)
 
     def test_has_spec_template_metadata_labels(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        metadata = deployment.spec.template.metadata
-        assert hasattr(metadata, 'labels')
-        assert isinstance(metadata.labels, dict)
+        metadata = deployment['spec']['template']['metadata']
+        assert 'labels' in metadata
+        assert isinstance(metadata['labels'], dict)
         labels = get_default_labels(name=self.name)
         labels['service-type'] = 'memcached'
-        assert metadata.labels == labels
+        assert metadata['labels'] == labels
 
     def test_has_pod_spec(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        template = deployment.spec.template
-        assert hasattr(template, 'spec')
-        assert isinstance(template.spec, client.V1PodSpec)
+        template = deployment['spec']['template']
+        assert 'spec' in template
+        assert isinstance(template['spec'], dict)
 
     def test_has_containers(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        spec = deployment.spec.template.spec
-        assert hasattr(spec, 'containers')
-        assert isinstance(spec.containers, list)
-        assert len(spec.containers) == 2
-        for c in spec.containers:
-            assert isinstance(c, client.V1Container)
+        spec = deployment['spec']['template']['spec']
+        assert 'containers' in spec
+        assert isinstance(spec['containers'], list)
+        assert len(spec['containers']) == 2
+        for c in spec['containers']:
+            assert isinstance(c, dict)
 
     def test_memcached_container(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        container = deployment.spec.template.spec.containers[0]
-        assert hasattr(container, 'name')
-        assert container.name == 'memcached'
+        container = deployment['spec']['template']['spec']['containers'][0]
+        assert 'name' in container
+        assert container['name'] == 'memcached'
 
-        assert hasattr(container, 'command')
-        assert container.command == ['memcached', '-p', '11211']
+        assert 'command' in container
+        assert container['command'] == ['memcached', '-p', '11211']
 
-        assert hasattr(container, 'image')
-        assert container.image == 'memcached:1.4.33'
+        assert 'image' in container
+        assert container['image'] == 'memcached:1.4.33'
 
-        assert hasattr(container, 'ports')
-        assert len(container.ports) == 1
-        assert isinstance(container.ports[0], client.V1ContainerPort)
-        assert container.ports[0].name == 'memcached'
-        assert container.ports[0].container_port == 11211
-        assert container.ports[0].protocol == 'TCP'
+        assert 'ports' in container
+        assert len(container['ports']) == 1
+        assert isinstance(container['ports'][0], dict)
+        assert container['ports'][0]['name'] == 'memcached'
+        assert container['ports'][0]['containerPort'] == 11211
+        assert container['ports'][0]['protocol'] == 'TCP'
 
-        assert hasattr(container, 'resources')
-        assert isinstance(container.resources, client.V1ResourceRequirements)
-        assert container.resources.limits == {'cpu': '100m', 'memory': '64Mi'}
-        assert container.resources.requests == {'cpu': '100m', 'memory': '64Mi'}
+        assert 'resources' in container
+        assert isinstance(container['resources'], dict)
+        assert container['resources']['limits'] == {'cpu': '100m', 'memory': '64Mi'}
+        assert container['resources']['requests'] == {'cpu': '100m', 'memory': '64Mi'}
 
     def test_memcached_container_custom_limit_cpu(self):
         cluster_object = deepcopy(self.cluster_object)
         limit = '200m'
         cluster_object['spec'] = {'memcached': {'memcached_limit_cpu': limit}}
         deployment = get_memcached_deployment_object(cluster_object)
-        assert deployment.spec.template.spec.containers[0].resources.limits['cpu'] == limit
+        assert deployment['spec']['template']['spec']['containers'][0]['resources']['limits']['cpu'] == limit
 
     def test_memcached_container_custom_limit_memory(self):
         cluster_object = deepcopy(self.cluster_object)
         limit = '128Mi'
         cluster_object['spec'] = {'memcached': {'memcached_limit_memory': limit}}
         deployment = get_memcached_deployment_object(cluster_object)
-        assert deployment.spec.template.spec.containers[0].resources.limits['memory'] == limit
+        assert deployment['spec']['template']['spec']['containers'][0]['resources']['limits']['memory'] == limit
 
     def test_metrics_container(self):
         deployment = get_memcached_deployment_object(self.cluster_object)
-        container = deployment.spec.template.spec.containers[1]
-        assert hasattr(container, 'name')
-        assert container.name == 'prometheus-exporter'
+        container = deployment['spec']['template']['spec']['containers'][1]
+        assert 'name' in container
+        assert container['name'] == 'prometheus-exporter'
 
-        assert hasattr(container, 'image')
-        assert container.image == 'prom/memcached-exporter:v0.3.0'
+        assert 'image' in container
+        assert container['image'] == 'prom/memcached-exporter:v0.3.0'
 
-        assert hasattr(container, 'ports')
-        assert len(container.ports) == 1
-        assert isinstance(container.ports[0], client.V1ContainerPort)
-        assert container.ports[0].name == 'metrics'
-        assert container.ports[0].container_port == 9150
-        assert container.ports[0].protocol == 'TCP'
+        assert 'ports' in container
+        assert len(container['ports']) == 1
+        assert isinstance(container['ports'][0], dict)
+        assert container['ports'][0]['name'] == 'metrics'
+        assert container['ports'][0]['containerPort'] == 9150
+        assert container['ports'][0]['protocol'] == 'TCP'
 
-        assert hasattr(container, 'resources')
-        assert isinstance(container.resources, client.V1ResourceRequirements)
-        assert container.resources.limits == {'cpu': '50m', 'memory': '16Mi'}
-        assert container.resources.requests == {'cpu': '50m', 'memory': '16Mi'}
+        assert 'resources' in container
+        assert isinstance(container['resources'], dict)
+        assert container['resources']['limits'] == {'cpu': '50m', 'memory': '16Mi'}
+        assert container['resources']['requests'] == {'cpu': '50m', 'memory': '16Mi'}
 
 
 class TestGetMcrouterDeploymentObject():
@@ -279,165 +500,191 @@ class TestGetMcrouterDeploymentObject():
         self.cluster_object = {'metadata': {'name': self.name,
                                             'namespace': self.namespace}}
 
-    def test_returns_v1beta1_deployment(self):
+    def test_returns_v1_deployment(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert isinstance(deployment, client.AppsV1beta1Deployment)
+        assert isinstance(deployment, dict)
+        assert deployment['apiVersion'] == 'apps/v1'
+        assert deployment['kind'] == 'Deployment'
 
     def test_has_metadata(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert hasattr(deployment, 'metadata')
-        assert isinstance(deployment.metadata, client.V1ObjectMeta)
+        assert 'metadata' in deployment
+        assert isinstance(deployment['metadata'], dict)
 
     def test_has_metadata_name(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert deployment.metadata.name == '{}-router'.format(self.name)
+        assert deployment['metadata']['name'] == '{}-router'.format(self.name)
 
     def test_has_metadata_namespace(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert deployment.metadata.namespace == self.namespace
+        assert deployment['metadata']['namespace'] == self.namespace
 
     def test_has_metadata_labels(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert hasattr(deployment.metadata, 'labels')
-        assert isinstance(deployment.metadata.labels, dict)
+        assert 'labels' in deployment['metadata']
+        assert isinstance(deployment['metadata']['labels'], dict)
         labels = get_default_labels(name=self.name)
         labels['service-type'] = 'mcrouter'
-        assert deployment.metadata.labels == labels
+        assert deployment['metadata']['labels'] == labels
 
     def test_has_spec(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert hasattr(deployment, 'spec')
-        assert isinstance(deployment.spec, client.AppsV1beta1DeploymentSpec)
+        assert 'spec' in deployment
+        assert isinstance(deployment['spec'], dict)
 
     def test_has_spec_default_replicas(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert deployment.spec.replicas == 1
+        assert deployment['spec']['replicas'] == 1
 
     def test_has_spec_custom_replicas(self):
         cluster_object = deepcopy(self.cluster_object)
         replicas = 8
         cluster_object['spec'] = {'mcrouter': {'replicas': replicas}}
         deployment = get_mcrouter_deployment_object(cluster_object)
-        assert deployment.spec.replicas == replicas
+        assert deployment['spec']['replicas'] == replicas
+
+    def test_autoscaled_leaves_replicas_out(self):
+        cluster_object = deepcopy(self.cluster_object)
+        cluster_object['spec'] = {'mcrouter': {'replicas': 8, 'autoscaled': True}}
+        deployment = get_mcrouter_deployment_object(cluster_object)
+        assert 'replicas' not in deployment['spec']
 
     def test_has_spec_template(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert hasattr(deployment.spec, 'template')
-        assert isinstance(deployment.spec.template, client.V1PodTemplateSpec)
+        assert 'template' in deployment['spec']
+        assert isinstance(deployment['spec']['template'], dict)
 
     def test_has_spec_template_metadata(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        assert hasattr(deployment.spec.template, 'metadata')
+        assert 'metadata' in deployment['spec']['template']
         assert isinstance(
-            deployment.spec.template.metadata, client.V1ObjectMeta)
+            deployment['spec']['template']['metadata'], dict)
 
     def test_has_spec_template_metadata_labels(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        metadata = deployment.spec.template.metadata
-        assert hasattr(metadata, 'labels')
-        assert isinstance(metadata.labels, dict)
+        metadata = deployment['spec']['template']['metadata']
+        assert 'labels' in metadata
+        assert isinstance(metadata['labels'], dict)
         labels = get_default_labels(name=self.name)
         labels['service-type'] = 'mcrouter'
-        assert metadata.labels == labels
+        assert metadata['labels'] == labels
 
     def test_has_pod_spec(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        template = deployment.spec.template
-        assert hasattr(template, 'spec')
-        assert isinstance(template.spec, client.V1PodSpec)
+        template = deployment['spec']['template']
+        assert 'spec' in template
+        assert isinstance(template['spec'], dict)
 
     def test_has_containers(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        spec = deployment.spec.template.spec
-        assert hasattr(spec, 'containers')
-        assert isinstance(spec.containers, list)
-        assert len(spec.containers) == 3
-        for c in spec.containers:
-            assert isinstance(c, client.V1Container)
+        spec = deployment['spec']['template']['spec']
+        assert 'containers' in spec
+        assert isinstance(spec['containers'], list)
+        assert len(spec['containers']) == 3
+        for c in spec['containers']:
+            assert isinstance(c, dict)
 
     def test_mcrouter_container(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        container = deployment.spec.template.spec.containers[0]
-        assert hasattr(container, 'name')
-        assert container.name == 'mcrouter'
-
-        assert hasattr(container, 'command')
-        assert container.command == ['mcrouter', '-p', '11211', '-f', '/etc/mcrouter/mcrouter.conf']
-
-        assert hasattr(container, 'image')
-        assert container.image == 'kubestack/mcrouter:v0.36.0-kbst1'
-
-        assert hasattr(container, 'ports')
-        assert len(container.ports) == 1
-        assert isinstance(container.ports[0], client.V1ContainerPort)
-        assert container.ports[0].name == 'mcrouter'
-        assert container.ports[0].container_port == 11211
-        assert container.ports[0].protocol == 'TCP'
-
-        assert hasattr(container, 'volume_mounts')
-        assert isinstance(container.volume_mounts[0], client.V1VolumeMount)
-        volume_mount = container.volume_mounts[0]
-        assert volume_mount.name == 'mcrouter-config'
-        assert volume_mount.read_only == False
-        assert volume_mount.mount_path == '/etc/mcrouter'
-
-        assert hasattr(container, 'resources')
-        assert isinstance(container.resources, client.V1ResourceRequirements)
-        assert container.resources.limits == {'cpu': '50m', 'memory': '32Mi'}
-        assert container.resources.requests == {'cpu': '50m', 'memory': '32Mi'}
+        container = deployment['spec']['template']['spec']['containers'][0]
+        assert 'name' in container
+        assert container['name'] == 'mcrouter'
+
+        assert 'command' in container
+        assert container['command'] == ['mcrouter', '-p', '11211', '-f', '/etc/mcrouter/mcrouter.conf']
+
+        assert 'image' in container
+        assert container['image'] == 'kubestack/mcrouter:v0.36.0-kbst1'
+
+        assert 'ports' in container
+        assert len(container['ports']) == 1
+        assert isinstance(container['ports'][0], dict)
+        assert container['ports'][0]['name'] == 'mcrouter'
+        assert container['ports'][0]['containerPort'] == 11211
+        assert container['ports'][0]['protocol'] == 'TCP'
+
+        assert 'volumeMounts' in container
+        assert isinstance(container['volumeMounts'][0], dict)
+        volume_mount = container['volumeMounts'][0]
+        assert volume_mount['name'] == 'mcrouter-config'
+        assert volume_mount['readOnly'] == False
+        assert volume_mount['mountPath'] == '/etc/mcrouter'
+
+        assert 'resources' in container
+        assert isinstance(container['resources'], dict)
+        assert container['resources']['limits'] == {'cpu': '50m', 'memory': '32Mi'}
+        assert container['resources']['requests'] == {'cpu': '50m', 'memory': '32Mi'}
 
     def test_mcrouter_container_custom_limit_cpu(self):
         cluster_object = deepcopy(self.cluster_object)
         limit = '200m'
         cluster_object['spec'] = {'mcrouter': {'mcrouter_limit_cpu': limit}}
         deployment = get_mcrouter_deployment_object(cluster_object)
-        assert deployment.spec.template.spec.containers[0].resources.limits['cpu'] == limit
+        assert deployment['spec']['template']['spec']['containers'][0]['resources']['limits']['cpu'] == limit
 
     def test_mcrouter_container_custom_limit_memory(self):
         cluster_object = deepcopy(self.cluster_object)
         limit = '128Mi'
         cluster_object['spec'] = {'mcrouter': {'mcrouter_limit_memory': limit}}
         deployment = get_mcrouter_deployment_object(cluster_object)
-        assert deployment.spec.template.spec.containers[0].resources.limits['memory'] == limit
+        assert deployment['spec']['template']['spec']['containers'][0]['resources']['limits']['memory'] == limit
 
     def test_config_sidecar_container(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        container = deployment.spec.template.spec.containers[1]
-        assert hasattr(container, 'name')
-        assert container.name == 'config-sidecar'
+        container = deployment['spec']['template']['spec']['containers'][1]
+        assert 'name' in container
+        assert container['name'] == 'config-sidecar'
 
-        assert hasattr(container, 'image')
-        assert container.image == 'kubestack/mcrouter_sidecar:v0.1.0'
+        assert 'image' in container
+        assert container['image'] == 'kubestack/mcrouter_sidecar:v0.1.0'
 
-        assert hasattr(container, 'volume_mounts')
-        assert isinstance(container.volume_mounts[0], client.V1VolumeMount)
-        volume_mount = container.volume_mounts[0]
-        assert volume_mount.name == 'mcrouter-config'
-        assert volume_mount.read_only == False
-        assert volume_mount.mount_path == '/etc/mcrouter'
+        assert 'volumeMounts' in container
+        assert isinstance(container['volumeMounts'][0], dict)
+        volume_mount = container['volumeMounts'][0]
+        assert volume_mount['name'] == 'mcrouter-config'
+        assert volume_mount['readOnly'] == False
+        assert volume_mount['mountPath'] == '/etc/mcrouter'
 
-        assert hasattr(container, 'resources')
-        assert isinstance(container.resources, client.V1ResourceRequirements)
-        assert container.resources.limits == {'cpu': '25m', 'memory': '8Mi'}
-        assert container.resources.requests == {'cpu': '25m', 'memory': '8Mi'}
+        assert 'resources' in container
+        assert isinstance(container['resources'], dict)
+        assert container['resources']['limits'] == {'cpu': '25m', 'memory': '8Mi'}
+        assert container['resources']['requests'] == {'cpu': '25m', 'memory': '8Mi'}
 
     def test_metrics_container(self):
         deployment = get_mcrouter_deployment_object(self.cluster_object)
-        container = deployment.spec.template.spec.containers[2]
-        assert hasattr(container, 'name')
-        assert container.name == 'prometheus-exporter'
-
-        assert hasattr(container, 'image')
-        assert container.image == 'kubestack/mcrouter_exporter:v0.0.1'
-
-        assert hasattr(container, 'ports')
-        assert len(container.ports) == 1
-        assert isinstance(container.ports[0], client.V1ContainerPort)
-        assert container.ports[0].name == 'metrics'
-        assert container.ports[0].container_port == 9150
-        assert container.ports[0].protocol == 'TCP'
-
-        assert hasattr(container, 'resources')
-        assert isinstance(container.resources, client.V1ResourceRequirements)
-        assert container.resources.limits == {'cpu': '50m', 'memory': '16Mi'}
-        assert container.resources.requests == {'cpu': '50m', 'memory': '16Mi'}
+        container = deployment['spec']['template']['spec']['containers'][2]
+        assert 'name' in container
+        assert container['name'] == 'prometheus-exporter'
+
+        assert 'image' in container
+        assert container['image'] == 'kubestack/mcrouter_exporter:v0.0.1'
+
+        assert 'ports' in container
+        assert len(container['ports']) == 1
+        assert isinstance(container['ports'][0], dict)
+        assert container['ports'][0]['name'] == 'metrics'
+        assert container['ports'][0]['containerPort'] == 9150
+        assert container['ports'][0]['protocol'] == 'TCP'
+
+        assert 'resources' in container
+        assert isinstance(container['resources'], dict)
+        assert container['resources']['limits'] == {'cpu': '50m', 'memory': '16Mi'}
+        assert container['resources']['requests'] == {'cpu': '50m', 'memory': '16Mi'}
+
+
+class TestLeaseObject():
+    def test_lease(self):
+        renew_time = datetime(2019, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+
+        lease_object = get_lease_object(
+            'testlease', 'testnamespace456', 'replica-a', 15.0,
+            labels={'test': 'true'}, renew_time=renew_time)
+
+        assert lease_object['kind'] == 'Lease'
+        assert lease_object['metadata'] == {'name': 'testlease',
+                                            'namespace': 'testnamespace456',
+                                            'labels': {'test': 'true'}}
+        assert lease_object['spec'] == {
+            'holderIdentity': 'replica-a',
+            'leaseDurationSeconds': 15,
+            'renewTime': '2019-01-02T03:04:05.000678Z'}
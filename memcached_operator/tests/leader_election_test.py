@@ -0,0 +1,163 @@
+from datetime import datetime, timezone
+from threading import Event
+from unittest.mock import patch, MagicMock
+
+from kubernetes import client
+
+from ..memcached_operator.leader_election import (LeaderElection,
+                                                  LEADER_LEASE_NAME)
+from ..memcached_operator.sharding import Shards
+
+
+def get_lease(holder, second=0, resource_version='1', transitions=0):
+    return client.V1beta1Lease(
+        metadata=client.V1ObjectMeta(resource_version=resource_version),
+        spec=client.V1beta1LeaseSpec(
+            holder_identity=holder,
+            lease_duration_seconds=15,
+            lease_transitions=transitions,
+            renew_time=datetime(
+                2020, 1, 1, 0, 0, second, tzinfo=timezone.utc)))
+
+
+@patch('memcached_operator.memcached_operator.leader_election.monotonic', return_value=100)
+@patch('memcached_operator.memcached_operator.leader_election.renew_lease')
+@patch('memcached_operator.memcached_operator.leader_election.read_lease')
+class TestLeaderElection():
+    def setUp(self):
+        self.shards = Shards()
+        self.election = LeaderElection('a', 'kubestack', 15, self.shards)
+        self.queue = MagicMock()
+        self.rebalance = MagicMock()
+
+    def test_standby(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = get_lease('b')
+
+        assert self.election.sync(self.queue, self.rebalance) is False
+
+        mock_read_lease.assert_called_once_with(LEADER_LEASE_NAME, 'kubestack')
+        assert mock_renew_lease.called is False
+        assert self.shards.owns('ns/cluster') is False
+        assert self.rebalance.called is False
+
+    def test_acquire_missing(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = None
+
+        assert self.election.sync(self.queue, self.rebalance) is True
+
+        lease_object = mock_renew_lease.call_args[0][0]
+        assert 'resourceVersion' not in lease_object['metadata']
+        assert lease_object['spec']['holderIdentity'] == 'a'
+        assert lease_object['spec']['leaseTransitions'] == 0
+        assert self.election.is_leader is True
+        assert self.shards.owns('ns/cluster') is True
+        self.rebalance.assert_called_once_with(self.queue)
+
+    def test_acquire_expired(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = get_lease('b', transitions=3)
+        self.election.sync(self.queue, self.rebalance)
+
+        # b didn't renew for a lease duration
+        mock_monotonic.return_value = 115
+        assert self.election.sync(self.queue, self.rebalance) is True
+
+        lease_object = mock_renew_lease.call_args[0][0]
+        assert lease_object['metadata']['resourceVersion'] == '1'
+        assert lease_object['spec']['leaseTransitions'] == 4
+        assert lease_object['spec']['acquireTime'] == \
+            lease_object['spec']['renewTime']
+        self.rebalance.assert_called_once_with(self.queue)
+
+    def test_renewed_by_other(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = get_lease('b')
+        self.election.sync(self.queue, self.rebalance)
+
+        mock_monotonic.return_value = 115
+        mock_read_lease.return_value = get_lease('b', 14)
+        assert self.election.sync(self.queue, self.rebalance) is False
+
+        assert mock_renew_lease.called is False
+
+    def test_acquire_released(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = get_lease(None)
+
+        assert self.election.sync(self.queue, self.rebalance) is True
+
+    def test_acquire_conflict(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = get_lease(None)
+        mock_renew_lease.return_value = False
+
+        assert self.election.sync(self.queue, self.rebalance) is False
+
+        assert self.election.is_leader is False
+        assert self.shards.owns('ns/cluster') is False
+
+    def test_renew(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = None
+        mock_renew_lease.return_value = get_lease('a', resource_version='2')
+        self.election.sync(self.queue, self.rebalance)
+        mock_read_lease.reset_mock()
+
+        mock_monotonic.return_value = 105
+        assert self.election.sync(self.queue, self.rebalance) is True
+
+        # Leaders renew without reading the lease first
+        assert mock_read_lease.called is False
+        lease_object = mock_renew_lease.call_args[0][0]
+        assert lease_object['metadata']['resourceVersion'] == '2'
+        assert 'acquireTime' not in lease_object['spec']
+        assert self.election.renewed_at == 105
+        assert self.rebalance.call_count == 1
+
+    def test_renew_failed(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = None
+        mock_renew_lease.return_value = get_lease('a')
+        self.election.sync(self.queue, self.rebalance)
+
+        mock_monotonic.return_value = 105
+        mock_renew_lease.return_value = False
+        mock_read_lease.return_value = get_lease('a', resource_version='3')
+        assert self.election.sync(self.queue, self.rebalance) is False
+
+        # Still leading, retries with the current resourceVersion
+        assert self.election.is_leader is True
+        assert self.election.lease.metadata.resource_version == '3'
+
+    def test_renew_deadline(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = None
+        mock_renew_lease.return_value = get_lease('a')
+        self.election.sync(self.queue, self.rebalance)
+
+        mock_monotonic.return_value = 110
+        mock_renew_lease.return_value = False
+        assert self.election.sync(self.queue, self.rebalance) is False
+
+        assert self.election.is_leader is False
+        assert self.shards.owns('ns/cluster') is False
+
+    def test_taken_over(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = None
+        mock_renew_lease.return_value = get_lease('a')
+        self.election.sync(self.queue, self.rebalance)
+
+        mock_renew_lease.return_value = False
+        mock_read_lease.return_value = get_lease('b', resource_version='3')
+        self.election.sync(self.queue, self.rebalance)
+
+        assert self.election.is_leader is False
+        assert self.shards.owns('ns/cluster') is False
+
+    def test_run_releases_lease(self, mock_read_lease, mock_renew_lease, mock_monotonic):
+        mock_read_lease.return_value = None
+        mock_renew_lease.return_value = get_lease('a', resource_version='2')
+        self.election.sync(self.queue, self.rebalance)
+        shutting_down = Event()
+        shutting_down.set()
+
+        self.election.run(shutting_down, self.queue, self.rebalance)
+
+        lease_object = mock_renew_lease.call_args[0][0]
+        assert lease_object['metadata']['resourceVersion'] == '2'
+        assert lease_object['spec']['holderIdentity'] is None
+        assert self.election.is_leader is False
+        assert self.shards.owns('ns/cluster') is False
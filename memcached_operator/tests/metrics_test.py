@@ -0,0 +1,172 @@
+import json
+from unittest.mock import patch, MagicMock
+
+from kubernetes import client
+from prometheus_client import REGISTRY
+
+from ..memcached_operator.metrics import (ApiPressure,
+                                          API_PRESSURE,
+                                          StartupTimer,
+                                          get_api_verb_and_resource,
+                                          instrument_rest_client)
+from ..memcached_operator.tracing import SPAN_KIND_CLIENT, Tracer
+
+
+def get_requests(verb, resource, status):
+    return REGISTRY.get_sample_value(
+        'memcached_operator_apiserver_requests_total',
+        {'verb': verb, 'resource': resource, 'status': status}) or 0
+
+
+class TestGetApiVerbAndResource():
+    def test_namespaced(self):
+        result = get_api_verb_and_resource(
+            'PATCH',
+            'https://10.0.0.1:443/api/v1/namespaces/default/services/test',
+            [])
+
+        assert result == ('PATCH', 'services')
+
+    def test_group(self):
+        result = get_api_verb_and_resource(
+            'DELETE',
+            'https://10.0.0.1/apis/apps/v1/namespaces/default/'
+            'deployments/test',
+            None)
+
+        assert result == ('DELETE', 'deployments')
+
+    def test_list(self):
+        result = get_api_verb_and_resource(
+            'GET', 'https://10.0.0.1/apis/kubestack.com/v1/memcacheds', [])
+
+        assert result == ('LIST', 'memcacheds')
+
+    def test_get(self):
+        result = get_api_verb_and_resource(
+            'GET',
+            'https://10.0.0.1/apis/kubestack.com/v1/namespaces/default/'
+            'memcacheds/test',
+            [])
+
+        assert result == ('GET', 'memcacheds')
+
+    def test_watch(self):
+        result = get_api_verb_and_resource(
+            'GET',
+            'https://10.0.0.1/api/v1/services',
+            [('labelSelector', 'heritage=kubestack.com'), ('watch', True)])
+
+        assert result == ('WATCH', 'services')
+
+
+class TestInstrumentRestClient():
+    def setUp(self):
+        self.url = 'https://10.0.0.1/api/v1/namespaces/default/services/test'
+        self.rest_client = MagicMock()
+        self.request = self.rest_client.request
+        instrument_rest_client(self.rest_client)
+
+    def test_success(self):
+        before = get_requests('PATCH', 'services', '200')
+        self.request.return_value.status = 200
+
+        response = self.rest_client.request(
+            'PATCH', self.url, query_params=[], body={})
+
+        assert response is self.request.return_value
+        self.request.assert_called_once_with(
+            'PATCH', self.url, [], body={})
+        assert get_requests('PATCH', 'services', '200') == before + 1
+
+    def test_traced(self):
+        tracer = Tracer(sample_rate=1, buffer_size=1)
+        self.request.return_value.status = 404
+
+        with patch('memcached_operator.memcached_operator.metrics.TRACER',
+                   tracer):
+            with tracer.trace('reconcile', 'default/test', 'reconcile'):
+                self.rest_client.request('PATCH', self.url)
+
+        spans = json.loads(tracer.buffer[0])[
+            'resourceSpans'][0]['scopeSpans'][0]['spans']
+        assert spans[0]['name'] == 'PATCH services'
+        assert spans[0]['kind'] == SPAN_KIND_CLIENT
+        assert spans[0]['status'] == {'code': 2}
+        assert {'key': 'memcached.result',
+                'value': {'stringValue': '404'}} in spans[0]['attributes']
+        assert {'key': 'http.target',
+                'value': {'stringValue':
+                          '/api/v1/namespaces/default/services/test'}} in \
+            spans[0]['attributes']
+
+    def test_api_exception(self):
+        before = get_requests('PATCH', 'services', '409')
+        self.request.side_effect = client.rest.ApiException(status=409)
+
+        try:
+            self.rest_client.request('PATCH', self.url, query_params=[])
+        except client.rest.ApiException:
+            pass
+        else:
+            assert False, 'ApiException not raised'
+
+        assert get_requests('PATCH', 'services', '409') == before + 1
+
+    def test_connection_error(self):
+        before = get_requests('PATCH', 'services', 'error')
+        self.request.side_effect = OSError()
+
+        try:
+            self.rest_client.request('PATCH', self.url)
+        except OSError:
+            pass
+
+        assert get_requests('PATCH', 'services', 'error') == before + 1
+
+    def test_throttled(self):
+        API_PRESSURE.collect()
+        self.request.side_effect = client.rest.ApiException(status=429)
+
+        try:
+            self.rest_client.request('PATCH', self.url, query_params=[])
+        except client.rest.ApiException:
+            pass
+
+        requests, _, throttled = API_PRESSURE.collect()
+        assert requests == 1
+        assert throttled == 1
+
+
+class TestApiPressure():
+    def setUp(self):
+        self.pressure = ApiPressure()
+
+    def test_empty(self):
+        assert self.pressure.collect() == (0, 0, 0)
+
+    def test_collect(self):
+        self.pressure.observe('GET', 0.1, 200)
+        self.pressure.observe('PATCH', 0.3, 429)
+        # Watches stay open until they time out
+        self.pressure.observe('WATCH', 25, 200)
+
+        requests, latency, throttled = self.pressure.collect()
+
+        assert requests == 2
+        assert round(latency, 3) == 0.2
+        assert throttled == 1
+        assert self.pressure.collect() == (0, 0, 0)
+
+
+class TestStartupTimer():
+    @patch('memcached_operator.memcached_operator.metrics.logging')
+    def test_reported_once(self, mock_logging):
+        gauge = MagicMock()
+        timer = StartupTimer(gauge)
+
+        timer.reconciled()
+        timer.reconciled()
+
+        assert gauge.set.call_count == 1
+        assert gauge.set.call_args[0][0] >= 0
@@ -3,344 +3,525 @@ from copy import deepcopy
 
 from kubernetes import client
 
-from ..memcached_operator.periodical import (is_version_cached, cache_version,
-                                             check_existing, collect_garbage)
+from ..memcached_operator.periodical import (check_existing, check_cluster,
+                                             collect_garbage, get_priority,
+                                             PeriodicCheck)
 from ..memcached_operator.kubernetes_resources import (
+                                                DESIRED_STATE_HASH_ANNOTATION,
                                                 get_mcrouter_service_object,
-                                                get_memcached_service_object)
+                                                get_memcached_service_object,
+                                                get_memcached_deployment_object,
+                                                get_mcrouter_deployment_object)
+from ..memcached_operator.metrics import ApiPressure
+from ..memcached_operator.rollout import RolloutGate
+from ..memcached_operator.state import ChildVersions
+from ..memcached_operator.scope import SCOPE
+from ..memcached_operator.workqueue import (PRIORITY_URGENT,
+                                            PRIORITY_DRIFTED,
+                                            PRIORITY_RESYNC)
+from ..memcached_operator.informers import (MEMCACHED_STORE,
+                                            SERVICE_STORE,
+                                            DEPLOYMENT_STORE)
 
 
-class TestVersionCache():
+class TestCheckExisting():
     def setUp(self):
-        self.uid = 'test-uid-1234567890'
-        self.version = '123'
-        self.resource = MagicMock()
-        self.resource.metadata.uid = self.uid
-        self.resource.metadata.version = self.version
+        self.name = 'testname123'
+        self.namespace = 'testnamespace456'
+        self.cluster_object = {'metadata':{'name': self.name,
+                                           'namespace': self.namespace}}
+        self.queue = MagicMock()
 
-    def test_version_not_cached(self):
-        result = is_version_cached(self.resource)
+        MEMCACHED_STORE.replace([self.cluster_object])
+        SERVICE_STORE.replace([])
+        DEPLOYMENT_STORE.replace([])
 
+    @patch('memcached_operator.memcached_operator.periodical.logging')
+    @patch('memcached_operator.memcached_operator.periodical.caches_synced', return_value=False)
+    def test_caches_not_synced(self, mock_caches_synced, mock_logging):
+        result = check_existing(self.queue)
+
+        mock_logging.info.assert_called_once_with(
+            'waiting for informer caches to sync')
+        assert self.queue.add.called is False
         assert result is False
 
-    def test_version_cached(self):
-        cache_version(self.resource)
-        result = is_version_cached(self.resource)
+    def test_no_memcached_tprs(self):
+        MEMCACHED_STORE.replace([])
 
-        assert result is True
+        check_existing(self.queue)
 
+        assert self.queue.add.called is False
 
-class TestCheckExisting():
+    def test_queues_clusters(self):
+        check_existing(self.queue)
+
+        # Without children the cluster is repaired first
+        self.queue.add.assert_called_once_with(
+            '{}/{}'.format(self.namespace, self.name), PRIORITY_URGENT)
+
+    @patch('memcached_operator.memcached_operator.periodical.SHARDS')
+    def test_skips_other_shards(self, mock_shards):
+        mock_shards.owns.return_value = False
+
+        check_existing(self.queue)
+
+        mock_shards.owns.assert_called_once_with(
+            '{}/{}'.format(self.namespace, self.name))
+        assert self.queue.add.called is False
+
+
+    def test_schedule(self):
+        schedule = MagicMock()
+        schedule.get_due.return_value = []
+
+        check_existing(self.queue, schedule)
+
+        args, _ = schedule.get_due.call_args
+        assert args[0] == [self.cluster_object]
+        assert self.queue.add.called is False
+
+
+class TestPeriodicCheck():
+    def setUp(self):
+        self.queue = MagicMock()
+        self.periodic_check = PeriodicCheck(25, gc_budget=10)
+        self.periodic_check.interval.pressure = ApiPressure()
+
+    @patch('memcached_operator.memcached_operator.periodical.monotonic')
+    @patch('memcached_operator.memcached_operator.periodical.collect_garbage', return_value='ns/cursor')
+    @patch('memcached_operator.memcached_operator.periodical.check_existing')
+    def test_tick(self, mock_check_existing, mock_collect_garbage, mock_monotonic):
+        for now in (100, 101, 125):
+            mock_monotonic.return_value = now
+            self.periodic_check.tick(self.queue)
+
+        assert mock_check_existing.call_count == 3
+        mock_check_existing.assert_called_with(
+            self.queue, self.periodic_check.schedule)
+        # Garbage is collected once per interval
+        assert mock_collect_garbage.call_count == 2
+        mock_collect_garbage.assert_called_with(self.queue, 'ns/cursor', 10)
+
+    @patch('memcached_operator.memcached_operator.periodical.SHARDS')
+    @patch('memcached_operator.memcached_operator.periodical.check_existing')
+    def test_sized_by_owned_clusters(self, mock_check_existing, mock_shards):
+        MEMCACHED_STORE.replace([
+            {'metadata': {'name': 'cluster{}'.format(i),
+                          'namespace': 'testnamespace456'}}
+            for i in range(5000)])
+        mock_shards.owns.side_effect = lambda key: key.endswith('0')
+        self.periodic_check.interval.resync_rate = 10
+        self.periodic_check.interval.max_seconds = 600
+
+        self.periodic_check.tick(self.queue)
+
+        # 500 owned clusters at 10 per second
+        assert self.periodic_check.interval.seconds == 50
+
+    @patch('memcached_operator.memcached_operator.periodical.save_state')
+    @patch('memcached_operator.memcached_operator.periodical.monotonic')
+    @patch('memcached_operator.memcached_operator.periodical.collect_garbage')
+    @patch('memcached_operator.memcached_operator.periodical.check_existing')
+    def test_save_state(self, mock_check_existing, mock_collect_garbage, mock_monotonic, mock_save_state):
+        self.periodic_check.state_file = '/state/state.json'
+        for now in (100, 101, 125):
+            mock_monotonic.return_value = now
+            self.periodic_check.tick(self.queue)
+
+        # Saved once per interval
+        assert mock_save_state.call_count == 2
+        mock_save_state.assert_called_with('/state/state.json')
+
+
+class TestGetPriority():
+    def setUp(self):
+        self.cluster_object = {'metadata': {'name': 'testname123',
+                                            'namespace': 'testnamespace456',
+                                            'uid': 'test-uid-1234567890'}}
+        SERVICE_STORE.replace([
+            get_mcrouter_service_object(self.cluster_object),
+            get_memcached_service_object(self.cluster_object)])
+        DEPLOYMENT_STORE.replace([
+            get_memcached_deployment_object(self.cluster_object),
+            get_mcrouter_deployment_object(self.cluster_object)])
+
+    def test_healthy(self):
+        assert get_priority(self.cluster_object) == PRIORITY_RESYNC
+
+    def test_missing_child(self):
+        DEPLOYMENT_STORE.replace(
+            [get_memcached_deployment_object(self.cluster_object)])
+
+        assert get_priority(self.cluster_object) == PRIORITY_URGENT
+
+    def test_drifted_child(self):
+        deployment = deepcopy(
+            get_mcrouter_deployment_object(self.cluster_object))
+        deployment['metadata']['annotations'][
+            DESIRED_STATE_HASH_ANNOTATION] = 'outdated'
+        DEPLOYMENT_STORE.upsert(deployment)
+
+        assert get_priority(self.cluster_object) == PRIORITY_DRIFTED
+
+    def test_unobserved_spec_change(self):
+        self.cluster_object['metadata']['generation'] = 2
+        self.cluster_object['status'] = {'observedGeneration': 1}
+
+        assert get_priority(self.cluster_object) == PRIORITY_URGENT
+
+
+class TestCheckCluster():
     def setUp(self):
         self.name = 'testname123'
         self.namespace = 'testnamespace456'
         self.cluster_object = {'metadata':{'name': self.name,
                                            'namespace': self.namespace}}
-        self.base_list_result = {'items': [self.cluster_object]}
 
-    @patch('memcached_operator.memcached_operator.periodical.logging')
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object', side_effect=client.rest.ApiException())
-    def test_list_memcached_exception(self, mock_list_cluster_memcached_object, mock_logging):
-        result = check_existing()
-
-        assert mock_logging.exception.called is True
-        assert result is False
+        self.mcrouter_service = get_mcrouter_service_object(self.cluster_object)
+        self.memcached_service = get_memcached_service_object(self.cluster_object)
+        self.memcached_deploy = get_memcached_deployment_object(self.cluster_object)
+        self.mcrouter_deploy = get_mcrouter_deployment_object(self.cluster_object)
+
+        MEMCACHED_STORE.replace([self.cluster_object])
+        SERVICE_STORE.replace([])
+        DEPLOYMENT_STORE.replace([])
+
+        self.rollouts = RolloutGate(2)
+        self.rollouts_patcher = patch(
+            'memcached_operator.memcached_operator.periodical.ROLLOUTS',
+            self.rollouts)
+        self.rollouts_patcher.start()
+
+        self.versions = ChildVersions()
+        self.versions_patcher = patch(
+            'memcached_operator.memcached_operator.periodical.CHILD_VERSIONS',
+            self.versions)
+        self.versions_patcher.start()
+
+    def tearDown(self):
+        self.rollouts_patcher.stop()
+        self.versions_patcher.stop()
+
+    def outdate(self, *resources):
+        # Pretend resources were rendered from an older spec
+        outdated = []
+        for resource in resources:
+            resource = deepcopy(resource)
+            resource['metadata']['annotations'] = {
+                DESIRED_STATE_HASH_ANNOTATION: 'outdated'}
+            outdated.append(resource)
+        return outdated
 
     @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
-    @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment')
-    @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment', return_value=client.V1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment', return_value=client.V1Deployment())
     @patch('memcached_operator.memcached_operator.periodical.update_service')
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached')
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
-    @patch('memcached_operator.memcached_operator.periodical.create_service')
+    @patch('memcached_operator.memcached_operator.periodical.create_service', return_value=client.V1Service())
+    @patch('kubernetes.client.AppsV1Api.read_namespaced_deployment')
     @patch('kubernetes.client.CoreV1Api.read_namespaced_service')
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_no_memcached_tprs(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        # Mock list memcached call with 0 items
-        no_item_result = deepcopy(self.base_list_result)
-        no_item_result['items'] = []
-        mock_list_cluster_memcached_object.return_value = no_item_result
+    def test_service_and_deploy_missing(self, mock_read_namespaced_service, mock_read_namespaced_deployment, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        result = check_cluster(self.cluster_object)
 
-        check_existing()
-
-        mock_list_cluster_memcached_object.assert_called_once_with()
+        # Everything is read from the informer caches
         assert mock_read_namespaced_service.called is False
-        assert mock_create_service.called is False
-        assert mock_cache_version.called is False
-        assert mock_is_version_cached.called is False
-        assert mock_update_service.called is False
         assert mock_read_namespaced_deployment.called is False
-        assert mock_create_memcached_deployment.called is False
-        assert mock_create_mcrouter_deployment.called is False
-        assert mock_update_memcached_deployment.called is False
-        assert mock_update_memcached_deployment.called is False
-
-    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
-    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
-    @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment', return_value=client.AppsV1beta1Deployment())
-    @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment', return_value=client.AppsV1beta1Deployment())
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment', side_effect=client.rest.ApiException(status=404))
-    @patch('memcached_operator.memcached_operator.periodical.update_service')
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached', return_value=True)
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
-    @patch('memcached_operator.memcached_operator.periodical.create_service', return_value=client.V1Service())
-    @patch('kubernetes.client.CoreV1Api.read_namespaced_service', side_effect=client.rest.ApiException(status=404))
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_service_and_deploy_404(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        # Mock list memcached call with 0 items
-        mock_list_cluster_memcached_object.return_value = self.base_list_result
-
-        check_existing()
-
-        mock_list_cluster_memcached_object.assert_called_once_with()
-
-        service_calls = [
-            call(self.name, self.namespace),
-            call('{}-backend'.format(self.name), self.namespace)]
-        mock_read_namespaced_service.assert_has_calls(service_calls)
 
         create_service_calls = [
-            call(get_mcrouter_service_object(self.cluster_object)),
-            call(get_memcached_service_object(self.cluster_object))]
-        mock_create_service.assert_has_calls(create_service_calls)
+            call(self.mcrouter_service),
+            call(self.memcached_service)]
+        mock_create_service.assert_has_calls(create_service_calls, any_order=True)
 
-        cache_version_calls = [
-            call(client.V1Service()),
-            call(client.AppsV1beta1Deployment())]
-        mock_cache_version.assert_has_calls(cache_version_calls)
-
-        assert mock_is_version_cached.called is False
         assert mock_update_service.called is False
-        read_namespaced_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_read_namespaced_deployment.assert_has_calls(read_namespaced_deployment_calls)
         mock_create_memcached_deployment.assert_called_once_with(self.cluster_object)
         mock_create_mcrouter_deployment.assert_called_once_with(self.cluster_object)
         assert mock_update_memcached_deployment.called is False
         assert mock_update_mcrouter_deployment.called is False
+        assert result is True
 
     @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment', return_value=False)
     @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment', return_value=False)
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment', side_effect=client.rest.ApiException(status=404))
     @patch('memcached_operator.memcached_operator.periodical.update_service')
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached', return_value=True)
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
     @patch('memcached_operator.memcached_operator.periodical.create_service', return_value=False)
-    @patch('kubernetes.client.CoreV1Api.read_namespaced_service', side_effect=client.rest.ApiException(status=404))
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_service_and_deploy_404_yet_create_false(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        # Mock list memcached call with 0 items
-        mock_list_cluster_memcached_object.return_value = self.base_list_result
-
-        check_existing()
-
-        mock_list_cluster_memcached_object.assert_called_once_with()
-
-        read_service_calls = [
-            call(self.name, self.namespace),
-            call('{}-backend'.format(self.name), self.namespace)]
-        mock_read_namespaced_service.assert_has_calls(read_service_calls)
+    def test_service_and_deploy_missing_yet_create_false(self, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        result = check_cluster(self.cluster_object)
 
         create_service_calls = [
-            call(get_mcrouter_service_object(self.cluster_object)),
-            call(get_memcached_service_object(self.cluster_object))]
-        mock_create_service.assert_has_calls(create_service_calls)
+            call(self.mcrouter_service),
+            call(self.memcached_service)]
+        mock_create_service.assert_has_calls(create_service_calls, any_order=True)
 
-        assert mock_cache_version.called is False
-
-        assert mock_is_version_cached.called is False
         assert mock_update_service.called is False
-        read_namespaced_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_read_namespaced_deployment.assert_has_calls(read_namespaced_deployment_calls)
         mock_create_memcached_deployment.assert_called_once_with(self.cluster_object)
-        mock_create_mcrouter_deployment.assert_called_once_with(self.cluster_object)
+        # mcrouter can't resolve memcached without the backend service
+        assert mock_create_mcrouter_deployment.called is False
         assert mock_update_memcached_deployment.called is False
         assert mock_update_mcrouter_deployment.called is False
+        assert result is False
 
-    @patch('memcached_operator.memcached_operator.periodical.logging')
     @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment', side_effect=client.rest.ApiException(status=500))
     @patch('memcached_operator.memcached_operator.periodical.update_service')
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached')
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
     @patch('memcached_operator.memcached_operator.periodical.create_service')
-    @patch('kubernetes.client.CoreV1Api.read_namespaced_service', side_effect=client.rest.ApiException(status=500))
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_service_and_deploy_500(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment, mock_logging):
-        # Mock list memcached call
-        mock_list_cluster_memcached_object.return_value = self.base_list_result
+    def test_service_and_deploy_up_to_date(self, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace([self.memcached_deploy, self.mcrouter_deploy])
 
-        check_existing()
+        result = check_cluster(self.cluster_object)
 
-        mock_list_cluster_memcached_object.assert_called_once_with()
-        read_namespaced_service_calls = [
-            call(self.name, self.namespace),
-            call('{}-backend'.format(self.name), self.namespace)]
-        mock_read_namespaced_service.assert_has_calls(read_namespaced_service_calls)
         assert mock_create_service.called is False
-        assert mock_cache_version.called is False
-        assert mock_is_version_cached.called is False
         assert mock_update_service.called is False
-        read_namespaced_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_read_namespaced_deployment.assert_has_calls(read_namespaced_deployment_calls)
         assert mock_create_memcached_deployment.called is False
         assert mock_create_mcrouter_deployment.called is False
         assert mock_update_memcached_deployment.called is False
         assert mock_update_mcrouter_deployment.called is False
-        mock_logging.exception.call_count == 2
+        assert result is True
 
-    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
-    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment', return_value=client.V1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment', return_value=client.V1Deployment())
     @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
-    @patch('memcached_operator.memcached_operator.periodical.update_service')
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached', return_value=True)
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
+    @patch('memcached_operator.memcached_operator.periodical.update_service', return_value=client.V1Service())
     @patch('memcached_operator.memcached_operator.periodical.create_service')
-    @patch('kubernetes.client.CoreV1Api.read_namespaced_service', return_value=client.V1Service())
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_service_and_deploy_cached(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        # Mock list memcached call with 0 items
-        mock_list_cluster_memcached_object.return_value = self.base_list_result
+    def test_service_and_deploy_outdated(self, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        SERVICE_STORE.replace(
+            self.outdate(self.mcrouter_service, self.memcached_service))
+        DEPLOYMENT_STORE.replace(
+            self.outdate(self.memcached_deploy, self.mcrouter_deploy))
 
-        check_existing()
+        result = check_cluster(self.cluster_object)
 
-        mock_list_cluster_memcached_object.assert_called_once_with()
-        read_namespaced_service_calls = [
-            call(self.name, self.namespace),
-            call('{}-backend'.format(self.name), self.namespace)]
-        mock_read_namespaced_service.assert_has_calls(read_namespaced_service_calls)
         assert mock_create_service.called is False
-        assert mock_cache_version.called is False
-
-        is_version_cached_calls = [
-            call(client.V1Service()),
-            call(client.AppsV1beta1Deployment())]
-        mock_is_version_cached.assert_has_calls(is_version_cached_calls)
 
-        assert mock_update_service.called is False
-        read_namespaced_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_read_namespaced_deployment.assert_has_calls(read_namespaced_deployment_calls)
+        update_service_calls = [
+            call(self.mcrouter_service),
+            call(self.memcached_service)]
+        mock_update_service.assert_has_calls(update_service_calls, any_order=True)
         assert mock_create_memcached_deployment.called is False
         assert mock_create_mcrouter_deployment.called is False
-        assert mock_update_memcached_deployment.called is False
-        assert mock_update_mcrouter_deployment.called is False
+        mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
+        mock_update_mcrouter_deployment.assert_called_once_with(self.cluster_object)
+        assert result is True
 
-    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment', return_value=client.AppsV1beta1Deployment())
-    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment', return_value=client.AppsV1beta1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
     @patch('memcached_operator.memcached_operator.periodical.update_service', return_value=client.V1Service())
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached', return_value=False)
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
     @patch('memcached_operator.memcached_operator.periodical.create_service')
-    @patch('kubernetes.client.CoreV1Api.read_namespaced_service', return_value=client.V1Service())
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_service_and_deploy_not_cached(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        # Mock list memcached call with 0 items
-        mock_list_cluster_memcached_object.return_value = self.base_list_result
+    def test_spec_changed(self, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace([self.memcached_deploy, self.mcrouter_deploy])
+        self.cluster_object['spec'] = {'memcached': {'replicas': 4}}
 
-        check_existing()
+        result = check_cluster(self.cluster_object)
 
-        mock_list_cluster_memcached_object.assert_called_once_with()
+        # Only the memcached deployment renders differently
+        assert mock_update_service.called is False
+        mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
+        assert mock_update_mcrouter_deployment.called is False
+        assert result is True
 
-        read_namespaced_service_calls = [
-            call(self.name, self.namespace),
-            call('{}-backend'.format(self.name), self.namespace)]
-        mock_read_namespaced_service.assert_has_calls(read_namespaced_service_calls)
-        assert mock_create_service.called is False
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.update_service')
+    def test_edited_by_others(self, mock_update_service, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        memcached_deploy = deepcopy(self.memcached_deploy)
+        memcached_deploy['metadata']['generation'] = 2
+        mock_update_memcached_deployment.return_value = memcached_deploy
+        scaled_deploy = deepcopy(self.memcached_deploy)
+        scaled_deploy['metadata']['generation'] = 1
+        scaled_deploy['spec']['replicas'] = 10
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace([scaled_deploy, self.mcrouter_deploy])
+        self.versions.record('deployments', scaled_deploy)
+        # Scaled by hand, the desired state hash annotation is unchanged
+        scaled_deploy['metadata']['generation'] = 3
+
+        result = check_cluster(self.cluster_object)
+
+        assert mock_update_service.called is False
+        mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
+        assert mock_update_mcrouter_deployment.called is False
+        # Repairs aren't staged and our own write is remembered
+        assert len(self.rollouts) == 0
+        assert self.versions.is_modified('deployments', memcached_deploy) is False
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
+    def test_own_write_event_ignored(self, mock_update_memcached_deployment, mock_update_mcrouter_deployment):
+        memcached_deploy, mcrouter_deploy = self.outdate(
+            self.memcached_deploy, self.mcrouter_deploy)
+        memcached_deploy['metadata']['generation'] = 1
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace([memcached_deploy, mcrouter_deploy])
+        self.versions.record('deployments', memcached_deploy)
+        updated_deploy = deepcopy(self.memcached_deploy)
+        updated_deploy['metadata']['generation'] = 2
+        modified_during_write = []
+
+        def update(cluster_object):
+            # The watch event of the patch arrives before it returns
+            modified_during_write.append(
+                self.versions.is_modified('deployments', updated_deploy))
+            return updated_deploy
+        mock_update_memcached_deployment.side_effect = update
+        mock_update_mcrouter_deployment.return_value = False
+
+        check_cluster(self.cluster_object)
+
+        assert modified_during_write == [False]
+        assert self.versions.is_modified('deployments', updated_deploy) is False
+
+    def test_up_to_date_adopted(self):
+        memcached_deploy = deepcopy(self.memcached_deploy)
+        memcached_deploy['metadata']['generation'] = 1
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace([memcached_deploy, self.mcrouter_deploy])
+
+        check_cluster(self.cluster_object)
+
+        edited = deepcopy(memcached_deploy)
+        edited['metadata']['generation'] = 2
+        assert self.versions.is_modified('deployments', edited) is True
 
-        cache_version_calls = [
-            call(client.V1Service()),
-            call(client.AppsV1beta1Deployment())]
-        mock_cache_version.assert_has_calls(cache_version_calls)
+    @patch('memcached_operator.memcached_operator.periodical.logging')
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment', return_value=client.V1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment', return_value=client.V1Deployment())
+    def test_template_rollout_deferred(self, mock_update_mcrouter_deployment, mock_update_memcached_deployment, mock_logging):
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace(
+            self.outdate(self.memcached_deploy, self.mcrouter_deploy))
+        # Another cluster's deployment occupies one of both slots
+        self.rollouts.try_start('other', self.namespace)
 
-        is_version_cached_calls = [
-            call(client.V1Service()),
-            call(client.AppsV1beta1Deployment())]
-        mock_is_version_cached.assert_has_calls(is_version_cached_calls)
+        result = check_cluster(self.cluster_object)
+
+        mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
+        assert mock_update_mcrouter_deployment.called is False
+        assert mock_logging.info.called is True
+        assert len(self.rollouts) == 2
+        assert result is False
+
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment', return_value=client.V1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment', return_value=client.V1Deployment())
+    def test_metadata_change_not_staged(self, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        deployments = [deepcopy(self.memcached_deploy),
+                       deepcopy(self.mcrouter_deploy)]
+        for deployment in deployments:
+            # Same pod template, other metadata
+            deployment['metadata']['annotations'] = dict(
+                deployment['metadata']['annotations'])
+            deployment['metadata']['annotations'][
+                DESIRED_STATE_HASH_ANNOTATION] = 'outdated'
+        DEPLOYMENT_STORE.replace(deployments)
+        self.rollouts.configure(0)
+
+        result = check_cluster(self.cluster_object)
 
-        update_service_calls = [
-            call(get_mcrouter_service_object(self.cluster_object)),
-            call(get_memcached_service_object(self.cluster_object))]
-        mock_update_service.assert_has_calls(update_service_calls)
-        read_namespaced_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_read_namespaced_deployment.assert_has_calls(read_namespaced_deployment_calls)
-        assert mock_create_memcached_deployment.called is False
-        assert mock_create_mcrouter_deployment.called is False
         mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
         mock_update_mcrouter_deployment.assert_called_once_with(self.cluster_object)
+        assert len(self.rollouts) == 0
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment', return_value=client.V1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment', return_value=client.V1Deployment())
+    def test_spec_change_not_staged(self, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        SERVICE_STORE.replace([self.mcrouter_service, self.memcached_service])
+        DEPLOYMENT_STORE.replace(
+            self.outdate(self.memcached_deploy, self.mcrouter_deploy))
+        self.rollouts.configure(0)
+        self.cluster_object['metadata']['generation'] = 2
+
+        result = check_cluster(self.cluster_object)
+
+        mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
+        mock_update_mcrouter_deployment.assert_called_once_with(self.cluster_object)
+        assert len(self.rollouts) == 0
+        assert result is True
 
     @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment', return_value=False)
     @patch('memcached_operator.memcached_operator.periodical.update_mcrouter_deployment', return_value=False)
     @patch('memcached_operator.memcached_operator.periodical.create_memcached_deployment')
     @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.read_namespaced_deployment', return_value=client.AppsV1beta1Deployment())
     @patch('memcached_operator.memcached_operator.periodical.update_service', return_value=False)
-    @patch('memcached_operator.memcached_operator.periodical.is_version_cached', return_value=False)
-    @patch('memcached_operator.memcached_operator.periodical.cache_version')
     @patch('memcached_operator.memcached_operator.periodical.create_service')
-    @patch('kubernetes.client.CoreV1Api.read_namespaced_service', return_value=client.V1Service())
-    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
-    def test_service_and_deploy_not_cached_yet_update_exception(self, mock_list_cluster_memcached_object, mock_read_namespaced_service, mock_create_service, mock_cache_version, mock_is_version_cached, mock_update_service, mock_read_namespaced_deployment, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
-        # Mock list memcached call with 0 items
-        mock_list_cluster_memcached_object.return_value = self.base_list_result
-
-        check_existing()
+    def test_service_and_deploy_outdated_yet_update_exception(self, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_create_memcached_deployment, mock_update_mcrouter_deployment, mock_update_memcached_deployment):
+        SERVICE_STORE.replace(
+            self.outdate(self.mcrouter_service, self.memcached_service))
+        DEPLOYMENT_STORE.replace(
+            self.outdate(self.memcached_deploy, self.mcrouter_deploy))
 
-        mock_list_cluster_memcached_object.assert_called_once_with()
+        result = check_cluster(self.cluster_object)
 
-        read_namespaced_service_calls = [
-            call(self.name, self.namespace),
-            call('{}-backend'.format(self.name), self.namespace)]
-        mock_read_namespaced_service.assert_has_calls(read_namespaced_service_calls)
         assert mock_create_service.called is False
 
-        assert mock_cache_version.called is False
-
-        is_version_cached_calls = [
-            call(client.V1Service()),
-            call(client.AppsV1beta1Deployment())]
-        mock_is_version_cached.assert_has_calls(is_version_cached_calls)
-
         update_service_calls = [
-            call(get_mcrouter_service_object(self.cluster_object)),
-            call(get_memcached_service_object(self.cluster_object))]
-        mock_update_service.assert_has_calls(update_service_calls)
-        read_namespaced_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_read_namespaced_deployment.assert_has_calls(read_namespaced_deployment_calls)
+            call(self.mcrouter_service),
+            call(self.memcached_service)]
+        mock_update_service.assert_has_calls(update_service_calls, any_order=True)
         assert mock_create_memcached_deployment.called is False
         assert mock_create_mcrouter_deployment.called is False
         mock_update_memcached_deployment.assert_called_once_with(self.cluster_object)
-        mock_update_mcrouter_deployment.assert_called_once_with(self.cluster_object)
+        assert mock_update_mcrouter_deployment.called is False
+        # Failed updates don't hold a rollout slot
+        assert len(self.rollouts) == 0
+        assert result is False
+
+    @patch('memcached_operator.memcached_operator.periodical.update_memcached_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.create_mcrouter_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.update_service')
+    @patch('memcached_operator.memcached_operator.periodical.create_service')
+    @patch('memcached_operator.memcached_operator.periodical.apply_deployment', return_value=client.V1Deployment())
+    @patch('memcached_operator.memcached_operator.periodical.apply_service', return_value=client.V1Service())
+    def test_server_side_apply(self, mock_apply_service, mock_apply_deployment, mock_create_service, mock_update_service, mock_create_mcrouter_deployment, mock_update_memcached_deployment):
+        # One missing and one outdated service and deployment
+        SERVICE_STORE.replace(self.outdate(self.mcrouter_service))
+        DEPLOYMENT_STORE.replace(self.outdate(self.memcached_deploy))
+
+        result = check_cluster(self.cluster_object, server_side_apply=True)
+
+        apply_service_calls = [
+            call(self.mcrouter_service),
+            call(self.memcached_service)]
+        mock_apply_service.assert_has_calls(apply_service_calls, any_order=True)
+        apply_deployment_calls = [
+            call(self.memcached_deploy),
+            call(self.mcrouter_deploy)]
+        mock_apply_deployment.assert_has_calls(apply_deployment_calls, any_order=True)
+        assert mock_create_service.called is False
+        assert mock_update_service.called is False
+        assert mock_create_mcrouter_deployment.called is False
+        assert mock_update_memcached_deployment.called is False
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.periodical.apply_deployment')
+    @patch('memcached_operator.memcached_operator.periodical.apply_service', return_value=False)
+    def test_server_side_apply_failure(self, mock_apply_service, mock_apply_deployment):
+        SERVICE_STORE.replace([self.memcached_service])
+        DEPLOYMENT_STORE.replace([self.memcached_deploy, self.mcrouter_deploy])
+
+        result = check_cluster(self.cluster_object, server_side_apply=True)
+
+        mock_apply_service.assert_called_once_with(self.mcrouter_service)
+        assert mock_apply_deployment.called is False
+        assert result is False
 
 
 class TestCollectGargabe():
     def setUp(self):
         self.name = 'testname123'
         self.namespace = 'testnamespace456'
+        self.cluster_object = {'metadata':{'name': self.name,
+                                           'namespace': self.namespace}}
 
-        svc_list = client.V1ServiceList(items=[])
         svc = client.V1Service()
         svc.metadata = client.V1ObjectMeta(
             name=self.name, namespace=self.namespace)
@@ -348,150 +529,153 @@ class TestCollectGargabe():
             'operated-by': 'memcached.operator.kubestack.com',
             'heritage': 'kubestack.com',
             'cluster': self.name}
-        svc_list.items = [svc]
-        self.correct_svc_list = svc_list
 
-        cm_list = client.V1ConfigMapList(items=[])
-        cm = client.V1ConfigMap()
-        cm.metadata = client.V1ObjectMeta(
-            name=self.name, namespace=self.namespace)
-        cm.metadata.labels = {
-            'operated-by': 'memcached.operator.kubestack.com',
-            'heritage': 'kubestack.com',
-            'cluster': self.name}
-        cm_list.items = [cm]
-        self.correct_cm_list = cm_list
-
-        deploy_list = client.AppsV1beta1DeploymentList(items=[])
-        memcached_deploy = client.AppsV1beta1Deployment()
+        memcached_deploy = client.V1Deployment()
         memcached_deploy.metadata = client.V1ObjectMeta(
             name=self.name, namespace=self.namespace)
         memcached_deploy.metadata.labels = {
             'operated-by': 'memcached.operator.kubestack.com',
             'heritage': 'kubestack.com',
             'cluster': self.name}
-        mcrouter_deploy = client.AppsV1beta1Deployment()
+        mcrouter_deploy = client.V1Deployment()
         mcrouter_deploy.metadata = client.V1ObjectMeta(
             name='{}-router'.format(self.name), namespace=self.namespace)
         mcrouter_deploy.metadata.labels = {
             'operated-by': 'memcached.operator.kubestack.com',
             'heritage': 'kubestack.com',
             'cluster': self.name}
-        deploy_list.items = [memcached_deploy, mcrouter_deploy]
-        self.correct_deploy_list = deploy_list
-
-    @patch('memcached_operator.memcached_operator.periodical.delete_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.list_deployment_for_all_namespaces')
-    @patch('memcached_operator.memcached_operator.periodical.get_namespaced_memcached_object')
-    @patch('memcached_operator.memcached_operator.periodical.delete_service')
-    @patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces')
-    def test_services_and_deployments_exceptions(self, mock_list_service_for_all_namespaces, mock_delete_service, mock_get_namespaced_memcached_object, mock_list_deployment_for_all_namespaces, mock_delete_deployment):
-        # Mock service list exception
-        mock_list_service_for_all_namespaces.side_effect = client.rest.ApiException()
-
-        # Mock deployment list exception
-        mock_list_deployment_for_all_namespaces.side_effect = client.rest.ApiException()
-
-        collect_garbage()
-        assert mock_get_namespaced_memcached_object.called is False
-        assert mock_delete_service.called is False
-        assert mock_delete_deployment.called is False
-
-    @patch('memcached_operator.memcached_operator.periodical.delete_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.list_deployment_for_all_namespaces')
-    @patch('memcached_operator.memcached_operator.periodical.get_namespaced_memcached_object')
-    @patch('memcached_operator.memcached_operator.periodical.delete_service')
-    @patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces')
-    def test_no_services_and_deployments(self, mock_list_service_for_all_namespaces, mock_delete_service, mock_get_namespaced_memcached_object, mock_list_deployment_for_all_namespaces, mock_delete_deployment):
-        # Mock emtpy service list
-        empty_svc_list = deepcopy(self.correct_svc_list)
-        empty_svc_list.items = []
-        mock_list_service_for_all_namespaces.return_value = empty_svc_list
-
-        # Mock emtpy deployment list
-        empty_deploy_list = deepcopy(self.correct_deploy_list)
-        empty_deploy_list.items = []
-        mock_list_deployment_for_all_namespaces.return_value = empty_deploy_list
-
-        collect_garbage()
-        assert mock_get_namespaced_memcached_object.called is False
-        assert mock_delete_service.called is False
-        assert mock_delete_deployment.called is False
-
-    @patch('memcached_operator.memcached_operator.periodical.delete_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.list_deployment_for_all_namespaces')
-    @patch('memcached_operator.memcached_operator.periodical.get_namespaced_memcached_object')
-    @patch('memcached_operator.memcached_operator.periodical.delete_service')
-    @patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces')
-    def test_expected_services_and_deployments(self, mock_list_service_for_all_namespaces, mock_delete_service, mock_get_namespaced_memcached_object, mock_list_deployment_for_all_namespaces, mock_delete_deployment):
-        # Mock service list
-        mock_list_service_for_all_namespaces.return_value = self.correct_svc_list
-
-        # Mock deployment list
-        mock_list_deployment_for_all_namespaces.return_value = self.correct_deploy_list
-
-        collect_garbage()
-        read_namespaced_memcached_calls = [
-            call(self.name, self.namespace),
-            call(self.name, self.namespace),
-            call(self.name, self.namespace)]
-        mock_get_namespaced_memcached_object.assert_has_calls(
-            read_namespaced_memcached_calls)
-        assert mock_delete_service.called is False
-        assert mock_delete_deployment.called is False
-
-    @patch('memcached_operator.memcached_operator.periodical.delete_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.list_deployment_for_all_namespaces')
-    @patch('memcached_operator.memcached_operator.periodical.get_namespaced_memcached_object')
-    @patch('memcached_operator.memcached_operator.periodical.delete_service')
-    @patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces')
-    def test_unexpected_services_and_deployments(self, mock_list_service_for_all_namespaces, mock_delete_service, mock_get_namespaced_memcached_object, mock_list_deployment_for_all_namespaces, mock_delete_deployment):
-        # Mock service list
-        mock_list_service_for_all_namespaces.return_value = self.correct_svc_list
-
-        # Mock deployment list
-        mock_list_deployment_for_all_namespaces.return_value = self.correct_deploy_list
-
-        # Mock read namespaced memcached side effect
-        mock_get_namespaced_memcached_object.side_effect = client.rest.ApiException(status=404)
-
-        collect_garbage()
-        read_namespaced_memcached_calls = [
-            call(self.name, self.namespace),
-            call(self.name, self.namespace),
-            call(self.name, self.namespace)]
-        mock_get_namespaced_memcached_object.assert_has_calls(
-            read_namespaced_memcached_calls)
-        mock_delete_service.assert_called_once_with(self.name, self.namespace)
-        delete_deployment_calls = [
-            call(self.name, self.namespace),
-            call('{}-router'.format(self.name), self.namespace)]
-        mock_delete_deployment.assert_has_calls(delete_deployment_calls)
+
+        self.queue = MagicMock()
+
+        MEMCACHED_STORE.replace([])
+        SERVICE_STORE.replace([svc])
+        DEPLOYMENT_STORE.replace([memcached_deploy, mcrouter_deploy])
+
+    def cluster_list(self, *names, **kwargs):
+        return {'metadata': {'continue': kwargs.get('_continue')},
+                'items': [{'metadata': {'name': name,
+                                        'namespace': self.namespace}}
+                          for name in names]}
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    @patch('memcached_operator.memcached_operator.periodical.caches_synced', return_value=False)
+    def test_caches_not_synced(self, mock_caches_synced, mock_list_cluster_memcached_object):
+        cursor = collect_garbage(self.queue, 'testnamespace456/a')
+
+        assert cursor == 'testnamespace456/a'
+        assert mock_list_cluster_memcached_object.called is False
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_no_services_and_deployments(self, mock_list_cluster_memcached_object):
+        SERVICE_STORE.replace([])
+        DEPLOYMENT_STORE.replace([])
+
+        cursor = collect_garbage(self.queue)
+        assert cursor is None
+        assert mock_list_cluster_memcached_object.called is False
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_expected_services_and_deployments(self, mock_list_cluster_memcached_object):
+        MEMCACHED_STORE.replace([self.cluster_object])
+
+        collect_garbage(self.queue)
+        # Clusters found in the cache are not listed from the apiserver
+        assert mock_list_cluster_memcached_object.called is False
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_uncached_cluster_exists(self, mock_list_cluster_memcached_object):
+        mock_list_cluster_memcached_object.return_value = self.cluster_list(
+            self.name)
+
+        collect_garbage(self.queue)
+        # All children are confirmed with a single list
+        mock_list_cluster_memcached_object.assert_called_once_with(
+            limit=500)
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_uncached_cluster_exists_on_later_page(self, mock_list_cluster_memcached_object):
+        mock_list_cluster_memcached_object.side_effect = [
+            self.cluster_list('other', _continue='page-2'),
+            self.cluster_list(self.name)]
+
+        collect_garbage(self.queue)
+        list_calls = [
+            call(limit=500),
+            call(limit=500, _continue='page-2')]
+        mock_list_cluster_memcached_object.assert_has_calls(list_calls)
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_unexpected_services_and_deployments(self, mock_list_cluster_memcached_object):
+        mock_list_cluster_memcached_object.return_value = self.cluster_list()
+
+        collect_garbage(self.queue)
+        # The cluster is only confirmed and queued once
+        mock_list_cluster_memcached_object.assert_called_once_with(
+            limit=500)
+        self.queue.add.assert_called_once_with(
+            '{}/{}'.format(self.namespace, self.name), PRIORITY_DRIFTED)
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_scoped_to_namespaces(self, mock_list_cluster_memcached_object):
+        mock_list_cluster_memcached_object.return_value = self.cluster_list()
+        SCOPE.configure([self.namespace, 'other'], 'tenant=a')
+        try:
+            collect_garbage(self.queue)
+        finally:
+            SCOPE.configure()
+
+        # Clusters outside the label selector count as alive
+        list_calls = [
+            call(limit=500, namespace='other'),
+            call(limit=500, namespace=self.namespace)]
+        assert mock_list_cluster_memcached_object.call_args_list == list_calls
+        self.queue.add.assert_called_once_with(
+            '{}/{}'.format(self.namespace, self.name), PRIORITY_DRIFTED)
 
     @patch('memcached_operator.memcached_operator.periodical.logging')
-    @patch('memcached_operator.memcached_operator.periodical.delete_deployment')
-    @patch('kubernetes.client.AppsV1beta1Api.list_deployment_for_all_namespaces')
-    @patch('memcached_operator.memcached_operator.periodical.get_namespaced_memcached_object')
-    @patch('memcached_operator.memcached_operator.periodical.delete_service')
-    @patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces')
-    def test_read_services_and_deployments_500(self, mock_list_service_for_all_namespaces, mock_delete_service, mock_get_namespaced_memcached_object, mock_list_deployment_for_all_namespaces, mock_delete_deployment, mock_logging):
-        # Mock service list
-        mock_list_service_for_all_namespaces.return_value = self.correct_svc_list
-
-        # Mock deployment list
-        mock_list_deployment_for_all_namespaces.return_value = self.correct_deploy_list
-
-        # Mock read namespaced memcached side effect
-        mock_get_namespaced_memcached_object.side_effect = client.rest.ApiException(status=500)
-
-        collect_garbage()
-        read_namespaced_memcached_calls = [
-            call(self.name, self.namespace),
-            call(self.name, self.namespace),
-            call(self.name, self.namespace)]
-        mock_get_namespaced_memcached_object.assert_has_calls(
-            read_namespaced_memcached_calls)
-        assert mock_delete_service.called is False
-        assert mock_delete_deployment.called is False
-        assert mock_logging.exception.called is True
-        assert mock_logging.exception.call_count == 3
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_list_clusters_500(self, mock_list_cluster_memcached_object, mock_logging):
+        mock_list_cluster_memcached_object.side_effect = client.rest.ApiException(status=500)
+
+        cursor = collect_garbage(self.queue, None, 1)
+        # The same clusters are checked again next time
+        assert cursor is None
+        assert self.queue.add.called is False
+        assert mock_logging.exception.call_count == 1
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_owned_services_and_deployments(self, mock_list_cluster_memcached_object):
+        owner_reference = client.V1OwnerReference(
+            api_version='kubestack.com/v1', kind='Memcached',
+            name=self.name, uid='test-uid-1234567890', controller=True)
+        for resource in SERVICE_STORE.list() + DEPLOYMENT_STORE.list():
+            resource.metadata.owner_references = [owner_reference]
+
+        collect_garbage(self.queue)
+        # Left to the kubernetes garbage collector
+        assert mock_list_cluster_memcached_object.called is False
+        assert self.queue.add.called is False
+
+    @patch('memcached_operator.memcached_operator.periodical.list_cluster_memcached_object')
+    def test_budget(self, mock_list_cluster_memcached_object):
+        other_svc = deepcopy(SERVICE_STORE.list()[0])
+        other_svc.metadata.name = 'other'
+        other_svc.metadata.labels['cluster'] = 'other'
+        SERVICE_STORE.upsert(other_svc)
+        mock_list_cluster_memcached_object.return_value = self.cluster_list()
+        other_key = '{}/other'.format(self.namespace)
+        key = '{}/{}'.format(self.namespace, self.name)
+
+        cursor = collect_garbage(self.queue, None, 1)
+        assert cursor == other_key
+        self.queue.add.assert_called_once_with(other_key, PRIORITY_DRIFTED)
+
+        self.queue.reset_mock()
+        cursor = collect_garbage(self.queue, cursor, 1)
+        assert cursor is None
+        self.queue.add.assert_called_once_with(key, PRIORITY_DRIFTED)
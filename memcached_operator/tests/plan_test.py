@@ -0,0 +1,111 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+
+from ..memcached_operator.plan import Plan, configure_executor, get_executor
+
+
+class TestPlan():
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(4)
+        self.plan = Plan()
+        self.order = []
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def step(self, name, result=True):
+        def run():
+            self.order.append(name)
+            return result
+        return run
+
+    def test_concurrent(self):
+        # Both steps only return once they ran at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        self.plan.add('a', barrier.wait)
+        self.plan.add('b', barrier.wait)
+
+        results = self.plan.run(self.executor)
+
+        assert sorted(results) == ['a', 'b']
+
+    def test_dependency(self):
+        self.plan.add('service', self.step('service'))
+        self.plan.add('deployment', self.step('deployment'),
+                      after=['service'])
+
+        results = self.plan.run(self.executor)
+
+        assert self.order == ['service', 'deployment']
+        assert results == {'service': True, 'deployment': True}
+
+    def test_dependency_not_planned(self):
+        # Up to date children aren't part of the plan
+        self.plan.add('deployment', self.step('deployment'),
+                      after=['service'])
+
+        assert self.plan.run(self.executor) == {'deployment': True}
+
+    @patch('memcached_operator.memcached_operator.plan.logging')
+    def test_dependency_failed(self, mock_logging):
+        self.plan.add('service', self.step('service', False))
+        self.plan.add('other', self.step('other'))
+        self.plan.add('deployment', self.step('deployment'),
+                      after=['service'])
+
+        results = self.plan.run(self.executor)
+
+        assert 'deployment' not in self.order
+        assert results == {'service': False, 'other': True,
+                           'deployment': False}
+
+    def test_arguments(self):
+        func = MagicMock(return_value=True)
+        self.plan.add('a', func, 'name', 'namespace')
+
+        self.plan.run(self.executor)
+
+        func.assert_called_once_with('name', 'namespace')
+
+    def test_single_step_inline(self):
+        executor = MagicMock()
+        self.plan.add('a', threading.current_thread)
+
+        results = self.plan.run(executor)
+
+        assert results['a'] is threading.current_thread()
+        assert executor.submit.called is False
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('test')
+        self.plan.add('a', fail)
+        self.plan.add('b', self.step('b'))
+
+        try:
+            self.plan.run(self.executor)
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
+        # Other steps still ran
+        assert self.order == ['b']
+
+    def test_empty(self):
+        assert self.plan.run(self.executor) == {}
+        assert len(self.plan) == 0
+
+
+class TestExecutor():
+    def tearDown(self):
+        configure_executor()
+
+    def test_shared(self):
+        assert get_executor() is get_executor()
+
+    def test_configure(self):
+        executor = configure_executor(2)
+
+        assert get_executor() is executor
+        assert executor._max_workers == 2
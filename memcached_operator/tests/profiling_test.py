@@ -0,0 +1,150 @@
+import os
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from ..memcached_operator.profiling import (PROFILER, Profiler,
+                                            format_report, sample_stacks,
+                                            start_profile_server)
+
+
+def wait_for(event):
+    event.wait(5)
+
+
+class TestSampleStacks():
+    def test_other_threads(self):
+        started = threading.Event()
+        stopped = threading.Event()
+
+        def idle():
+            started.set()
+            wait_for(stopped)
+        thread = threading.Thread(name='Idle', target=idle)
+        thread.start()
+        started.wait(5)
+
+        stacks = Counter()
+        try:
+            sample_stacks(stacks, {thread.ident: 'Idle'},
+                          threading.get_ident())
+        finally:
+            stopped.set()
+            thread.join()
+
+        idle_stacks = [stack for stack in stacks if stack[0] == 'Idle']
+        assert len(idle_stacks) == 1
+        assert any(frame.startswith('wait_for (profiling_test.py:')
+                   for frame in idle_stacks[0])
+        # Our own thread isn't sampled
+        assert not any(frame.startswith('test_other_threads ')
+                       for stack in stacks for frame in stack)
+
+
+class TestFormatReport():
+    def test_sections(self):
+        stacks = Counter({
+            ('Worker-0', 'worker (reconciler.py:69)', 'get (queue.py:1)'): 3,
+            ('Worker-1', 'worker (reconciler.py:69)', 'get (queue.py:1)'): 1})
+
+        report = format_report(1, 4, stacks, None)
+
+        assert '# memcached-operator profile of 1.0s, 4 samples' in report
+        assert '       4 100.0%  get (queue.py:1)' in report
+        assert ('Worker-0;worker (reconciler.py:69);get (queue.py:1) 3'
+                in report.splitlines())
+        assert 'Top allocations' not in report
+
+
+class TestProfiler():
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.directory.name, 0.05)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_profile(self):
+        report = self.profiler.profile()
+
+        assert '## Top frames by thread samples' in report
+        assert '## Top allocations' in report
+        assert '## Stacks' in report
+        profiles = os.listdir(self.directory.name)
+        assert len(profiles) == 1
+        with open(os.path.join(self.directory.name, profiles[0])) as f:
+            assert f.read() == report
+        assert tracemalloc.is_tracing() is False
+
+    def test_keeps_tracemalloc(self):
+        tracemalloc.start()
+        try:
+            self.profiler.profile()
+            assert tracemalloc.is_tracing() is True
+        finally:
+            tracemalloc.stop()
+
+    def test_busy(self):
+        self.profiler.running = True
+
+        assert self.profiler.profile() is None
+        assert self.profiler.start() is False
+        assert os.listdir(self.directory.name) == []
+
+    def test_start(self):
+        assert self.profiler.start() is True
+
+        for thread in threading.enumerate():
+            if thread.name == 'Profiler':
+                thread.join(5)
+        assert self.profiler.running is False
+        assert len(os.listdir(self.directory.name)) == 1
+
+    @patch('memcached_operator.memcached_operator.profiling.logging')
+    def test_write_error(self, mock_logging):
+        self.profiler.configure('/nonexistent', 0.05)
+
+        assert self.profiler.profile() is not None
+        assert mock_logging.exception.called is True
+        assert self.profiler.running is False
+
+
+class TestProfileServer():
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        PROFILER.configure(self.directory.name, 30)
+        self.server = start_profile_server(0)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        PROFILER.configure()
+        self.directory.cleanup()
+
+    def get_status(self, path):
+        try:
+            return urlopen(self.url + path, timeout=5).status
+        except HTTPError as e:
+            return e.code
+
+    def test_profile(self):
+        response = urlopen(self.url + '/debug/profile?seconds=0.05',
+                           timeout=5)
+
+        assert response.status == 200
+        assert b'## Stacks' in response.read()
+        assert len(os.listdir(self.directory.name)) == 1
+
+    def test_not_found(self):
+        assert self.get_status('/metrics') == 404
+
+    def test_bad_seconds(self):
+        assert self.get_status('/debug/profile?seconds=x') == 400
+
+    def test_local_only(self):
+        assert self.server.server_address[0] == '127.0.0.1'
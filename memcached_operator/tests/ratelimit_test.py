@@ -0,0 +1,158 @@
+from unittest.mock import patch, MagicMock
+
+from kubernetes import client
+
+from ..memcached_operator.ratelimit import (TokenBucket, get_retry_after,
+                                            limit_rest_client)
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket():
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket(10, 2, self.clock, self.clock.sleep)
+
+    def test_burst(self):
+        assert self.bucket.acquire() == 0
+        assert self.bucket.acquire() == 0
+        assert self.clock.now == 0
+
+    def test_qps(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+
+        assert abs(self.bucket.acquire() - 0.1) < 1e-9
+        assert abs(self.bucket.acquire() - 0.1) < 1e-9
+        assert abs(self.clock.now - 0.2) < 1e-9
+
+    def test_refill(self):
+        self.bucket.acquire()
+        self.bucket.acquire()
+        self.clock.now += 10
+
+        # Never more tokens than the burst
+        assert self.bucket.acquire() == 0
+        assert self.bucket.acquire() == 0
+        assert self.bucket.acquire() > 0
+
+    def test_pause(self):
+        self.bucket.pause(5)
+
+        assert self.bucket.acquire() == 5
+        assert self.bucket.acquire() == 0
+
+    def test_default_burst(self):
+        bucket = TokenBucket(5)
+        assert bucket.burst == 5
+
+
+class TestGetRetryAfter():
+    def test_header(self):
+        e = client.rest.ApiException(status=429)
+        e.headers = {'Retry-After': '3'}
+        assert get_retry_after(e) == 3
+
+    def test_missing(self):
+        e = client.rest.ApiException(status=429)
+        assert get_retry_after(e) == 1
+
+    def test_invalid(self):
+        e = client.rest.ApiException(status=429)
+        e.headers = {'Retry-After': 'soon'}
+        assert get_retry_after(e) == 1
+
+    def test_capped(self):
+        e = client.rest.ApiException(status=429)
+        e.headers = {'Retry-After': '3600'}
+        assert get_retry_after(e) == 60
+
+
+class TestLimitRestClient():
+    def setUp(self):
+        self.rest_client = MagicMock()
+        self.request = self.rest_client.request
+        self.limiter = MagicMock()
+        limit_rest_client(self.rest_client, self.limiter, max_retries=2)
+
+    def throttled(self):
+        e = client.rest.ApiException(status=429)
+        e.headers = {'Retry-After': '2'}
+        return e
+
+    def test_limited(self):
+        self.request.return_value = 'response'
+
+        result = self.rest_client.request(
+            'GET', 'https://k8s/api/v1/namespaces/default/services/test')
+
+        assert result == 'response'
+        self.limiter.acquire.assert_called_once_with()
+
+    def test_watch_not_limited(self):
+        self.rest_client.request(
+            'GET', 'https://k8s/api/v1/services', [('watch', True)])
+
+        assert self.limiter.acquire.called is False
+        assert self.request.called is True
+
+    def test_lease_not_limited(self):
+        self.request.side_effect = self.throttled()
+
+        try:
+            self.rest_client.request(
+                'PATCH', 'https://k8s/apis/coordination.k8s.io/v1beta1/'
+                'namespaces/kubestack/leases/memcached-operator-leader')
+        except client.rest.ApiException as e:
+            assert e.status == 429
+        else:
+            assert False, 'ApiException not raised'
+        assert self.limiter.acquire.called is False
+        assert self.limiter.pause.called is False
+        assert self.request.call_count == 1
+
+    @patch('memcached_operator.memcached_operator.ratelimit.logging')
+    def test_retry_throttled(self, mock_logging):
+        self.request.side_effect = [self.throttled(), 'response']
+
+        result = self.rest_client.request(
+            'GET', 'https://k8s/api/v1/namespaces/default/services/test')
+
+        assert result == 'response'
+        assert self.request.call_count == 2
+        assert self.limiter.acquire.call_count == 2
+        self.limiter.pause.assert_called_once_with(2)
+
+    @patch('memcached_operator.memcached_operator.ratelimit.logging')
+    def test_retries_exhausted(self, mock_logging):
+        self.request.side_effect = self.throttled()
+
+        try:
+            self.rest_client.request(
+                'GET', 'https://k8s/api/v1/namespaces/default/services/test')
+        except client.rest.ApiException as e:
+            assert e.status == 429
+        else:
+            assert False, 'ApiException not raised'
+        assert self.request.call_count == 3
+
+    def test_other_errors_not_retried(self):
+        self.request.side_effect = client.rest.ApiException(status=500)
+
+        try:
+            self.rest_client.request(
+                'GET', 'https://k8s/api/v1/namespaces/default/services/test')
+        except client.rest.ApiException as e:
+            assert e.status == 500
+        else:
+            assert False, 'ApiException not raised'
+        assert self.request.call_count == 1
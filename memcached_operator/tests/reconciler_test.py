@@ -0,0 +1,223 @@
+from unittest.mock import patch, MagicMock
+from threading import Event
+
+from kubernetes import client
+
+from ..memcached_operator.reconciler import reconcile, worker
+from ..memcached_operator.scope import SCOPE
+from ..memcached_operator.informers import (MEMCACHED_STORE,
+                                            SERVICE_STORE,
+                                            DEPLOYMENT_STORE)
+from ..memcached_operator.kubernetes_resources import (
+    get_mcrouter_service_object,
+    get_memcached_deployment_object)
+
+
+class TestReconcile():
+    def setUp(self):
+        self.name = 'testname123'
+        self.namespace = 'testnamespace456'
+        self.key = '{}/{}'.format(self.namespace, self.name)
+        self.cluster_object = {'metadata':{'name': self.name,
+                                           'namespace': self.namespace,
+                                           'uid': 'test-uid-1234567890',
+                                           'resourceVersion': '5'}}
+        MEMCACHED_STORE.replace([self.cluster_object])
+        SERVICE_STORE.replace([])
+        DEPLOYMENT_STORE.replace([])
+
+    @patch('memcached_operator.memcached_operator.reconciler.delete', return_value=True)
+    def test_deleted_cluster(self, mock_delete):
+        MEMCACHED_STORE.replace([])
+        # Created before ownerReferences were set
+        unowned_object = {'metadata': {'name': self.name,
+                                       'namespace': self.namespace}}
+        SERVICE_STORE.replace([get_mcrouter_service_object(unowned_object)])
+
+        result = reconcile(self.key)
+
+        mock_delete.assert_called_once_with(
+            {'metadata': {'name': self.name, 'namespace': self.namespace}})
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.reconciler.get_namespaced_memcached_object')
+    @patch('memcached_operator.memcached_operator.reconciler.delete', return_value=True)
+    def test_relabeled_cluster(self, mock_delete, mock_get_namespaced_memcached_object):
+        MEMCACHED_STORE.replace([])
+        unowned_object = {'metadata': {'name': self.name,
+                                       'namespace': self.namespace}}
+        SERVICE_STORE.replace([get_mcrouter_service_object(unowned_object)])
+        SCOPE.configure(label_selector='tenant=a')
+        try:
+            result = reconcile(self.key)
+        finally:
+            SCOPE.configure()
+
+        mock_get_namespaced_memcached_object.assert_called_once_with(
+            self.name, self.namespace)
+        assert mock_delete.called is False
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.reconciler.get_namespaced_memcached_object', side_effect=client.rest.ApiException(status=404))
+    @patch('memcached_operator.memcached_operator.reconciler.delete', return_value=True)
+    def test_deleted_cluster_with_selector(self, mock_delete, mock_get_namespaced_memcached_object):
+        MEMCACHED_STORE.replace([])
+        unowned_object = {'metadata': {'name': self.name,
+                                       'namespace': self.namespace}}
+        SERVICE_STORE.replace([get_mcrouter_service_object(unowned_object)])
+        SCOPE.configure(label_selector='tenant=a')
+        try:
+            result = reconcile(self.key)
+        finally:
+            SCOPE.configure()
+
+        assert mock_delete.called is True
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.reconciler.delete', return_value=True)
+    def test_deleted_cluster_owned_children(self, mock_delete):
+        MEMCACHED_STORE.replace([])
+        SERVICE_STORE.replace(
+            [get_mcrouter_service_object(self.cluster_object)])
+        DEPLOYMENT_STORE.replace(
+            [get_memcached_deployment_object(self.cluster_object)])
+
+        result = reconcile(self.key)
+
+        # Left to the kubernetes garbage collector
+        assert mock_delete.called is False
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.reconciler.update_memcached_status')
+    @patch('memcached_operator.memcached_operator.reconciler.check_cluster', return_value=True)
+    def test_changed_cluster(self, mock_check_cluster, mock_update_memcached_status):
+        self.cluster_object['metadata']['generation'] = 2
+        self.cluster_object['status'] = {'observedGeneration': 1}
+
+        result = reconcile(self.key)
+
+        mock_check_cluster.assert_called_once_with(self.cluster_object, False)
+        mock_update_memcached_status.assert_called_once_with(
+            self.name, self.namespace, {'observedGeneration': 2})
+        assert result is True
+
+    @patch('memcached_operator.memcached_operator.reconciler.update_memcached_status')
+    @patch('memcached_operator.memcached_operator.reconciler.check_cluster', return_value=False)
+    def test_changed_cluster_failure(self, mock_check_cluster, mock_update_memcached_status):
+        self.cluster_object['metadata']['generation'] = 2
+
+        result = reconcile(self.key)
+
+        assert mock_update_memcached_status.called is False
+        assert result is False
+
+    @patch('memcached_operator.memcached_operator.reconciler.update_memcached_status', return_value=False)
+    @patch('memcached_operator.memcached_operator.reconciler.check_cluster', return_value=True)
+    def test_changed_cluster_status_failure(self, mock_check_cluster, mock_update_memcached_status):
+        self.cluster_object['metadata']['generation'] = 2
+
+        result = reconcile(self.key)
+
+        assert result is False
+
+    @patch('memcached_operator.memcached_operator.reconciler.update_memcached_status')
+    @patch('memcached_operator.memcached_operator.reconciler.check_cluster', return_value=True)
+    def test_unchanged_cluster(self, mock_check_cluster, mock_update_memcached_status):
+        self.cluster_object['metadata']['generation'] = 2
+        self.cluster_object['status'] = {'observedGeneration': 2}
+
+        result = reconcile(self.key)
+
+        mock_check_cluster.assert_called_once_with(self.cluster_object, False)
+        assert mock_update_memcached_status.called is False
+        assert result is True
+
+
+class TestWorker():
+    def setUp(self):
+        self.key = 'testnamespace456/testname123'
+        self.shutting_down = Event()
+        self.queue = MagicMock()
+        self.queue.num_requeues.return_value = 0
+
+        def get(timeout=None):
+            # Hand out one key, then stop the worker
+            if self.shutting_down.isSet():
+                return None
+            self.shutting_down.set()
+            return self.key
+        self.queue.get.side_effect = get
+
+        self.caches_synced_patcher = patch(
+            'memcached_operator.memcached_operator.reconciler.caches_synced',
+            return_value=True)
+        self.mock_caches_synced = self.caches_synced_patcher.start()
+
+    def tearDown(self):
+        self.caches_synced_patcher.stop()
+
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile', return_value=True)
+    def test_success(self, mock_reconcile):
+        worker(self.shutting_down, self.queue)
+
+        mock_reconcile.assert_called_once_with(self.key, False)
+        self.queue.forget.assert_called_once_with(self.key)
+        assert self.queue.add_rate_limited.called is False
+        self.queue.done.assert_called_once_with(self.key)
+
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile', return_value=True)
+    def test_server_side_apply(self, mock_reconcile):
+        worker(self.shutting_down, self.queue, True)
+
+        mock_reconcile.assert_called_once_with(self.key, True)
+
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile', return_value=False)
+    def test_failure(self, mock_reconcile):
+        worker(self.shutting_down, self.queue)
+
+        assert self.queue.forget.called is False
+        self.queue.add_rate_limited.assert_called_once_with(self.key)
+        self.queue.done.assert_called_once_with(self.key)
+
+    @patch('memcached_operator.memcached_operator.reconciler.logging')
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile', side_effect=Exception())
+    def test_exception(self, mock_reconcile, mock_logging):
+        worker(self.shutting_down, self.queue)
+
+        assert mock_logging.exception.called is True
+        self.queue.add_rate_limited.assert_called_once_with(self.key)
+        self.queue.done.assert_called_once_with(self.key)
+
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile', return_value=True)
+    def test_wait_for_caches(self, mock_reconcile):
+        def caches_synced():
+            # Synced on the second check
+            return self.mock_caches_synced.call_count > 1
+        self.mock_caches_synced.side_effect = caches_synced
+
+        worker(self.shutting_down, self.queue)
+
+        assert self.mock_caches_synced.call_count == 2
+        mock_reconcile.assert_called_once_with(self.key, False)
+
+    @patch('memcached_operator.memcached_operator.reconciler.STARTUP_TIMER')
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile', return_value=True)
+    def test_startup_timer(self, mock_reconcile, mock_startup_timer):
+        worker(self.shutting_down, self.queue)
+
+        mock_startup_timer.reconciled.assert_called_once_with()
+
+    @patch('memcached_operator.memcached_operator.reconciler.STARTUP_TIMER')
+    @patch('memcached_operator.memcached_operator.reconciler.reconcile')
+    @patch('memcached_operator.memcached_operator.reconciler.SHARDS')
+    def test_other_shard(self, mock_shards, mock_reconcile,
+                         mock_startup_timer):
+        # Also the case for every key while standing by for the leader
+        mock_shards.owns.return_value = False
+
+        worker(self.shutting_down, self.queue)
+
+        assert mock_reconcile.called is False
+        assert mock_startup_timer.reconciled.called is False
+        self.queue.forget.assert_called_once_with(self.key)
+        self.queue.done.assert_called_once_with(self.key)
@@ -0,0 +1,75 @@
+"""Render throughput benchmarks.
+
+Not collected by nose, run them with pytest-benchmark:
+
+    pytest memcached_operator/tests/render_benchmark.py
+"""
+from kubernetes import client
+
+from ..memcached_operator.kubernetes_resources import (
+    RENDER_CACHE,
+    parse_cluster_spec,
+    render_mcrouter_service,
+    render_memcached_service,
+    render_memcached_deployment,
+    render_mcrouter_deployment)
+
+
+CLUSTERS = 10000
+
+
+def get_cluster_objects(count=CLUSTERS):
+    cluster_objects = []
+    for i in range(count):
+        cluster_objects.append({
+            'metadata': {
+                'name': 'cluster{}'.format(i),
+                'namespace': 'namespace{}'.format(i % 100),
+                'uid': 'uid-{}'.format(i)},
+            'spec': {
+                'memcached': {'replicas': 2 + i % 3},
+                'mcrouter': {'replicas': 1 + i % 2}}})
+    return cluster_objects
+
+
+def render_all(cluster_objects):
+    for cluster_object in cluster_objects:
+        spec = parse_cluster_spec(cluster_object)
+        render_mcrouter_service(spec)
+        render_memcached_service(spec)
+        render_memcached_deployment(spec)
+        render_mcrouter_deployment(spec)
+
+
+def test_render(benchmark):
+    cluster_objects = get_cluster_objects()
+
+    benchmark.pedantic(
+        render_all,
+        args=(cluster_objects,),
+        setup=RENDER_CACHE.clear,
+        rounds=5)
+
+
+def test_render_memoized(benchmark):
+    cluster_objects = get_cluster_objects()
+    render_all(cluster_objects)
+
+    benchmark(render_all, cluster_objects)
+
+
+def test_serialize(benchmark):
+    # What the client does with every rendered resource it sends
+    api_client = client.ApiClient()
+    cluster_objects = get_cluster_objects()
+    RENDER_CACHE.clear()
+    resources = []
+    for cluster_object in cluster_objects:
+        spec = parse_cluster_spec(cluster_object)
+        resources.append(render_memcached_deployment(spec))
+
+    def serialize_all():
+        for resource in resources:
+            api_client.sanitize_for_serialization(resource)
+
+    benchmark(serialize_all)
@@ -0,0 +1,163 @@
+from unittest.mock import patch, MagicMock
+
+from ..memcached_operator.metrics import ApiPressure
+from ..memcached_operator.resync import (AdaptiveInterval, ResyncSchedule,
+                                         RESYNC_INTERVAL_ANNOTATION,
+                                         get_resync_interval)
+
+
+def get_cluster_objects(count, annotations=None):
+    return [{'metadata': {'name': 'cluster{}'.format(i),
+                          'namespace': 'testnamespace456',
+                          'annotations': annotations or {}}}
+            for i in range(count)]
+
+
+class TestGetResyncInterval():
+    def test_no_annotation(self):
+        assert get_resync_interval(get_cluster_objects(1)[0]) is None
+
+    def test_annotation(self):
+        cluster_object = get_cluster_objects(
+            1, {RESYNC_INTERVAL_ANNOTATION: '5'})[0]
+
+        assert get_resync_interval(cluster_object) == 5
+
+    def test_invalid_annotation(self):
+        for value in ('soon', '0', 'nan', 'inf', '-inf'):
+            cluster_object = get_cluster_objects(
+                1, {RESYNC_INTERVAL_ANNOTATION: value})[0]
+
+            assert get_resync_interval(cluster_object) is None
+
+
+class TestAdaptiveInterval():
+    def setUp(self):
+        self.pressure = ApiPressure()
+        self.interval = AdaptiveInterval(
+            25, 300, resync_rate=100, pressure=self.pressure)
+
+    def test_small_fleet(self):
+        assert self.interval.update(1000) == 25
+
+    def test_large_fleet(self):
+        assert self.interval.update(10000) == 100
+
+    @patch('memcached_operator.memcached_operator.resync.logging')
+    def test_max_below_min(self, mock_logging):
+        interval = AdaptiveInterval(900, 600, pressure=self.pressure)
+
+        assert interval.update(1000) == 900
+        assert mock_logging.warning.called is True
+
+    def test_throttled(self):
+        self.pressure.observe('PATCH', 0.01, 429)
+        assert self.interval.update(1000, 0) == 50
+
+        self.pressure.observe('PATCH', 0.01, 429)
+        assert self.interval.update(1000, 1) == 100
+
+        # Healthy ticks within the interval keep the backoff
+        for now in range(2, 101):
+            self.pressure.observe('GET', 0.01, 200)
+            assert self.interval.update(1000, now) == 100
+
+        # Every healthy interval halves it
+        assert self.interval.update(1000, 101) == 50
+        assert self.interval.update(1000, 150) == 50
+        assert self.interval.update(1000, 151) == 25
+        assert self.interval.update(1000, 1000) == 25
+
+    def test_slow_apiserver(self):
+        self.pressure.observe('GET', 2, 200)
+
+        assert self.interval.update(1000) == 31.25
+
+    def test_max_seconds(self):
+        assert self.interval.update(100000) == 300
+
+
+class TestResyncSchedule():
+    def setUp(self):
+        self.interval = MagicMock(seconds=10)
+        self.rand = MagicMock()
+        self.rand.random.return_value = 0.5
+        self.schedule = ResyncSchedule(self.interval, rand=self.rand)
+
+    def test_spread(self):
+        cluster_objects = get_cluster_objects(100)
+
+        due_per_second = [
+            len(self.schedule.get_due(cluster_objects, now))
+            for now in range(11)]
+
+        # Nothing is due when first seen, then every cluster once within
+        # the interval, in small batches
+        assert due_per_second[0] == 0
+        assert sum(due_per_second[1:]) == 100
+        assert max(due_per_second) < 25
+
+    def test_interval(self):
+        cluster_objects = get_cluster_objects(1)
+        self.schedule.get_due(cluster_objects, 0)
+
+        due = [now for now in range(31)
+               if self.schedule.get_due(cluster_objects, now)]
+
+        assert len(due) == 3
+        assert due[1] - due[0] == 10
+
+    def test_jitter(self):
+        cluster_objects = get_cluster_objects(1)
+        self.schedule.get_due(cluster_objects, 0)
+        self.rand.random.return_value = 1
+        first = [now for now in range(11)
+                 if self.schedule.get_due(cluster_objects, now)][0]
+
+        assert not self.schedule.get_due(cluster_objects, first + 10)
+        assert self.schedule.get_due(cluster_objects, first + 11)
+
+    def test_annotation_override(self):
+        cluster_objects = get_cluster_objects(
+            1, {RESYNC_INTERVAL_ANNOTATION: '2'})
+        self.schedule.get_due(cluster_objects, 0)
+
+        due = [now for now in range(11)
+               if self.schedule.get_due(cluster_objects, now)]
+
+        assert len(due) == 5
+
+    def test_interval_grows(self):
+        cluster_objects = get_cluster_objects(1)
+        self.schedule.get_due(cluster_objects, 0)
+        first = [now for now in range(11)
+                 if self.schedule.get_due(cluster_objects, now)][0]
+
+        # Backing off moves the pending resync out as well
+        self.interval.seconds = 100
+        due = [now for now in range(first + 1, first + 101)
+               if self.schedule.get_due(cluster_objects, now)]
+
+        assert due == [first + 100]
+
+    def test_interval_shrinks(self):
+        cluster_objects = get_cluster_objects(1)
+        self.schedule.get_due(cluster_objects, 0)
+        first = [now for now in range(11)
+                 if self.schedule.get_due(cluster_objects, now)][0]
+
+        # Annotated later, the next resync comes sooner
+        cluster_objects[0]['metadata']['annotations'] = {
+            RESYNC_INTERVAL_ANNOTATION: '2'}
+        due = [now for now in range(first + 1, first + 5)
+               if self.schedule.get_due(cluster_objects, now)]
+
+        assert due == [first + 2, first + 4]
+
+    def test_forgets_deleted(self):
+        cluster_objects = get_cluster_objects(2)
+        self.schedule.get_due(cluster_objects, 0)
+
+        self.schedule.get_due(cluster_objects[:1], 1)
+
+        assert len(self.schedule._due) == 1
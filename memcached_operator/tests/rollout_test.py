@@ -0,0 +1,127 @@
+from unittest.mock import MagicMock
+
+from kubernetes import client
+
+from ..memcached_operator.informers import Store
+from ..memcached_operator.rollout import (RolloutGate, is_rolled_out,
+                                          get_generation)
+
+
+def get_deployment(generation, observed_generation, replicas=3,
+                   updated=3, available=3, current=None):
+    return client.V1Deployment(
+        metadata=client.V1ObjectMeta(
+            name='test', namespace='default', generation=generation),
+        spec=client.V1DeploymentSpec(
+            replicas=replicas,
+            selector=client.V1LabelSelector(),
+            template=client.V1PodTemplateSpec()),
+        status=client.V1DeploymentStatus(
+            observed_generation=observed_generation,
+            replicas=updated if current is None else current,
+            updated_replicas=updated,
+            available_replicas=available))
+
+
+class TestIsRolledOut():
+    def test_rolled_out(self):
+        assert is_rolled_out(get_deployment(2, 2)) is True
+
+    def test_generation_not_observed(self):
+        assert is_rolled_out(get_deployment(2, 1)) is False
+
+    def test_generation_of_update_not_observed(self):
+        # The cache hasn't seen the update yet
+        assert is_rolled_out(get_deployment(2, 2), 3) is False
+
+    def test_replicas_not_updated(self):
+        assert is_rolled_out(get_deployment(2, 2, updated=2)) is False
+
+    def test_old_replicas_terminating(self):
+        assert is_rolled_out(get_deployment(2, 2, current=4)) is False
+
+    def test_replicas_not_available(self):
+        assert is_rolled_out(get_deployment(2, 2, available=2)) is False
+
+    def test_no_status(self):
+        deployment = get_deployment(2, 2)
+        deployment.status = None
+        assert is_rolled_out(deployment) is False
+
+    def test_dict(self):
+        deployment = {
+            'metadata': {'generation': 2},
+            'spec': {'replicas': 1},
+            'status': {'observedGeneration': 2, 'replicas': 1,
+                       'updatedReplicas': 1, 'availableReplicas': 1}}
+        assert is_rolled_out(deployment) is True
+        assert get_generation(deployment) == 2
+
+
+class TestRolloutGate():
+    def setUp(self):
+        self.store = Store()
+        self.store.replace([])
+        self.gate = RolloutGate(1, self.store)
+
+    def test_limit(self):
+        self.store.replace([get_deployment(1, 1)])
+        assert self.gate.try_start('test', 'default') is True
+        self.gate.started('test', 'default', get_deployment(2, 1))
+
+        # Already rolling deployments may be updated again
+        assert self.gate.try_start('test', 'default') is True
+        assert self.gate.try_start('other', 'default') is False
+        assert len(self.gate) == 1
+
+    def test_pending_update_holds_slot(self):
+        # The cached deployment looks rolled out until the update returns
+        self.store.replace([get_deployment(1, 1)])
+        assert self.gate.try_start('test', 'default') is True
+
+        assert self.gate.try_start('other', 'default') is False
+
+    def test_rolled_out_frees_slot(self):
+        self.store.replace([get_deployment(1, 1)])
+        self.gate.try_start('test', 'default')
+        self.gate.started('test', 'default', get_deployment(2, 1))
+
+        self.store.replace([get_deployment(2, 2)])
+
+        assert len(self.gate) == 0
+        assert self.gate.try_start('other', 'default') is True
+
+    def test_deleted_frees_slot(self):
+        self.gate.try_start('test', 'default')
+        self.gate.started('test', 'default', get_deployment(2, 1))
+
+        assert self.gate.try_start('other', 'default') is True
+
+    def test_cancel(self):
+        self.gate.try_start('test', 'default')
+        self.gate.cancel('test', 'default')
+
+        assert self.gate.try_start('other', 'default') is True
+
+    def test_requeue_deferred(self):
+        queue = MagicMock()
+        self.gate.try_start('test', 'default')
+        assert self.gate.try_start('other', 'default', 'default/a') is False
+        assert self.gate.try_start('other', 'default', 'default/b') is False
+
+        # Still rolling
+        self.gate.requeue_deferred(queue)
+        assert queue.add.called is False
+
+        self.gate.cancel('test', 'default')
+        self.gate.requeue_deferred(queue)
+        queue.add.assert_called_once_with('default/a')
+
+        queue.reset_mock()
+        self.gate.requeue_deferred(queue)
+        queue.add.assert_called_once_with('default/b')
+
+    def test_configure(self):
+        self.gate.configure('0')
+
+        assert self.gate.try_start('test', 'default') is False
@@ -0,0 +1,40 @@
+from ..memcached_operator.scope import (Scope, get_list_kwargs,
+                                        parse_namespaces)
+
+
+class TestScope():
+    def setUp(self):
+        self.scope = Scope()
+
+    def test_cluster_wide(self):
+        assert self.scope.get_namespaces() == [None]
+        assert self.scope.label_selector is None
+
+    def test_configure(self):
+        self.scope.configure(['b', 'a', 'b'], 'tenant=a')
+
+        assert self.scope.get_namespaces() == ['a', 'b']
+        assert self.scope.label_selector == 'tenant=a'
+
+    def test_configure_empty(self):
+        self.scope.configure([], '')
+
+        assert self.scope.get_namespaces() == [None]
+        assert self.scope.label_selector is None
+
+
+class TestGetListKwargs():
+    def test_unscoped(self):
+        assert get_list_kwargs() == {}
+
+    def test_scoped(self):
+        assert get_list_kwargs('a', 'tenant=a') == {
+            'namespace': 'a', 'label_selector': 'tenant=a'}
+
+
+class TestParseNamespaces():
+    def test_parse(self):
+        assert parse_namespaces('a, b,,c') == ['a', 'b', 'c']
+
+    def test_none(self):
+        assert parse_namespaces(None) is None
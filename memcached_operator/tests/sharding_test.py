@@ -0,0 +1,197 @@
+from datetime import datetime, timezone
+from threading import Event, Thread
+from unittest.mock import patch, MagicMock
+
+from kubernetes import client
+
+from ..memcached_operator.sharding import (HashRing, Shards, ShardMembership,
+                                           SHARD_LABEL)
+
+
+def get_keys(count=1000):
+    return ['namespace{}/cluster{}'.format(i % 10, i) for i in range(count)]
+
+
+def get_lease(holder, second=0):
+    return client.V1beta1Lease(spec=client.V1beta1LeaseSpec(
+        holder_identity=holder,
+        lease_duration_seconds=15,
+        renew_time=datetime(2020, 1, 1, 0, 0, second, tzinfo=timezone.utc)))
+
+
+class TestHashRing():
+    def test_empty(self):
+        assert HashRing([]).get_member('ns/cluster') is None
+
+    def test_spreads_keys(self):
+        ring = HashRing(['a', 'b', 'c'])
+
+        counts = {}
+        for key in get_keys():
+            member = ring.get_member(key)
+            counts[member] = counts.get(member, 0) + 1
+
+        assert sorted(counts) == ['a', 'b', 'c']
+        assert min(counts.values()) > 200
+
+    def test_join_moves_few_keys(self):
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+
+        moved = [key for key in get_keys()
+                 if before.get_member(key) != after.get_member(key)]
+
+        # Only keys taken over by the new member move
+        assert all(after.get_member(key) == 'd' for key in moved)
+        assert len(moved) < 400
+
+
+class TestShards():
+    def setUp(self):
+        self.shards = Shards()
+
+    def test_owns_all_without_ring(self):
+        assert self.shards.owns('ns/cluster') is True
+
+    def test_owns(self):
+        self.shards.set_members('a', ['a', 'b'])
+
+        owned = [key for key in get_keys() if self.shards.owns(key)]
+
+        assert 0 < len(owned) < 1000
+        assert all(HashRing(['a', 'b']).get_member(key) == 'a'
+                   for key in owned)
+
+    def test_set_members_changed(self):
+        assert self.shards.set_members('a', ['a', 'b']) is True
+        assert self.shards.set_members('a', ['b', 'a']) is False
+        assert self.shards.set_members('a', ['a']) is True
+
+    def test_inactive_owns_nothing(self):
+        self.shards.set_active(False)
+
+        assert self.shards.owns('ns/cluster') is False
+
+        self.shards.set_active(True)
+        assert self.shards.owns('ns/cluster') is True
+
+    def test_reset(self):
+        self.shards.set_members('a', ['a', 'b'])
+        self.shards.reset()
+
+        assert self.shards.owns('ns/cluster') is True
+
+
+class TestShardMembership():
+    def setUp(self):
+        self.shards = Shards()
+        self.membership = ShardMembership('a', 'kubestack', 15, self.shards)
+        self.queue = MagicMock()
+        self.rebalance = MagicMock()
+
+    @patch('memcached_operator.memcached_operator.sharding.list_lease_object')
+    @patch('memcached_operator.memcached_operator.sharding.renew_lease')
+    def test_sync(self, mock_renew_lease, mock_list_lease_object):
+        mock_list_lease_object.return_value = client.V1beta1LeaseList(
+            items=[get_lease('a'), get_lease('b')])
+
+        self.membership.sync(self.queue, self.rebalance)
+
+        lease_object = mock_renew_lease.call_args[0][0]
+        assert lease_object['metadata']['name'] == 'memcached-operator-shard-a'
+        assert lease_object['metadata']['labels'] == {SHARD_LABEL: 'true'}
+        assert lease_object['spec']['holderIdentity'] == 'a'
+        mock_list_lease_object.assert_called_once_with(
+            'kubestack', '{}=true'.format(SHARD_LABEL))
+        assert self.shards.ring.members == {'a', 'b'}
+        self.rebalance.assert_called_once_with(self.queue)
+
+    @patch('memcached_operator.memcached_operator.sharding.list_lease_object')
+    @patch('memcached_operator.memcached_operator.sharding.renew_lease')
+    def test_sync_unchanged(self, mock_renew_lease, mock_list_lease_object):
+        mock_list_lease_object.return_value = client.V1beta1LeaseList(
+            items=[get_lease('b')])
+        self.shards.set_members('a', ['a', 'b'])
+
+        self.membership.sync(self.queue, self.rebalance)
+
+        assert self.rebalance.called is False
+
+    def test_owns_nothing_before_sync(self):
+        assert self.shards.owns('ns/cluster') is False
+
+    @patch('memcached_operator.memcached_operator.sharding.list_lease_object')
+    @patch('memcached_operator.memcached_operator.sharding.renew_lease', return_value=False)
+    def test_sync_renew_failed(self, mock_renew_lease, mock_list_lease_object):
+        self.membership.sync(self.queue, self.rebalance)
+
+        assert mock_list_lease_object.called is False
+        assert self.shards.owns('ns/cluster') is False
+        assert self.rebalance.called is False
+
+    @patch('memcached_operator.memcached_operator.sharding.monotonic')
+    @patch('memcached_operator.memcached_operator.sharding.list_lease_object')
+    @patch('memcached_operator.memcached_operator.sharding.renew_lease')
+    def test_renew_deadline(self, mock_renew_lease, mock_list_lease_object, mock_monotonic):
+        mock_list_lease_object.return_value = client.V1beta1LeaseList(
+            items=[])
+        mock_monotonic.return_value = 100
+        self.membership.sync(self.queue, self.rebalance)
+        assert self.shards.owns('ns/cluster') is True
+
+        # Keep our clusters while the others still count us in
+        mock_renew_lease.return_value = False
+        mock_monotonic.return_value = 105
+        self.membership.sync(self.queue, self.rebalance)
+        assert self.shards.owns('ns/cluster') is True
+
+        mock_monotonic.return_value = 110
+        self.membership.sync(self.queue, self.rebalance)
+        assert self.shards.owns('ns/cluster') is False
+
+        # Take them back once renewing works again
+        mock_renew_lease.return_value = True
+        mock_monotonic.return_value = 115
+        self.membership.sync(self.queue, self.rebalance)
+        assert self.shards.owns('ns/cluster') is True
+        assert self.rebalance.call_count == 2
+
+    @patch('memcached_operator.memcached_operator.sharding.monotonic')
+    @patch('memcached_operator.memcached_operator.sharding.list_lease_object')
+    def test_expired_member(self, mock_list_lease_object, mock_monotonic):
+        mock_monotonic.return_value = 100
+        mock_list_lease_object.return_value = client.V1beta1LeaseList(
+            items=[get_lease('b'), get_lease('c')])
+        assert self.membership.get_live_members() == {'a', 'b', 'c'}
+
+        # Only c renewed its lease since
+        mock_monotonic.return_value = 116
+        mock_list_lease_object.return_value = client.V1beta1LeaseList(
+            items=[get_lease('b'), get_lease('c', 16)])
+        assert self.membership.get_live_members() == {'a', 'c'}
+
+    @patch('memcached_operator.memcached_operator.sharding.delete_lease')
+    def test_run_releases_lease(self, mock_delete_lease):
+        shutting_down = Event()
+        shutting_down.set()
+
+        self.membership.run(shutting_down, self.queue, self.rebalance)
+
+        mock_delete_lease.assert_called_once_with(
+            'memcached-operator-shard-a', 'kubestack')
+
+    @patch('memcached_operator.memcached_operator.sharding.delete_lease')
+    @patch('memcached_operator.memcached_operator.sharding.ShardMembership.sync')
+    def test_stop_deletes_lease(self, mock_sync, mock_delete_lease):
+        shutting_down = Event()
+        thread = Thread(target=self.membership.run,
+                        args=(shutting_down, self.queue, self.rebalance))
+        thread.start()
+
+        # Like the SIGTERM handler, without waiting for the next renewal
+        shutting_down.set()
+        thread.join(1)
+
+        assert thread.is_alive() is False
+        mock_delete_lease.assert_called_once_with(
+            'memcached-operator-shard-a', 'kubestack')
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from kubernetes import client
+
+from ..memcached_operator.state import (ChildVersions, get_version,
+                                        save_state, load_state)
+
+
+class TestGetVersion():
+    def test_deployment_generation(self):
+        deployment = client.V1Deployment(
+            metadata=client.V1ObjectMeta(generation=4, resource_version='9'))
+        assert get_version(deployment) == '4'
+
+    def test_service_resource_version(self):
+        service = client.V1Service(
+            metadata=client.V1ObjectMeta(resource_version='9'))
+        assert get_version(service) == '9'
+
+    def test_dict(self):
+        assert get_version({'metadata': {'resourceVersion': '9'}}) == '9'
+
+    def test_unknown(self):
+        assert get_version(True) is None
+        assert get_version({'metadata': {}}) is None
+
+
+class TestChildVersions():
+    def setUp(self):
+        self.versions = ChildVersions()
+        self.service = {'metadata': {'name': 'test',
+                                     'namespace': 'default',
+                                     'resourceVersion': '5'}}
+        self.edited = {'metadata': {'name': 'test',
+                                    'namespace': 'default',
+                                    'resourceVersion': '6'}}
+
+    def test_modified(self):
+        self.versions.record('services', self.service)
+
+        assert self.versions.is_modified('services', self.service) is False
+        assert self.versions.is_modified('services', self.edited) is True
+        # Deployments of the same name are tracked separately
+        assert self.versions.is_modified('deployments', self.edited) is False
+
+    def test_record_replaces(self):
+        self.versions.record('services', self.service)
+        self.versions.record('services', self.edited)
+
+        assert self.versions.is_modified('services', self.edited) is False
+
+    def test_writing(self):
+        self.versions.record('services', self.service)
+
+        with self.versions.writing('services', 'test', 'default'):
+            # The event of our own write, before it returned
+            assert self.versions.is_modified('services', self.edited) is False
+            self.versions.record('services', self.edited)
+
+        assert self.versions.is_modified('services', self.edited) is False
+        assert self.versions.is_modified('services', self.service) is True
+
+    def test_writing_failed(self):
+        self.versions.record('services', self.service)
+
+        try:
+            with self.versions.writing('services', 'test', 'default'):
+                raise ValueError('write failed')
+        except ValueError:
+            pass
+
+        assert self.versions.is_modified('services', self.edited) is True
+
+    def test_adopt_keeps_recorded(self):
+        self.versions.record('services', self.service)
+        self.versions.adopt('services', self.edited)
+
+        assert self.versions.is_modified('services', self.edited) is True
+
+    def test_forget(self):
+        self.versions.record('services', self.service)
+        self.versions.forget('services', 'test', 'default')
+
+        assert self.versions.is_modified('services', self.edited) is False
+        assert len(self.versions) == 0
+
+    def test_dump_restore(self):
+        self.versions.record('services', self.service)
+        versions = ChildVersions()
+
+        versions.restore(json.loads(json.dumps(self.versions.dump())))
+
+        assert versions.is_modified('services', self.edited) is True
+
+
+class TestStateFile():
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+        self.versions = ChildVersions()
+        self.versions.record('services', {
+            'metadata': {'name': 'test',
+                         'namespace': 'default',
+                         'resourceVersion': '5'}})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        versions = ChildVersions()
+
+        assert save_state(self.path, self.versions) is True
+        assert load_state(self.path, versions) is True
+
+        assert versions.dump() == self.versions.dump()
+        assert not os.path.exists(self.path + '.tmp')
+
+    @patch('memcached_operator.memcached_operator.state.logging')
+    def test_missing(self, mock_logging):
+        assert load_state(self.path, self.versions) is False
+        assert len(self.versions) == 1
+
+    @patch('memcached_operator.memcached_operator.state.logging')
+    def test_invalid(self, mock_logging):
+        with open(self.path, 'w') as state_file:
+            state_file.write('{')
+
+        assert load_state(self.path, self.versions) is False
+        assert mock_logging.exception.called is True
+
+    @patch('memcached_operator.memcached_operator.state.logging')
+    def test_other_version(self, mock_logging):
+        with open(self.path, 'w') as state_file:
+            json.dump({'version': 0, 'children': []}, state_file)
+
+        assert load_state(self.path, self.versions) is False
+        assert len(self.versions) == 1
+
+    @patch('memcached_operator.memcached_operator.state.logging')
+    def test_save_error(self, mock_logging):
+        path = os.path.join(self.directory, 'missing', 'state.json')
+
+        assert save_state(path, self.versions) is False
+        assert mock_logging.exception.called is True
@@ -0,0 +1,195 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+
+from ..memcached_operator.plan import Plan
+from ..memcached_operator.tracing import (NOOP_SPAN, STATUS_ERROR, STATUS_OK,
+                                          Tracer, get_attribute_value)
+
+
+def get_spans(document):
+    return json.loads(document)['resourceSpans'][0]['scopeSpans'][0]['spans']
+
+
+def get_attributes(span):
+    return dict((attribute['key'], list(attribute['value'].values())[0])
+                for attribute in span['attributes'])
+
+
+class TestGetAttributeValue():
+    def test_values(self):
+        assert get_attribute_value(True) == {'boolValue': True}
+        assert get_attribute_value(3) == {'intValue': '3'}
+        assert get_attribute_value(0.5) == {'doubleValue': 0.5}
+        assert get_attribute_value('a') == {'stringValue': 'a'}
+
+
+class TestTracer():
+    def setUp(self):
+        self.tracer = Tracer(sample_rate=1, buffer_size=10)
+
+    def test_not_sampled(self):
+        tracer = Tracer(sample_rate=0, buffer_size=10)
+
+        with tracer.trace('reconcile', 'ns/a', 'reconcile') as span:
+            with tracer.span('render', 'render') as child:
+                pass
+
+        assert span is NOOP_SPAN
+        assert child is NOOP_SPAN
+        assert len(tracer.buffer) == 0
+
+    def test_span_outside_trace(self):
+        with self.tracer.span('GET services', 'get') as span:
+            span.set_result(200)
+
+        assert span is NOOP_SPAN
+        assert len(self.tracer.buffer) == 0
+
+    def test_trace(self):
+        with self.tracer.trace('reconcile', 'ns/a', 'reconcile') as root:
+            with self.tracer.span('render', 'render') as child:
+                child.set_result('miss')
+            root.set_result(True)
+
+        spans = get_spans(self.tracer.buffer[0])
+        render, reconcile = spans
+        assert render['traceId'] == reconcile['traceId']
+        assert render['parentSpanId'] == reconcile['spanId']
+        assert 'parentSpanId' not in reconcile
+        assert get_attributes(render) == {
+            'memcached.cluster': 'ns/a',
+            'memcached.verb': 'render',
+            'memcached.result': 'miss'}
+        assert reconcile['status'] == {'code': STATUS_OK}
+        assert (int(reconcile['endTimeUnixNano']) >=
+                int(render['endTimeUnixNano']))
+        assert self.tracer.current() is None
+
+    def test_exception(self):
+        try:
+            with self.tracer.trace('reconcile', 'ns/a', 'reconcile'):
+                raise ValueError('broken')
+        except ValueError:
+            pass
+        else:
+            assert False, 'exception was swallowed'
+
+        reconcile, = get_spans(self.tracer.buffer[0])
+        assert reconcile['status'] == {
+            'code': STATUS_ERROR, 'message': 'ValueError: broken'}
+        assert self.tracer.current() is None
+
+    def test_failed_result(self):
+        with self.tracer.trace('reconcile', 'ns/a', 'reconcile') as span:
+            span.set_result(False)
+
+        reconcile, = get_spans(self.tracer.buffer[0])
+        assert reconcile['status'] == {'code': STATUS_ERROR}
+        assert get_attributes(reconcile)['memcached.result'] == 'False'
+
+    def test_wrap(self):
+        executor = ThreadPoolExecutor(1)
+        with self.tracer.trace('reconcile', 'ns/a', 'reconcile'):
+            def step():
+                with self.tracer.span('step', 'sync'):
+                    return threading.current_thread()
+            thread = executor.submit(self.tracer.wrap(step)).result()
+        executor.shutdown()
+
+        assert thread is not threading.current_thread()
+        step, reconcile = get_spans(self.tracer.buffer[0])
+        assert step['parentSpanId'] == reconcile['spanId']
+
+    def test_nested_traces(self):
+        with self.tracer.trace('reconcile', 'ns/a', 'reconcile'):
+            with self.tracer.trace('reconcile', 'ns/b', 'reconcile') as span:
+                assert span is NOOP_SPAN
+
+        assert len(self.tracer.buffer) == 1
+
+    @patch('memcached_operator.memcached_operator.tracing.monotonic')
+    def test_min_duration(self, mock_monotonic):
+        mock_monotonic.side_effect = [0, 0.5, 1, 3]
+        self.tracer.min_duration = 1
+
+        with self.tracer.trace('reconcile', 'ns/a', 'reconcile'):
+            pass
+        with self.tracer.trace('reconcile', 'ns/b', 'reconcile'):
+            pass
+
+        assert len(self.tracer.buffer) == 1
+        reconcile, = get_spans(self.tracer.buffer[0])
+        assert get_attributes(reconcile)['memcached.cluster'] == 'ns/b'
+
+    def test_ring_buffer(self):
+        tracer = Tracer(sample_rate=1, buffer_size=2)
+        for name in ('a', 'b', 'c'):
+            with tracer.trace('reconcile', name, 'reconcile'):
+                pass
+
+        clusters = [get_attributes(get_spans(document)[0])[
+            'memcached.cluster'] for document in tracer.buffer]
+        assert clusters == ['b', 'c']
+
+    def test_trace_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.json')
+            tracer = Tracer(sample_rate=1, path=path)
+            for name in ('a', 'b'):
+                with tracer.trace('reconcile', name, 'reconcile'):
+                    pass
+
+            with open(path) as trace_file:
+                documents = trace_file.read().splitlines()
+        assert len(documents) == 2
+        assert get_attributes(get_spans(documents[1])[0])[
+            'memcached.cluster'] == 'b'
+
+    def test_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.json')
+            self.tracer.configure(1, path, buffer_size=10)
+            with self.tracer.trace('reconcile', 'ns/a', 'reconcile'):
+                pass
+
+            assert os.path.exists(path) is False
+            assert self.tracer.dump() is True
+            with open(path) as trace_file:
+                documents = trace_file.read().splitlines()
+        assert documents == list(self.tracer.buffer)
+
+    @patch('memcached_operator.memcached_operator.tracing.logging')
+    def test_dump_error(self, mock_logging):
+        assert self.tracer.dump('/nonexistent/traces.json') is False
+        assert mock_logging.exception.called is True
+
+
+class TestPlanSpans():
+    def test_steps(self):
+        tracer = Tracer(sample_rate=1, buffer_size=10)
+        executor = ThreadPoolExecutor(2)
+        plan = Plan()
+        plan.add('svc/a', MagicMock(__name__='sync_service',
+                                    return_value=True))
+        plan.add('svc/b', MagicMock(__name__='sync_service',
+                                    return_value=False))
+
+        with patch('memcached_operator.memcached_operator.plan.TRACER',
+                   tracer):
+            with tracer.trace('reconcile', 'ns/a', 'reconcile'):
+                plan.run(executor)
+        executor.shutdown()
+
+        spans = dict((span['name'], span)
+                     for span in get_spans(tracer.buffer[0]))
+        assert sorted(spans) == ['reconcile', 'svc/a', 'svc/b']
+        attributes = get_attributes(spans['svc/b'])
+        assert attributes['memcached.verb'] == 'sync_service'
+        assert attributes['memcached.result'] == 'False'
+        assert float(attributes['memcached.wait']) >= 0
+        assert spans['svc/a']['parentSpanId'] == \
+            spans['reconcile']['spanId']
@@ -0,0 +1,130 @@
+from threading import Thread
+
+from ..memcached_operator.workqueue import (WorkQueue,
+                                            PRIORITY_URGENT,
+                                            PRIORITY_DRIFTED,
+                                            PRIORITY_RESYNC)
+
+
+class TestWorkQueue():
+    def setUp(self):
+        self.queue = WorkQueue(base_delay=0.01, max_delay=0.04)
+
+    def test_get_empty(self):
+        assert self.queue.get(timeout=0.01) is None
+
+    def test_fifo(self):
+        self.queue.add('ns/a')
+        self.queue.add('ns/b')
+
+        assert self.queue.get(timeout=0) == 'ns/a'
+        assert self.queue.get(timeout=0) == 'ns/b'
+
+    def test_deduplicates_pending(self):
+        self.queue.add('ns/a')
+        self.queue.add('ns/a')
+
+        assert len(self.queue) == 1
+        assert self.queue.get(timeout=0) == 'ns/a'
+        assert self.queue.get(timeout=0) is None
+
+    def test_single_writer(self):
+        self.queue.add('ns/a')
+        key = self.queue.get(timeout=0)
+
+        # Added again while processing, must not be handed out twice
+        self.queue.add('ns/a')
+        assert self.queue.get(timeout=0) is None
+
+        self.queue.done(key)
+        assert self.queue.get(timeout=0) == 'ns/a'
+
+    def test_done_without_readd(self):
+        self.queue.add('ns/a')
+        self.queue.done(self.queue.get(timeout=0))
+
+        assert self.queue.get(timeout=0) is None
+
+    def test_add_after(self):
+        self.queue.add_after('ns/a', 0.02)
+
+        assert self.queue.get(timeout=0) is None
+        assert self.queue.get(timeout=1) == 'ns/a'
+
+    def test_add_rate_limited_backoff(self):
+        self.queue.add_rate_limited('ns/a')
+        self.queue.add_rate_limited('ns/a')
+        self.queue.add_rate_limited('ns/a')
+        self.queue.add_rate_limited('ns/a')
+
+        assert self.queue.num_requeues('ns/a') == 4
+        waiting = sorted(w[0] for w in self.queue._waiting)
+        # 0.01, 0.02, 0.04 and capped at 0.04
+        assert round(waiting[3] - waiting[2], 2) == 0.0
+        assert round(waiting[1] - waiting[0], 2) == 0.01
+
+        assert self.queue.get(timeout=1) == 'ns/a'
+
+    def test_forget(self):
+        self.queue.add_rate_limited('ns/a')
+        self.queue.forget('ns/a')
+
+        assert self.queue.num_requeues('ns/a') == 0
+
+    def test_priorities(self):
+        self.queue.add('ns/a')
+        self.queue.add('ns/b', PRIORITY_DRIFTED)
+        self.queue.add('ns/c', PRIORITY_URGENT)
+        self.queue.add('ns/d', PRIORITY_URGENT)
+
+        keys = [self.queue.get(timeout=0) for _ in range(4)]
+
+        assert keys == ['ns/c', 'ns/d', 'ns/b', 'ns/a']
+
+    def test_raise_priority(self):
+        self.queue.add('ns/a')
+        self.queue.add('ns/b')
+        self.queue.add('ns/b', PRIORITY_URGENT)
+        # Lowering is ignored
+        self.queue.add('ns/b', PRIORITY_RESYNC)
+
+        assert len(self.queue) == 2
+        assert self.queue.get(timeout=0) == 'ns/b'
+        assert self.queue.get(timeout=0) == 'ns/a'
+        assert self.queue.get(timeout=0) is None
+
+    def test_priority_while_processing(self):
+        self.queue.add('ns/a')
+        self.queue.add('ns/b', PRIORITY_DRIFTED)
+        key = self.queue.get(timeout=0)
+        assert key == 'ns/b'
+        self.queue.add(key, PRIORITY_URGENT)
+
+        # Queued again ahead of the routine resync
+        self.queue.done(key)
+        assert self.queue.get(timeout=0) == 'ns/b'
+        assert self.queue.get(timeout=0) == 'ns/a'
+
+    def test_rate_limited_keeps_priority(self):
+        self.queue.add('ns/a', PRIORITY_URGENT)
+        key = self.queue.get(timeout=0)
+        self.queue.add_rate_limited(key)
+        self.queue.done(key)
+
+        assert self.queue._waiting[0][3] == PRIORITY_URGENT
+
+    def test_shut_down_wakes_getters(self):
+        results = []
+        getter = Thread(target=lambda: results.append(self.queue.get()))
+        getter.start()
+
+        self.queue.shut_down()
+        getter.join(1)
+
+        assert results == [None]
+
+    def test_no_add_after_shut_down(self):
+        self.queue.shut_down()
+        self.queue.add('ns/a')
+
+        assert len(self.queue) == 0